@@ -0,0 +1,96 @@
+import logging
+
+# requires: keys that are stored under a different name in recon.json
+REQUIREMENT_RECON_KEYS = {
+    "advertising_type": "type",
+}
+REQUIREMENT_KEYS = [
+    "advertising",
+    "advertising_type",
+    "connectable",
+    "pairable",
+    "vendor",
+    "lmp_features",
+    "ll_features",
+    "pairing_features",
+]
+
+
+def normalize(value):
+    if isinstance(value, str):
+        return value.strip().lower().replace(" ", "_").replace("-", "_")
+    return value
+
+
+def find_feature(features, name):
+    """
+    Looks up a feature flag in the recon features, which can be a list of
+    supported feature names or a (possibly paged) dictionary of flags.
+    Returns None if the feature is unknown.
+    """
+    name = normalize(name)
+    if isinstance(features, (list, tuple)):
+        return name in [normalize(feature) for feature in features]
+    if isinstance(features, dict):
+        for key, value in features.items():
+            if isinstance(value, dict):
+                found = find_feature(value, name)
+                if found is not None:
+                    return found
+            elif normalize(key) == name:
+                return bool(value)
+    return None
+
+
+def matches(expected, actual) -> bool:
+    if isinstance(expected, list):
+        return any(matches(option, actual) for option in expected)
+    if isinstance(expected, str) and isinstance(actual, str):
+        return normalize(expected) == normalize(actual)
+    return expected == actual
+
+
+def check_features(expected, features, key) -> list:
+    if isinstance(expected, list):
+        expected = {feature: True for feature in expected}
+    reasons = []
+    for feature, wanted in expected.items():
+        found = find_feature(features, feature)
+        if found is not None and found != bool(wanted):
+            state = "supported" if found else "not supported"
+            reasons.append(f"{key}.{feature} is {state}")
+    return reasons
+
+
+def check_requirements(requires: dict, recon_data: dict) -> list:
+    """
+    Evaluates the `requires` section of an exploit against recon.json.
+    Returns the reasons why the exploit is not applicable, an empty list means
+    the exploit applies. Values missing from the recon data never exclude an
+    exploit, only data that contradicts a requirement does.
+    """
+    if not requires or recon_data is None:
+        return []
+
+    reasons = []
+    for key, expected in requires.items():
+        if key not in REQUIREMENT_KEYS:
+            logging.warning(f"applicability -> unknown requirement {key}, ignoring")
+            continue
+        actual = recon_data.get(REQUIREMENT_RECON_KEYS.get(key, key))
+        if actual is None:
+            continue
+
+        if key in ("lmp_features", "ll_features"):
+            reasons += check_features(expected, actual, key)
+        elif key == "pairing_features":
+            if not isinstance(actual, dict):
+                continue
+            for name, wanted in expected.items():
+                value = actual.get(name)
+                if value is not None and not matches(wanted, value):
+                    reasons.append(f"pairing_features.{name} is {value}")
+        elif not matches(expected, actual):
+            reasons.append(f"{key} is {actual}")
+
+    return reasons
@@ -0,0 +1,289 @@
+"""
+Offline benchmark of bluekit's own overhead against simulated targets.
+
+    python3 -m bluekit.benchmark --output results.json --compare previous.json
+
+Every catalog size runs in its own process with a simulated BLUEKIT_HOME,
+since the installation paths are fixed when bluekit.constants is imported.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_TARGET = "aa:bb:cc:dd:ee:ff"
+CATALOG_SIZES = [40, 500, 5000]
+OUTPUT_SIZES = [1024, 64 * 1024, 1024**2, 16 * 1024**2, 500 * 1024**2]
+CAMPAIGN_PHASES = [
+    "check_target",
+    "execute_command",
+    "process_raw_data",
+    "dos_checker",
+    "pull_information",
+    "save_data",
+]
+
+
+def summarize(durations: list) -> dict:
+    if len(durations) == 0:
+        return {"count": 0}
+    ordered = sorted(durations)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "mean": statistics.mean(ordered),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": ordered[-1],
+    }
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.durations = {}
+
+    def record(self, phase: str, duration: float) -> None:
+        self.durations.setdefault(phase, []).append(duration)
+
+    def call(self, phase: str, function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    def wrap(self, owner, name: str, phase: str = None) -> None:
+        function = getattr(owner, name)
+        setattr(
+            owner,
+            name,
+            lambda *args, **kwargs: self.call(phase or name, function, *args, **kwargs),
+        )
+
+    def summary(self) -> dict:
+        return {
+            phase: summarize(durations) for phase, durations in self.durations.items()
+        }
+
+
+def run_campaign_scenario(sample: int) -> dict:
+    # Imported here, BLUEKIT_HOME has to be set before bluekit.constants is loaded
+    import bluekit.engine.engine as engine_module
+    from bluekit.bluekit import BlueKit
+    from bluekit.device import set_device_backend
+    from bluekit.simulator import SimulatedDevice
+
+    set_device_backend(SimulatedDevice)
+    timer = PhaseTimer()
+    bluekit = BlueKit(handle_signals=False)
+    bluekit.original_dir = tempfile.mkdtemp()
+
+    exploits = timer.call("catalog_load", bluekit.get_available_exploits)
+    bluekit.recon.run_recon(BENCHMARK_TARGET)
+    exploits = timer.call(
+        "exploit_filter", bluekit.exploit_filter, BENCHMARK_TARGET, exploits
+    )[:sample]
+
+    timer.wrap(bluekit, "check_target")
+    timer.wrap(bluekit.engine, "execute_command")
+    timer.wrap(bluekit.engine, "process_raw_data")
+    timer.wrap(bluekit.engine, "pull_information")
+    timer.wrap(bluekit.report, "save_data")
+    timer.wrap(engine_module, "dos_checker")
+
+    start = time.perf_counter()
+    bluekit.test_one_by_one(BENCHMARK_TARGET, [], exploits)
+    loop_time = time.perf_counter() - start
+    phase_time = sum(sum(timer.durations.get(phase, [])) for phase in CAMPAIGN_PHASES)
+    timer.record("loop_overhead", loop_time - phase_time)
+
+    timer.call("generate_report", bluekit.report.generate_report, BENCHMARK_TARGET)
+    per_exploit = loop_time / max(1, len(exploits))
+    return {
+        "exploits_run": len(exploits),
+        "campaign_seconds": loop_time,
+        "exploits_per_hour": 3600 / per_exploit if per_exploit > 0 else None,
+        "phases": timer.summary(),
+    }
+
+
+def run_output_scenario(sizes: list, repeat: int) -> dict:
+    from bluekit.engine.engine import Engine
+
+    engine = Engine()
+    results = {}
+    for size in sizes:
+        timer = PhaseTimer()
+        command = [
+            sys.executable,
+            "-m",
+            "bluekit.simulator",
+            "exploit",
+            f"--target {BENCHMARK_TARGET}",
+            "--delay 0",
+            f"--output-bytes {size}",
+        ]
+        for _ in range(repeat):
+            if_failed, data = timer.call(
+                "execute_command",
+                engine.execute_command,
+                BENCHMARK_TARGET,
+                command,
+                "benchmark_output",
+            )
+            timer.call("process_raw_data", engine.process_raw_data, data, if_failed)
+        results[str(size)] = timer.summary()
+    return results
+
+
+def run_child(args) -> None:
+    from bluekit.log import setup_logging
+
+    setup_logging()
+    if args.scenario == "campaign":
+        result = run_campaign_scenario(args.sample)
+    else:
+        result = run_output_scenario(args.sizes, args.repeat)
+    print("BENCHMARK RESULT " + json.dumps(result))
+
+
+def run_scenario_process(home: str, scenario: str, extra: list) -> dict:
+    env = dict(os.environ, BLUEKIT_HOME=home)
+    output = subprocess.run(
+        [sys.executable, "-m", "bluekit.benchmark", "child", scenario] + extra,
+        env=env,
+        cwd=home,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    for line in output.decode(errors="replace").splitlines():
+        if line.startswith("BENCHMARK RESULT "):
+            return json.loads(line[len("BENCHMARK RESULT ") :])
+    raise Exception(f"Benchmark {scenario} did not report a result")
+
+
+def create_home(catalog_size: int) -> str:
+    from bluekit.simulator import write_catalog
+
+    home = tempfile.mkdtemp(prefix=f"bluekit-benchmark-{catalog_size}-")
+    write_catalog(home, catalog_size, delay=0)
+    config = {
+        "seed": 1,
+        "defaults": {
+            "scan_latency": 0,
+            "connect_latency": 0,
+            "pair_latency": 0,
+            "reboot_time": 0,
+        },
+    }
+    with open(os.path.join(home, "simulator.json"), "w") as f:
+        json.dump(config, f)
+    return home
+
+
+def get_phases(scenario: dict) -> dict:
+    if "phases" in scenario:
+        return scenario["phases"]
+    # Output size scenarios are keyed by size first
+    return {
+        f"{size} B {phase}": stats
+        for size, size_phases in scenario.items()
+        for phase, stats in size_phases.items()
+    }
+
+
+def compare(current: dict, previous: dict) -> None:
+    print("\nComparison with previous results (mean, current / previous):")
+    for name, scenario in current["scenarios"].items():
+        old_scenario = previous.get("scenarios", {}).get(name)
+        if old_scenario is None:
+            continue
+        old_phases = get_phases(old_scenario)
+        for phase, stats in get_phases(scenario).items():
+            old_stats = old_phases.get(phase, {})
+            if stats.get("mean") and old_stats.get("mean"):
+                ratio = stats["mean"] / old_stats["mean"]
+                print(f"  {name:>14} {phase:<32} {ratio:6.2f}x")
+
+
+def print_results(results: dict) -> None:
+    for name, scenario in results["scenarios"].items():
+        if "exploits_per_hour" in scenario:
+            print(
+                f"\n{name}: {scenario['exploits_run']} exploits, {scenario['exploits_per_hour']:.0f} exploits/hour"
+            )
+        else:
+            print(f"\n{name}:")
+        for phase, stats in get_phases(scenario).items():
+            if stats.get("count"):
+                print(
+                    f"  {phase:<32} mean {stats['mean'] * 1000:9.2f} ms  p90 {stats['p90'] * 1000:9.2f} ms  max {stats['max'] * 1000:9.2f} ms"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bluekit overhead benchmark")
+    subparsers = parser.add_subparsers(dest="command")
+
+    child_parser = subparsers.add_parser("child")
+    child_parser.add_argument("scenario", choices=["campaign", "output"])
+    child_parser.add_argument("--sample", default=40, type=int)
+    child_parser.add_argument("--sizes", nargs="+", default=OUTPUT_SIZES, type=int)
+    child_parser.add_argument("--repeat", default=3, type=int)
+
+    parser.add_argument("--catalog-sizes", nargs="+", default=CATALOG_SIZES, type=int)
+    parser.add_argument(
+        "--sample", default=40, type=int, help="Exploits actually run per catalog"
+    )
+    parser.add_argument("--output-sizes", nargs="+", default=OUTPUT_SIZES, type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--output", default=f"benchmark-{int(time.time())}.json")
+    parser.add_argument("--compare", type=str, help="Previous results file")
+    args = parser.parse_args()
+
+    if args.command == "child":
+        run_child(args)
+        return
+
+    results = {
+        "timestamp": time.time(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "scenarios": {},
+    }
+    for catalog_size in args.catalog_sizes:
+        print(f"Running campaign benchmark with a catalog of {catalog_size} exploits")
+        results["scenarios"][f"catalog_{catalog_size}"] = run_scenario_process(
+            create_home(catalog_size), "campaign", ["--sample", str(args.sample)]
+        )
+    if len(args.output_sizes) > 0:
+        print(f"Running output size benchmark for {args.output_sizes} bytes")
+        results["scenarios"]["output_sizes"] = run_scenario_process(
+            create_home(0),
+            "output",
+            ["--repeat", str(args.repeat), "--sizes"]
+            + [str(size) for size in args.output_sizes],
+        )
+
+    print_results(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"\nResults saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,13 @@ import os
 import pkg_resources
 import sys
 import argparse
+import atexit
 import logging
 import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from tqdm import tqdm
 from pathlib import Path
@@ -15,25 +20,56 @@ from bluekit.constants import (
     TOOLKIT_BLUEEXPLOITER_INSTALLATION_DIRECTORY,
     TOOLKIT_INSTALLATION_DIRECTORY,
 )
-from bluekit.constants import LOG_FILE, OUTPUT_DIRECTORY, BLUING_BR_LMP
+from bluekit.constants import OUTPUT_DIRECTORY, BLUING_BR_LMP
+from bluekit.constants import COORDINATOR_PORT, DISCOVERY_DURATION
+from bluekit.constants import POLICY_PARK_DELAY, POLICY_PARK_ROUNDS
+from bluekit.constants import POLICY_UNATTENDED, POLICY_UNATTENDED_SINGLE
 from bluekit.factories.exploitfactory import ExploitFactory
 from bluekit.factories.hardwarefactory import HardwareFactory
 from bluekit.engine.engine import Engine
-from bluekit.verifyconn import check_device_status
+from bluekit.verifyconn import check_device_status, RETVAL_CONTROLLER_ERROR
 from bluekit.checkpoint import Checkpoint
+from bluekit.lease import LeaseTimeout
 from bluekit.setupverfication.setupverification import SetupVerifier
-from bluekit.recon import Recon, COMMANDS, load_recon_data
+from bluekit.setupverfication.hardwarepool import HardwarePool
+from bluekit.recon import Recon, COMMANDS, load_recon_data, load_recon_data_full
+from bluekit.applicability import check_requirements
 from bluekit.report import Report
+from bluekit.fleet import FleetReport
+from bluekit.discovery import Discovery
+from bluekit.watch import Watcher
+from bluekit.policy import FailurePolicy, record_decision, ASK, NEXT, PARK, RETRY, SKIP
+from bluekit import snapshot
+from bluekit.daemon import BlueKitDaemon, DaemonClient, QUEUED_ACTIONS
+from bluekit.distributed import Coordinator, Worker
+from bluekit.device import set_device_backend
+from bluekit.simulator import SimulatedDevice
+from bluekit.tracing import trace_campaign, span, print_trace_summary
+from bluekit import metrics
+from bluekit import profiling
+from bluekit.progress import CampaignProgress, DurationHistory
+from bluekit.log import setup_logging
 
 
 class BlueKit:
-    def __init__(self) -> None:
-        signal.signal(signal.SIGINT, self.bluekit_signal_handler)
+    def __init__(self, handle_signals=True) -> None:
+        if handle_signals:
+            signal.signal(signal.SIGINT, self.bluekit_signal_handler)
+        self.target_sessions = []
         self.done_exploits = []
         self.exclude_exploits = []
         self.exploits_to_scan = []
         self.target = None
         self.parameters = None
+        self.trace = False
+        self.progress_events = None  # JSON lines of campaign progress are appended here
+        self.pause_requested = threading.Event()  # checkpoint before the next exploit
+        self.paused = False
+        self.unattended = False  # never prompt, see get_failure_policy
+        self.resumes_parked = False  # a parked campaign is picked up again later
+        self.failure_policy = None  # FailurePolicy for an unavailable target
+        self.policy_decision = None  # set when check_target returns False
+        self.durations = DurationHistory()
         self.exploitFactory = ExploitFactory()
         self.hardwareFactory = HardwareFactory()
         self.engine = Engine()
@@ -44,7 +80,10 @@ class BlueKit:
 
     def bluekit_signal_handler(self, sig, frame):
         print("Ctrl+C detected. Creating a checkpoint and exiting")
-        self.preserve_state()
+        for session in self.target_sessions:
+            session.preserve_state()
+        if len(self.target_sessions) == 0 or self.target is not None:
+            self.preserve_state()
         os.chdir(CURRENT_DIRECTORY)
         sys.exit()
 
@@ -58,6 +97,27 @@ class BlueKit:
     def set_exploits(self, exploits_to_scan: list):
         self.exploits_to_scan = exploits_to_scan
 
+    def reset_state(self):
+        self.done_exploits = []
+        self.exclude_exploits = []
+        self.exploits_to_scan = []
+        self.target = None
+        self.parameters = None
+        self.pause_requested.clear()
+        self.paused = False
+        self.policy_decision = None
+
+    def select_exploits(self, hardware: list, exploits: list, exclude_exploits: list):
+        if len(hardware) > 0:
+            self.set_exploits_hardware(hardware)
+            logging.info("Provided --hardware parameter -> " + str(hardware))
+        elif len(exploits) > 0:
+            self.set_exploits(exploits)
+            logging.info("Provided --exploit parameter -> " + str(exploits))
+        elif len(exclude_exploits) > 0:  # scips --exclude if --exploits is provided
+            self.set_explude_exploits(exclude_exploits)
+            logging.info("Provided --exclude parameter -> " + str(exclude_exploits))
+
     def set_exploits_hardware(self, hardware: list):
         available_exploits = self.get_available_exploits()
         available_exploits = [
@@ -71,14 +131,16 @@ class BlueKit:
     def get_available_hardware(self):
         return self.hardwareFactory.get_all_hardware_profiles()
 
-    def check_setup(self):
-        available_hardware = self.get_available_hardware()
-        hardware_verfied = self.setupverifier.verify_setup_multiple_hardware(
-            available_hardware
+    def get_setup_status(self) -> dict:
+        return self.setupverifier.verify_setup_multiple_hardware(
+            self.get_available_hardware()
         )
+
+    def check_setup(self):
+        hardware_verfied = self.get_setup_status()
         print("Hardware availability:")
-        for hardware in available_hardware:
-            print(f"{hardware.name} - status - {hardware_verfied[hardware.name]}")
+        for name, status in hardware_verfied.items():
+            print(f"{name} - status - {status}")
 
     def get_exploits_with_setup(self):
         available_exploits = self.get_available_exploits()
@@ -100,6 +162,9 @@ class BlueKit:
         return [exploit for exploit in exploits if hardware_verfied[exploit.hardware]]
 
     def print_available_exploits(self):
+        print(self.get_available_exploits_table())
+
+    def get_available_exploits_table(self) -> str:
         available_exploits = self.get_available_exploits()
         available_hardware = self.get_available_hardware()
         hardware_verfied = self.setupverifier.verify_setup_multiple_hardware(
@@ -146,32 +211,111 @@ class BlueKit:
             tablefmt="pretty",
             colalign=("center", "left", "left", "left"),
         )
-        print(table)
+        return table
 
     def test_exploit(self, target, current_exploit, parameters) -> tuple:
         return self.engine.run_test(target, current_exploit, parameters)
 
     def test_one_by_one(self, target, parameters, exploits) -> None:
-        for i in tqdm(range(0, len(exploits), 1), desc="Testing exploits"):
-            self.check_target(target)
-            response_code, data = self.test_exploit(target, exploits[i], parameters)
-            # done TODO add results data to done_exploits
-            self.done_exploits.append([exploits[i].name, response_code, data])
-            logging.info(
-                "Blueexploiter.test_one_by_one -> done exploits - "
-                + str(self.done_exploits)
-            )
-            self.report.save_data(
-                exploit_name=exploits[i].name,
-                target=target,
-                data=data,
-                code=response_code,
+        metrics.exploits_pending.set(len(exploits), target=target)
+        progress = CampaignProgress(
+            target, exploits, self.durations, events_path=self.progress_events
+        )
+        self.engine.output_listener = progress.on_output
+        self.engine.event_listener = progress.on_exploit_event
+        skipped = 0
+        try:
+            for i in range(0, len(exploits), 1):
+                with span(exploits[i].name, "exploit", type=exploits[i].type) as args:
+                    with span("check_target"):
+                        available = self.check_target(target, exploits[i].name)
+                    if not available and self.policy_decision == SKIP:
+                        print(f"{target} is not available, skipping {exploits[i].name}")
+                        progress.skip_exploit(i)
+                        skipped += 1
+                        continue
+                    if not available:
+                        self.pause_campaign()
+                        break
+                    progress.start_exploit(i)
+                    with span("run_test"):
+                        try:
+                            response_code, data = self.test_exploit(
+                                target, exploits[i], parameters
+                            )
+                        except LeaseTimeout as e:
+                            # Left in the checkpoint like a skipped exploit
+                            print(f"{e}, skipping {exploits[i].name}")
+                            progress.skip_exploit(i)
+                            skipped += 1
+                            continue
+                    args["code"] = response_code
+                    # done TODO add results data to done_exploits
+                    self.done_exploits.append([exploits[i].name, response_code, data])
+                    # Only the new result, logging the whole list grows with every exploit
+                    logging.info(
+                        "Blueexploiter.test_one_by_one -> done exploits - %d, last - %s",
+                        len(self.done_exploits),
+                        self.done_exploits[-1],
+                    )
+                    with span("save_data"):
+                        self.report.save_data(
+                            exploit_name=exploits[i].name,
+                            target=target,
+                            data=data,
+                            code=response_code,
+                            resources=self.engine.last_resource_usage,
+                            findings=self.engine.last_output.findings,
+                            artifacts=self.engine.last_output.artifacts,
+                        )
+                    progress.finish_exploit(response_code)
+                metrics.exploits_pending.set(len(exploits) - i - 1, target=target)
+            else:
+                if skipped > 0:
+                    # Skipped exploits aren't done, --checkpoint runs them
+                    self.preserve_state()
+                # Only this campaign's results, the index also has older runs
+                done = [exploit[0] for exploit in self.done_exploits]
+                self.report.save_snapshot(
+                    target, done, done + [exploit.name for exploit in exploits]
+                )
+        finally:
+            self.engine.output_listener = None
+            self.engine.event_listener = None
+            progress.close()
+
+    def pause_campaign(self) -> None:
+        if self.resumes_parked and self.policy_decision != NEXT:
+            print(f"Pausing the campaign for {self.target}, it is resumed later")
+        else:
+            print(f"Pausing the campaign for {self.target}, --checkpoint continues it")
+        self.pause_requested.set()
+        self.paused = True
+        self.preserve_state()
+
+    def get_failure_policy(self) -> FailurePolicy:
+        policy = self.failure_policy
+        if policy is not None and (policy.action != ASK or not self.unattended):
+            return policy
+        if self.unattended or not sys.stdin.isatty():
+            # Nobody to ask, parking only helps where something resumes the campaign
+            return FailurePolicy.parse(
+                POLICY_UNATTENDED if self.resumes_parked else POLICY_UNATTENDED_SINGLE
             )
+        return FailurePolicy()
 
-    def check_target(self, target):
-        cont = True
-        while cont:
+    def check_target(self, target, exploit=None):
+        """
+        Probes the target up to 10 times, then the failure policy decides.
+        False with the decision in policy_decision if it wasn't to retry.
+        """
+        self.policy_decision = None
+        policy = self.get_failure_policy()
+        attempt = 0
+        while True:
             for _ in range(10):
+                if self.pause_requested.is_set():
+                    return False
                 status = check_device_status(target)
                 if status in (1, 4):
                     logging.info(
@@ -181,52 +325,69 @@ class BlueKit:
                     logging.info(
                         "Blueexploiter.check_target -> Device does not accept connections"
                     )
+                elif status == RETVAL_CONTROLLER_ERROR:
+                    logging.info(
+                        "Blueexploiter.check_target -> The local controller didn't answer"
+                    )
                 else:
                     return True
 
-            while True:
-                cmd = input(
-                    "Device is might not be available. Do you want to try again? (Y/n):"
-                )
-                if cmd.lower() == "y":
-                    logging.info("Trying to verify connectivity again")
-                    break
-                elif cmd.lower() == "n":
-                    logging.info("Backing up")
-                    self.preserve_state()
-                    sys.exit()
-                else:
-                    logging.info("Invalid input. Please enter 'Y' or 'n'.")
+            attempt += 1
+            decision, delay = policy.decide(attempt)
+            if decision == ASK:
+                decision = self.command_input()
+            record_decision(
+                target,
+                decision,
+                exploit=exploit,
+                policy=str(policy),
+                attempt=attempt,
+                delay=delay,
+            )
+            if decision != RETRY:
+                self.policy_decision = decision
+                return False
+            if delay > 0:
+                print(f"{target} is not available, trying again in {delay} s")
+            if self.pause_requested.wait(delay):
+                return False
 
-    def command_input(self) -> None:
-        command = input(
-            "The target device is not available. Try restoring the connectivity. After that enter 1 of the following commands: continue, backup:\n"
-        )
-        if command == "continue":
-            print("Trying to verify connectivity again")
-        elif command == "backup":
-            print("Backing up")
-            self.preserve_state()
-            raise SystemExit
-        else:
-            print("Didn't understand your input")
+    def command_input(self) -> str:
+        while True:
+            cmd = input(
+                "Device is might not be available. Do you want to try again? (Y/n):"
+            )
+            if cmd.lower() == "y":
+                logging.info("Trying to verify connectivity again")
+                return RETRY
+            elif cmd.lower() == "n":
+                logging.info("Backing up")
+                return NEXT
+            else:
+                logging.info("Invalid input. Please enter 'Y' or 'n'.")
 
     # Start testing from a checkpoint
     def start_from_a_checkpoint(self, target) -> None:
         if self.check_if_checkpoint(target):
-            exploit_pool = self.load_state(
-                target
-            )  # Maybe it would be wise to check whether the hardware is still available
+            with trace_campaign(target, enabled=self.trace):
+                exploit_pool = self.load_state(
+                    target
+                )  # Maybe it would be wise to check whether the hardware is still available
 
-            self.test_one_by_one(self.target, self.parameters, exploit_pool)
+                self.test_one_by_one(self.target, self.parameters, exploit_pool)
 
     # Start testing from a normal call (testing all exploits)
     def start_from_cli_all(self, target, parameters) -> None:
         logging.info(f"start_from_cli_all -> Target: {target}")
+        with trace_campaign(target, enabled=self.trace):
+            self.test_all_exploits(target, parameters)
+
+    def test_all_exploits(self, target, parameters) -> None:
         available_exploits = self.get_available_exploits()
-        exploits_with_setup = self.exploit_filter(
-            target=target, exploits=self.get_exploits_with_setup()
-        )
+        with span("exploit_filter"):
+            exploits_with_setup = self.exploit_filter(
+                target=target, exploits=self.get_exploits_with_setup()
+            )
 
         print(
             f"There are {len(exploits_with_setup)} out of {len(available_exploits)} exploits available.\n"
@@ -240,29 +401,99 @@ class BlueKit:
         self.target = target
         self.test_one_by_one(target, self.parameters, exploit_pool)
 
-    def exploit_filter(self, target, exploits) -> list:
-        # Check if recon files exist by attempting to get version
-        vendor, version, type = load_recon_data(target)
-        # version = self.recon.determine_bluetooth_version(target)
+    def enable_hardware_pool(self) -> None:
+        self.engine.hardware_pool = HardwarePool()
+        resources = self.engine.hardware_pool.discover()
+        for hardware, hardware_resources in resources.items():
+            print(f"{hardware} - {len(hardware_resources)} available")
 
-        # If version is None, it means recon files don't exist - run recon
-        if version is None:
-            print("Recon data not found. Running recon...")
-            self.recon.run_recon(target)
-            vendor, version, type = load_recon_data(target)
-            if version is None:
-                print(
-                    "Recon failed to get device information. Please ensure the device is available and try again."
-                )
-                return []
-        else:
-            # Get path to recon file for logging
-            recon_file = os.path.join(
-                OUTPUT_DIRECTORY.format(target=target, exploit="recon"),
-                "recon.json",
-            )
-            print(f"Recon data found - {recon_file}")
+    # A BlueKit for one target of a parallel campaign, sharing catalog and hardware
+    def new_target_session(self):
+        session = BlueKit(handle_signals=False)
+        session.exploitFactory = self.exploitFactory
+        session.hardwareFactory = self.hardwareFactory
+        session.setupverifier = self.setupverifier
+        session.engine.hardware_pool = self.engine.hardware_pool
+        session.engine.python_runner = self.engine.python_runner
+        session.trace = self.trace
+        session.failure_policy = self.failure_policy
+        session.unattended = True  # parallel sessions can't share the terminal
+        session.resumes_parked = True  # by start_from_cli_multiple or the watcher
+        session.progress_events = self.progress_events
+        session.engine.record_transcripts = self.engine.record_transcripts
+        session.engine.capture_hci = self.engine.capture_hci
+        session.durations = self.durations
+        session.original_dir = getattr(self, "original_dir", os.getcwd())
+        session.exploits_to_scan = list(self.exploits_to_scan)
+        session.exclude_exploits = list(self.exclude_exploits)
+        self.target_sessions.append(session)
+        return session
+
+    # Start testing several targets at once, sharing the hardware pool
+    def start_from_cli_multiple(self, targets, parameters) -> None:
+        if self.engine.hardware_pool is None:
+            self.enable_hardware_pool()
+        sessions = [(target, self.new_target_session()) for target in targets]
+
+        def run_session(target, session, resume=False):
+            try:
+                if resume:
+                    session.start_from_a_checkpoint(target)
+                else:
+                    session.start_from_cli_all(target, list(parameters))
+            except BaseException as e:  # sys.exit() in a session stops only that target
+                logging.exception(f"start_from_cli_multiple -> {target} stopped")
+                print(f"Testing {target} stopped - {e!r}")
+
+        with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+            for target, session in sessions:
+                pool.submit(run_session, target, session)
+
+        # Parked targets get another go once the others are done
+        for _ in range(POLICY_PARK_ROUNDS):
+            parked = [
+                (target, session)
+                for target, session in sessions
+                if session.paused and session.policy_decision == PARK
+            ]
+            if len(parked) == 0:
+                break
+            print(f"Resuming {len(parked)} parked targets in {POLICY_PARK_DELAY} s")
+            time.sleep(POLICY_PARK_DELAY)
+            with ThreadPoolExecutor(max_workers=len(parked)) as pool:
+                for target, session in parked:
+                    session.pause_requested.clear()
+                    session.paused = False
+                    pool.submit(run_session, target, session, True)
+
+    # Distribute the exploits for all targets over the workers connecting to us
+    def start_coordinator(self, address, targets, parameters) -> None:
+        exploits = self.get_selected_exploits(self.get_available_exploits())
+        coordinator = Coordinator(
+            Coordinator.create_jobs(targets, exploits, parameters), report=self.report
+        )
+        host, port = coordinator.start(*address)
+        print(
+            f"Coordinator listening on {host}:{port} with {coordinator.total} jobs for {len(targets)} targets"
+        )
+        try:
+            coordinator.wait()
+        finally:
+            coordinator.stop()
+        print("All jobs are done")
+
+    # Pull jobs from a coordinator and run them on the verified hardware of this node
+    def start_worker(self, address) -> None:
+        hardware = [
+            name for name, verified in self.get_setup_status().items() if verified
+        ]
+        self.unattended = True
+        worker = Worker(*address, socket.gethostname(), hardware, bluekit=self)
+        print(f"Worker with {hardware} connecting to {address[0]}:{address[1]}")
+        worker.run()
 
+    # Apply --exploits, --exclude and mass_testing to a list of exploits
+    def get_selected_exploits(self, exploits) -> list:
         logging.info(
             f"start_from_cli_all -> available exploit amount - {len(exploits)}"
         )
@@ -284,7 +515,32 @@ class BlueKit:
             f"start_from_cli_all -> available exploit again amount - {len(exploits)}"
         )
 
-        exploits = [exploit for exploit in exploits if exploit.mass_testing]
+        return [exploit for exploit in exploits if exploit.mass_testing]
+
+    def exploit_filter(self, target, exploits) -> list:
+        # Check if recon files exist by attempting to get version
+        vendor, version, type = load_recon_data(target)
+        # version = self.recon.determine_bluetooth_version(target)
+
+        # If version is None, it means recon files don't exist - run recon
+        if version is None:
+            print("Recon data not found. Running recon...")
+            self.recon.run_recon(target)
+            vendor, version, type = load_recon_data(target)
+            if version is None:
+                print(
+                    "Recon failed to get device information. Please ensure the device is available and try again."
+                )
+                return []
+        else:
+            # Get path to recon file for logging
+            recon_file = os.path.join(
+                OUTPUT_DIRECTORY.format(target=target, exploit="recon"),
+                "recon.json",
+            )
+            print(f"Recon data found - {recon_file}")
+
+        exploits = self.get_selected_exploits(exploits)
 
         if version is not None:
             logging.info(f"Target Bluetooth version: {version}")
@@ -297,7 +553,27 @@ class BlueKit:
             ]
             logging.info(f"Only {len(exploits)} exploits can be used")
 
-        return exploits
+        recon_data = load_recon_data_full(target)
+        not_applicable = {}
+        applicable_exploits = []
+        for exploit in exploits:
+            reasons = check_requirements(exploit.requires, recon_data)
+            if len(reasons) > 0:
+                not_applicable[exploit.name] = reasons
+            else:
+                applicable_exploits.append(exploit)
+        if len(not_applicable) > 0:
+            print(
+                f"Skipping {len(not_applicable)} exploits that are not applicable: {list(not_applicable)}"
+            )
+            logging.info(f"exploit_filter -> not applicable - {not_applicable}")
+        self.report.save_not_applicable(
+            target=target,
+            not_applicable=not_applicable,
+            checked=[exploit.name for exploit in exploits],
+        )
+
+        return applicable_exploits
 
     # Check whether a checkpoint exists
     def check_if_checkpoint(self, target) -> bool:
@@ -351,6 +627,50 @@ class BlueKit:
     def generate_machine_readable_report(self, target):
         self.report.generate_machine_readable_report(target=target)
 
+    # Compare two runs of a target, or the last two runs of every target
+    def print_run_diff(self, target, selectors):
+        if target is None:
+            print(snapshot.format_fleet_diff(snapshot.diff_fleet()))
+            return
+        if len(selectors) == 0:
+            selectors = ["-2", "-1"]
+        elif len(selectors) == 1:
+            selectors = [selectors[0], snapshot.CURRENT]
+        current = {
+            "exploits": self.report.read_index(target)["exploits"],
+            "recon": self.report.get_recon(target),
+        }
+        old_name, old = snapshot.select_snapshot(target, selectors[0], current)
+        new_name, new = snapshot.select_snapshot(target, selectors[1], current)
+        print(f"Changes of {target} from {old_name} to {new_name}:\n")
+        print(snapshot.format_diff(snapshot.diff_snapshots(old, new)))
+
+    # Aggregate report over every tested target, see bluekit.fleet
+    def generate_fleet_report(self):
+        fleet = FleetReport()
+        exploit_names = [e.name for e in self.exploitFactory.get_all_exploits()]
+        result = fleet.build(exploit_names)
+        print(fleet.format_summary(result["matrix"]))
+        print(
+            f"{result['targets']} targets, {result['read']} read since the last report, "
+            f"written to {fleet.output_directory}"
+        )
+
+    # One sweep over all local controllers, then recon of every new device
+    def discover(self, duration: float = DISCOVERY_DURATION):
+        discovery = Discovery()
+        print(f"Discovering devices with {', '.join(discovery.controllers)}")
+        devices = discovery.sweep(duration)
+        discovery.run_recon(devices)
+        print(discovery.format_devices(devices))
+        return devices
+
+    # Campaigns for allowlisted devices as they come into range, see bluekit.watch
+    def watch(self, patterns, parameters) -> None:
+        if self.engine.hardware_pool is None:
+            self.enable_hardware_pool()
+        Watcher(self, patterns, parameters).run()
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -386,7 +706,11 @@ def main():
         help="Start from a checkpoint",
     )
     parser.add_argument(
-        "-v", "--verbosity", required=False, type=str, help="Verbosity level"
+        "-v",
+        "--verbosity",
+        required=False,
+        type=str,
+        help="Log level, optionally per module, e.g. warning,bluekit.recon=debug",
     )
     parser.add_argument(
         "-ex",
@@ -423,6 +747,39 @@ def main():
         action="store_true",
         help="Create a report for a target device",
     )
+    parser.add_argument(
+        "-fr",
+        "--fleetreport",
+        required=False,
+        action="store_true",
+        help="Create an aggregate report over all tested targets in data/fleet",
+    )
+    parser.add_argument(
+        "-ds",
+        "--discover",
+        required=False,
+        nargs="?",
+        const=DISCOVERY_DURATION,
+        type=float,
+        metavar="SECONDS",
+        help="Scan with all local controllers and run recon on every new device",
+    )
+    parser.add_argument(
+        "-wa",
+        "--watch",
+        required=False,
+        nargs="+",
+        metavar="PATTERN",
+        help="Test devices matching these address/name patterns or allowlist files as they come into range",
+    )
+    parser.add_argument(
+        "-df",
+        "--diff",
+        required=False,
+        nargs="*",
+        type=str,
+        help="Compare runs of --target: none for the last two, OLD for OLD to current, or OLD NEW; a run is -1 (latest), a run-<date> prefix or current. Without --target the last two runs of all targets",
+    )
     parser.add_argument(
         "-hh",
         "--hardware",
@@ -432,10 +789,137 @@ def main():
         type=str,
         help="Scan only for provided exploits based on hardware --hardware hardware1 hardware2; --exclude and --exploit are not taken into account",
     )
+    parser.add_argument(
+        "-pf",
+        "--prefork",
+        required=False,
+        action="store_true",
+        help="Run python exploits in forked children of a preloaded interpreter, not with --multipletargets, --daemon or --watch",
+    )
+    parser.add_argument(
+        "-d",
+        "--daemon",
+        required=False,
+        action="store_true",
+        help="Run as a daemon accepting jobs on a local unix socket",
+    )
+    parser.add_argument(
+        "-nd",
+        "--nodaemon",
+        required=False,
+        action="store_true",
+        help="Run in this process even if a bluekit daemon is running",
+    )
+    parser.add_argument(
+        "-w",
+        "--wait",
+        required=False,
+        action="store_true",
+        help="Wait for a job submitted to the daemon to finish",
+    )
+    parser.add_argument(
+        "-mt",
+        "--multipletargets",
+        required=False,
+        nargs="+",
+        default=[],
+        type=str,
+        help="Test several target MAC addresses at once using all attached boards and phones",
+    )
+    parser.add_argument(
+        "-co",
+        "--coordinator",
+        required=False,
+        type=str,
+        help="Coordinate a campaign over workers on other nodes, listen on HOST:PORT",
+    )
+    parser.add_argument(
+        "-wo",
+        "--worker",
+        required=False,
+        type=str,
+        help="Run jobs of the coordinator at HOST:PORT on this node's hardware",
+    )
+    parser.add_argument(
+        "-sim",
+        "--simulate",
+        required=False,
+        action="store_true",
+        help="Use simulated targets instead of the local controller (see bluekit.simulator)",
+    )
+    parser.add_argument(
+        "-tr",
+        "--trace",
+        required=False,
+        action="store_true",
+        help="Record a Chrome trace of the campaign phases in the target directory",
+    )
+    parser.add_argument(
+        "-ts",
+        "--tracesummary",
+        required=False,
+        type=str,
+        help="Print the top time sinks of a trace file",
+    )
+    parser.add_argument(
+        "-mp",
+        "--metricsport",
+        required=False,
+        type=int,
+        help="Serve Prometheus metrics on this localhost port",
+    )
+    parser.add_argument(
+        "-mf",
+        "--metricsfile",
+        required=False,
+        type=str,
+        help="Write Prometheus metrics to this file at intervals",
+    )
+    parser.add_argument(
+        "-pe",
+        "--progressevents",
+        required=False,
+        type=str,
+        help="Append campaign progress with ETA to this file as JSON lines",
+    )
+    parser.add_argument(
+        "-pr",
+        "--profile",
+        required=False,
+        action="store_true",
+        help="Profile CPU time and allocations of each phase of this run, implies --nodaemon",
+    )
+    parser.add_argument(
+        "-rt",
+        "--recordtranscripts",
+        required=False,
+        action="store_true",
+        help="Record the timed output of every exploit for python -m bluekit.replay",
+    )
+    parser.add_argument(
+        "-hc",
+        "--capturehci",
+        required=False,
+        action="store_true",
+        help="Save an HCI trace (btsnoop) of every exploit with its output",
+    )
+    parser.add_argument(
+        "-fp",
+        "--failurepolicy",
+        required=False,
+        type=parse_failure_policy,
+        metavar="POLICY",
+        help=f"When the target is unavailable: ask, skip, park, next or retry[:RETRIES[:THEN]]; without a terminal {POLICY_UNATTENDED_SINGLE}, or {POLICY_UNATTENDED} for several targets",
+    )
     parser.add_argument("rest", nargs=argparse.REMAINDER)
     args = parser.parse_args()
+    if args.prefork and (len(args.multipletargets) > 0 or args.daemon or args.watch):
+        # Forking from several threads, see PythonRunner
+        parser.error(
+            "--prefork can't be combined with --multipletargets, --daemon or --watch"
+        )
 
-    logging.basicConfig(filename=LOG_FILE, level=logging.INFO)
+    setup_logging(args.verbosity)
     logging.info("Started")
 
     script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
@@ -450,27 +934,80 @@ def main():
 
     addition_parameters = args.rest  # maybe args.rest[1:] is needed, not sure.
 
+    if args.tracesummary:
+        print_trace_summary(args.tracesummary)
+        return
+
+    if args.simulate:
+        set_device_backend(SimulatedDevice)
+
     # Store original working directory
     original_dir = os.getcwd()
-    os.chdir(TOOLKIT_INSTALLATION_DIRECTORY)
-    blueExp = BlueKit()
-    # Pass original directory to BlueKit
-    blueExp.original_dir = original_dir
-    if args.listexploits:
+
+    if not runs_locally(args):
+        client = DaemonClient()
+        if client.is_running():
+            run_daemon_client(client, args, addition_parameters, original_dir)
+            return
+
+    start_metrics_exporters(args)
+
+    with profiling.profile_invocation(args.profile, args.target):
+        with profiling.phase("setup"):
+            os.chdir(TOOLKIT_INSTALLATION_DIRECTORY)
+            blueExp = BlueKit()
+            # Pass original directory to BlueKit
+            blueExp.original_dir = original_dir
+            blueExp.trace = args.trace
+            blueExp.failure_policy = args.failurepolicy
+            if args.progressevents:
+                blueExp.progress_events = os.path.abspath(args.progressevents)
+            blueExp.engine.record_transcripts = args.recordtranscripts
+            blueExp.engine.capture_hci = args.capturehci
+            if args.prefork:
+                blueExp.engine.enable_python_runner()
+        with profiling.phase(get_daemon_action(args) or "run"):
+            run_action(blueExp, args, addition_parameters, parser)
+
+    os.chdir(CURRENT_DIRECTORY)
+
+
+def run_action(blueExp, args, addition_parameters, parser) -> None:
+    if args.daemon:
+        BlueKitDaemon(blueExp).serve_forever()
+    elif args.listexploits:
         blueExp.print_available_exploits()
     elif args.checksetup:
         blueExp.check_setup()
+    elif args.fleetreport:
+        blueExp.generate_fleet_report()
+    elif args.discover is not None:
+        blueExp.discover(args.discover)
+    elif args.watch:
+        blueExp.select_exploits(args.hardware, args.exploits, args.excludeexploits)
+        blueExp.watch(args.watch, addition_parameters)
+    elif args.diff is not None:
+        blueExp.print_run_diff(
+            args.target.lower() if args.target else None, args.diff[:2]
+        )
+    elif args.worker:
+        blueExp.start_worker(parse_address(args.worker))
+    elif args.coordinator:
+        blueExp.select_exploits(args.hardware, args.exploits, args.excludeexploits)
+        targets = args.multipletargets if args.target is None else [args.target]
+        blueExp.start_coordinator(
+            parse_address(args.coordinator),
+            [target.lower() for target in targets],
+            addition_parameters,
+        )
+    elif len(args.multipletargets) > 0:
+        blueExp.select_exploits(args.hardware, args.exploits, args.excludeexploits)
+        blueExp.start_from_cli_multiple(
+            [target.lower() for target in args.multipletargets], addition_parameters
+        )
     elif args.target:
         target = args.target.lower()
-        if len(args.hardware) > 0:
-            blueExp.set_exploits_hardware(args.hardware)
-            logging.info("Provided --hardware parameter -> " + str(args.hardware))
-        elif len(args.exploits) > 0:
-            blueExp.set_exploits(args.exploits)
-            logging.info("Provided --exploit parameter -> " + str(args.exploits))
-        elif len(args.excludeexploits) > 0:  # scips --exclude if --exploits is provided
-            blueExp.set_explude_exploits(args.excludeexploits)
-            logging.info("Provided --exclude parameter -> " + str(args.excludeexploits))
+        blueExp.select_exploits(args.hardware, args.exploits, args.excludeexploits)
 
         if args.checktarget:
             blueExp.check_target(target)
@@ -488,7 +1025,135 @@ def main():
     else:
         parser.print_help()
 
-    os.chdir(CURRENT_DIRECTORY)
+
+def start_metrics_exporters(args) -> None:
+    if args.metricsport is not None:
+        server = metrics.start_http_exporter(args.metricsport)
+        print(
+            f"Serving metrics on http://{server.server_address[0]}:{args.metricsport}/metrics"
+        )
+    if args.metricsfile is not None:
+        writer = metrics.MetricsFileWriter(os.path.abspath(args.metricsfile))
+        writer.start()
+        atexit.register(writer.stop)  # final numbers, also after sys.exit()
+
+
+def parse_address(address: str) -> tuple:
+    host, _, port = address.rpartition(":")
+    if host == "":
+        return address, COORDINATOR_PORT
+    return host, int(port)
+
+
+def parse_failure_policy(spec: str) -> FailurePolicy:
+    try:
+        return FailurePolicy.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def runs_locally(args) -> bool:
+    """Whether this invocation can't be handed to a running daemon"""
+    return bool(
+        args.daemon
+        or args.nodaemon
+        or args.coordinator
+        or args.worker
+        or args.profile
+        or args.fleetreport
+        or args.discover is not None
+        or args.watch
+        or args.diff is not None
+        # Settings of this process the daemon's jobs can't take over
+        or args.simulate
+        or args.prefork
+        or args.metricsport is not None
+        or args.metricsfile is not None
+    )
+
+
+def get_daemon_action(args) -> str:
+    if args.listexploits:
+        return "list"
+    elif args.checksetup:
+        return "checksetup"
+    elif args.fleetreport:
+        return "fleetreport"
+    elif args.diff is not None:
+        return "diff"
+    elif not args.target:
+        return None
+    elif args.checktarget:
+        return "checktarget"
+    elif args.recon:
+        return "recon"
+    elif args.report:
+        return "report"
+    elif args.reportjson:
+        return "reportjson"
+    elif args.checkpoint:
+        return "checkpoint"
+    return "campaign"
+
+
+def get_daemon_job(args, action, target, addition_parameters, original_dir) -> dict:
+    return {
+        "action": action,
+        "target": target.lower() if target else None,
+        "parameters": addition_parameters,
+        "hardware": args.hardware,
+        "exploits": args.exploits,
+        "exclude_exploits": args.excludeexploits,
+        "original_dir": original_dir,
+        "trace": args.trace,
+        "progress_events": (
+            os.path.abspath(args.progressevents) if args.progressevents else None
+        ),
+        "record_transcripts": args.recordtranscripts,
+        "capture_hci": args.capturehci,
+        "failure_policy": (
+            str(args.failurepolicy) if args.failurepolicy is not None else None
+        ),
+    }
+
+
+def run_daemon_client(client, args, addition_parameters, original_dir) -> None:
+    if len(args.multipletargets) > 0:
+        for target in args.multipletargets:
+            job = client.submit(
+                get_daemon_job(
+                    args, "campaign", target, addition_parameters, original_dir
+                )
+            )
+            print(f"Job {job['job_id']} for {target} queued on the bluekit daemon")
+        return
+
+    action = get_daemon_action(args)
+    if action is None:
+        print("Provide a target or use --nodaemon")
+        return
+
+    job = client.submit(
+        get_daemon_job(args, action, args.target, addition_parameters, original_dir)
+    )
+    logging.info(f"Submitted job {job['job_id']} to the bluekit daemon")
+    if action in QUEUED_ACTIONS:
+        print(f"Job {job['job_id']} queued on the bluekit daemon")
+        if not args.wait:
+            return
+        job = client.wait(job["job_id"])
+
+    if job["status"] == "failed":
+        print(f"Job {job['job_id']} failed - {job['error']}")
+    elif action == "checksetup":
+        print("Hardware availability:")
+        for name, status in job["result"].items():
+            print(f"{name} - status - {status}")
+    elif action == "report":
+        print("\nReport for target device:\n")
+        print(job["result"])
+    elif job["result"] is not None:
+        print(job["result"])
 
 
 if __name__ == "__main__":
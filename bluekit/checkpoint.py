@@ -31,7 +31,7 @@ class Checkpoint:
             "exploits_to_scan": exploits_to_scan,
             "exclude_exploits": exclude_exploits,
         }
-        logging.debug("Checkpoint - preserve_state -> document -> " + str(doc))
+        logging.debug("Checkpoint - preserve_state -> document -> %s", doc)
         checkpoint = open(CHECKPOINT_PATH.format(target=target), "w")
         json.dump(doc, checkpoint, indent=6)
         checkpoint.close()
@@ -46,8 +46,8 @@ class Checkpoint:
         doc = json.load(checkpoint)
         logging.info("Checkpoint state loaded")
         logging.info(
-            "Checkpoint - load_state -> document done_exploits -> "
-            + str(doc["done_exploits"])
+            "Checkpoint - load_state -> document done_exploits -> %s",
+            doc["done_exploits"],
         )
         done_exploits_intermediate = [
             exploit[0] for exploit in doc["done_exploits"]
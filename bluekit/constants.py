@@ -8,6 +8,8 @@ BRAKTOOTH_HOME = (
 BRAKTOOTH_LOG_DIR = "/home/weil/Desktop/University/Thesis/toolkit/modules/tools/braktooth/wdissector/logs/Bluetooth/"
 BRAKTOOTH_CHECK_SETUP = "ls /dev/ttyUSB*"
 BRAKTOOTH_GET_EXPLOITS = "./bin/bt_exploiter --list-exploits"
+ESP32_DEFAULT_HOST_PORT = "/dev/ttyUSB1"  # host port hardcoded in the esp32 exploit commands
+ESP32_TTY_GLOB = "/dev/ttyUSB*"
 BRAKTOOTH_GENERIC_EXPLOIT = "./bin/bt_exploiter --host-port=/dev/ttyUSB1 --target={target} --exploit={exploit} --random_bdaddress"
 
 
@@ -17,6 +19,7 @@ RETURN_CODE_VULNERABLE = 2
 RETURN_CODE_UNDEFINED = 3
 RETURN_CODE_NONE_OF_4_STATE_OBSERVED = 4
 RETURN_CODE_NOT_TESTED = 5
+RETURN_CODE_NOT_APPLICABLE = 7
 
 
 TYPE_DOS = "DoS"
@@ -34,7 +37,8 @@ TYPE_MANUAL = "Manual"
 # OUTPUT_DIRECTORY = '/home/weil/Desktop/University/Thesis/data/tests/{target}/{exploit}/'
 
 
-TOOLKIT_INSTALLATION_DIRECTORY = "/usr/share/BlueToolkit"
+# BLUEKIT_HOME points bluekit at another installation, e.g. a simulator setup
+TOOLKIT_INSTALLATION_DIRECTORY = os.environ.get("BLUEKIT_HOME", "/usr/share/BlueToolkit")
 TOOLKIT_BLUEEXPLOITER_INSTALLATION_DIRECTORY = (
     TOOLKIT_INSTALLATION_DIRECTORY + "/bluekit"
 )
@@ -43,9 +47,25 @@ CHECKPOINT_PATH = (
 )
 OUTPUT_DIRECTORY = TOOLKIT_INSTALLATION_DIRECTORY + "/data/tests/{target}/{exploit}/"
 TARGET_DIRECTORY = TOOLKIT_INSTALLATION_DIRECTORY + "/data/tests/{target}/"
+TESTS_DIRECTORY = TOOLKIT_INSTALLATION_DIRECTORY + "/data/tests/"
+FLEET_DIRECTORY = TOOLKIT_INSTALLATION_DIRECTORY + "/data/fleet/"
 REPORT_OUTPUT_FILE = OUTPUT_DIRECTORY + "output_report.json"
+REPORT_INDEX_FILE = TARGET_DIRECTORY + "index.json"
+RUN_SNAPSHOT_DIRECTORY = TARGET_DIRECTORY + "runs/"
+TRANSCRIPT_FILE = TARGET_DIRECTORY + "transcripts/{exploit}-{timestamp}.jsonl"
 MACHINE_READABLE_REPORT_OUTPUT_FILE = TARGET_DIRECTORY + "whole-output.json"
+NOT_APPLICABLE_FILE = TARGET_DIRECTORY + "not_applicable.json"
+POLICY_EVENTS_FILE = TARGET_DIRECTORY + "events.jsonl"
+TRACE_FILE = TARGET_DIRECTORY + "traces/trace-{timestamp}.json"
+PROFILE_DIRECTORY = TARGET_DIRECTORY + "profiles/{timestamp}/"
+GLOBAL_PROFILE_DIRECTORY = TOOLKIT_INSTALLATION_DIRECTORY + "/data/profiles/{timestamp}/"
 LOG_FILE = TOOLKIT_INSTALLATION_DIRECTORY + "/.logs/application.log"
+DAEMON_SOCKET = TOOLKIT_INSTALLATION_DIRECTORY + "/.bluekit.sock"
+LEASE_DIRECTORY = TOOLKIT_INSTALLATION_DIRECTORY + "/.leases"
+SIMULATOR_CONFIG_FILE = TOOLKIT_INSTALLATION_DIRECTORY + "/simulator.json"
+SIMULATOR_STATE_FILE = TOOLKIT_INSTALLATION_DIRECTORY + "/.simulator_state.json"
+DURATION_HISTORY_FILE = TOOLKIT_INSTALLATION_DIRECTORY + "/data/durations.json"
+COORDINATOR_RESULTS_FILE = TOOLKIT_INSTALLATION_DIRECTORY + "/data/coordinator/results.jsonl"
 
 # Exploits and hardware directories
 EXPLOIT_DIRECTORY = TOOLKIT_INSTALLATION_DIRECTORY + "/exploits"
@@ -54,10 +74,61 @@ HARDWARE_DIRECTORY = TOOLKIT_INSTALLATION_DIRECTORY + "/hardware"
 
 CURRENT_DIRECTORY = os.getcwd()
 ADDITIONAL_RECON_DATA_FILE = "additional_data.log"
-SKIP_DIRECTORIES = ["recon"]  # skip these directories when getting exploit names
+SKIP_DIRECTORIES = [
+    "recon",
+    "traces",
+    "profiles",
+    "runs",
+    "transcripts",
+]  # skip these directories when getting exploit names
 
 
 TIMEOUT = 40
+# Characters of exploit output written to the log, outputs can be hundreds of MB
+LOGGED_OUTPUT_LIMIT = 4096
+DAEMON_SOCKET_TIMEOUT = 10
+HARDWARE_LEASE_TIMEOUT = 3600  # seconds to wait for a free board or phone
+HARDWARE_REDISCOVERY_INTERVAL = 30  # seconds between looks for hardware missing from the pool
+LOG_DEFAULT_LEVEL = "INFO"  # --verbosity overrides it, also per module
+LOG_MAX_BYTES = 20 * 1024 * 1024  # application.log is rotated at this size
+LOG_ROTATION_INTERVAL = 24 * 3600  # ... or after this many seconds
+LOG_BACKUP_COUNT = 10
+METRICS_HOST = "127.0.0.1"  # the metrics endpoint is only served locally
+METRICS_DUMP_INTERVAL = 15  # seconds between writes of --metricsfile
+DURATION_HISTORY_WEIGHT = 0.3  # weight of the newest run in an exploit's expected duration
+PROGRESS_UPDATE_INTERVAL = 1  # seconds between progress updates caused by exploit output
+OUTPUT_CHUNK_SIZE = 65536
+# Output of an exploit whose board couldn't be opened, pyserial's SerialException
+EXPLOIT_TRANSPORT_ERRORS = [b"could not open port"]
+PROCESS_EXIT_TIMEOUT = 5  # seconds a stopped exploit gets to exit before SIGKILL
+RESOURCE_SAMPLE_INTERVAL = 0.25  # seconds between samples of an exploit's process tree
+PROFILE_TOP_FUNCTIONS = 40  # functions listed per phase of --profile
+PROFILE_TOP_ALLOCATIONS = 25  # source lines listed per phase of --profile
+LEASE_TIMEOUT = 3600  # seconds to wait for a controller held by another job
+LEASE_POLL_INTERVAL = 0.5
+FLEET_WORKERS = os.cpu_count() or 1  # processes reading targets for --fleetreport
+DISCOVERY_DURATION = 15  # seconds a --discover sweep (inquiry and LE scan) may take
+WATCH_SWEEP_DURATION = 5  # seconds of each --watch sweep
+WATCH_SWEEP_INTERVAL = 2  # seconds between sweeps, campaigns get the controllers meanwhile
+WATCH_ABSENT_SWEEPS = 2  # sweeps a device is missed before its campaign is paused
+HCI_CAPTURE_RING_SIZE = 100000  # HCI packets kept in memory for --capturehci
+HCI_CAPTURE_FILE_NAME = "hci.btsnoop"  # per exploit, next to its output
+WATCHDOG_FAILURE_THRESHOLD = 3  # consecutive failures before a controller is checked
+WATCHDOG_COMMAND_TIMEOUT = 10  # seconds a recovery command may take
+WATCHDOG_SETTLE_TIME = 3  # seconds a controller gets to come back after a recovery step
+POLICY_UNATTENDED = "retry:3:park"  # --failurepolicy without a terminal to ask on
+POLICY_UNATTENDED_SINGLE = "retry:3:next"  # the same for a single target, nothing resumes it
+POLICY_RETRIES = 3  # unavailability rounds retried by retry before its fallback
+POLICY_BACKOFF = 30  # seconds before the first retry, doubled for every next one
+POLICY_MAX_BACKOFF = 600
+POLICY_PARK_ROUNDS = 3  # times a parked target is resumed after the other targets
+POLICY_PARK_DELAY = 300  # seconds before a parked target is resumed
+COORDINATOR_PORT = 7385
+COORDINATOR_HEARTBEAT_INTERVAL = 5
+COORDINATOR_WORKER_TIMEOUT = 30  # seconds without heartbeat before a worker's jobs are reassigned
+COORDINATOR_UNSCHEDULABLE_TIMEOUT = 600  # seconds a job may wait without any worker having its hardware
+SETUP_VERIFICATION_TTL = 60  # seconds a hardware check is reused if no device was (un)plugged
+SETUP_VERIFICATION_WATCH_PATHS = ["/dev", "/dev/bus/usb/*"]
 NUMBER_OF_DOS_TESTS = 10
 MAX_CHARS_DATA_TRUNCATION = 80
 MAX_NUMBER_OF_DOS_TEST_TO_FAIL = 5  # > 30 seconds reported as vulnerable
@@ -67,6 +138,20 @@ DOS_TEST_DATA_RETURN = "Down - {} , Unpairable - {}"
 DEFAULT_CONNECTOR = " "
 
 
+DEFAULT_ADAPTER = "hci0"
+# Resource leased for an exploit's hardware when no hardware pool is used
+HARDWARE_LEASE_RESOURCES = {
+    "default": DEFAULT_ADAPTER,
+    "esp32": ESP32_DEFAULT_HOST_PORT,
+}
+
+
+# Modules imported once by the pre-forked python exploit runner (--prefork)
+PYTHON_RUNNER_PRELOAD_MODULES = ["pybtool.device", "bluetooth", "scapy.all"]
+PYTHON_RUNNER_INTERPRETERS = ("python3", "python")
+PYTHON_RUNNER_SHELL_CHARACTERS = "|&;<>()$`*?"
+
+
 COMMAND_INFO = "hcitool info {target}"
 COMMAND_CONNECT = (
     TOOLKIT_BLUEEXPLOITER_INSTALLATION_DIRECTORY + "/bluekit/reconnect.sh {target}"
@@ -74,6 +159,13 @@ COMMAND_CONNECT = (
 REGEX_COMMAND_CONNECT = "Device {target} Connected: yes"
 
 
+BTMGMT_FIND = "btmgmt --index {index} find"
+BTMGMT_INFO = "btmgmt --index {index} info"
+BTMGMT_POWER = "btmgmt --index {index} power {state}"
+HCICONFIG_RESET = "hciconfig {adapter} reset"
+BLUETOOTH_CONTROLLERS_GLOB = "/sys/class/bluetooth/hci*"
+
+
 HCITOOL_INFO = ("hcitool info {target}", "hciinfo.log")
 SDPTOOL_INFO = ("sdptool browse {target}", "sdpinfo.log")
 BLUING_BR_SDP = ("bluing br --sdp {target}", "bluing_sdp.log")
@@ -83,11 +175,6 @@ REGEX_BT_VERSION_HCITOOL = "\(0x[0-f]{1}\) LMP Subversion:"
 REGEX_BT_MANUFACTURER = "Manufacturer name: .*\n"
 
 
-REGEX_EXPLOIT_OUTPUT_DATA = b"BLUEEXPLOITER DATA:.*\n"
-REGEX_EXPLOIT_OUTPUT_DATA_CODE = b" code=[0-4],"
-REGEX_EXPLOIT_OUTPUT_DATA_DATA = b", data=.*"
-
-
 VERSION_TABLE = {
     "0x0": 1.0,
     "0x1": 1.1,
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from bluekit.constants import DAEMON_SOCKET, DAEMON_SOCKET_TIMEOUT
+from bluekit.constants import POLICY_PARK_DELAY, POLICY_PARK_ROUNDS, POLICY_UNATTENDED
+from bluekit.policy import FailurePolicy, PARK
+from bluekit.report import Report
+
+# Jobs that drive the adapter or boards are queued and run one at a time,
+# everything else is answered directly from the warm exploit catalog while
+# a queued job may be running, so it must not change the shared BlueKit.
+QUEUED_ACTIONS = ["campaign", "checkpoint", "recon", "checktarget"]
+IMMEDIATE_ACTIONS = ["list", "checksetup", "report", "reportjson"]
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class Job:
+    def __init__(self, job_id: int, request: dict):
+        self.job_id = job_id
+        self.request = request
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_json(self):
+        return {
+            "job_id": self.job_id,
+            "request": self.request,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            response = self.server.daemon.handle_request(json.loads(line))
+        except Exception as e:
+            logging.exception("BlueKitDaemon -> error while handling a request")
+            response = {"status": "error", "error": str(e)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class BlueKitDaemon:
+    """
+    Keeps a BlueKit instance (exploit catalog, hardware profiles, engine)
+    loaded and accepts jobs as JSON lines over a unix socket.
+    """
+
+    def __init__(self, bluekit, socket_path: str = DAEMON_SOCKET):
+        self.bluekit = bluekit
+        self.socket_path = socket_path
+        self.jobs = {}
+        self.job_queue = queue.Queue()
+        self.next_job_id = 1
+        self.lock = threading.Lock()
+        self.server = None
+
+    def serve_forever(self) -> None:
+        if DaemonClient(self.socket_path).is_running():
+            raise Exception(f"A bluekit daemon is already listening on {self.socket_path}")
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        # Warm up the catalog once, every job reuses it
+        self.bluekit.get_available_exploits()
+        self.bluekit.get_available_hardware()
+
+        self.server = DaemonServer(self.socket_path, DaemonRequestHandler)
+        self.server.daemon = self
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self.worker, daemon=True).start()
+
+        print(f"bluekit daemon listening on {self.socket_path}")
+        logging.info(f"BlueKitDaemon -> listening on {self.socket_path}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self) -> None:
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def handle_request(self, request: dict) -> dict:
+        command = request.get("command")
+        if command == "ping":
+            return {"status": "ok", "pid": os.getpid()}
+        elif command == "submit":
+            job = self.submit(request["job"])
+            if job.request["action"] in IMMEDIATE_ACTIONS:
+                self.run_job(job)
+            return {"status": "ok", "job": job.to_json()}
+        elif command == "status":
+            with self.lock:
+                if request.get("job_id") is not None:
+                    job = self.jobs.get(request["job_id"])
+                    if job is None:
+                        return {"status": "error", "error": "Unknown job"}
+                    return {"status": "ok", "job": job.to_json()}
+                return {
+                    "status": "ok",
+                    "jobs": [job.to_json() for job in self.jobs.values()],
+                }
+        elif command == "shutdown":
+            self.shutdown()
+            return {"status": "ok"}
+        return {"status": "error", "error": f"Unknown command {command}"}
+
+    def submit(self, request: dict) -> Job:
+        action = request.get("action")
+        if action not in QUEUED_ACTIONS + IMMEDIATE_ACTIONS:
+            raise Exception(f"Unknown action {action}")
+        if action not in ("list", "checksetup") and not request.get("target"):
+            raise Exception(f"Action {action} requires a target")
+
+        with self.lock:
+            job = Job(self.next_job_id, request)
+            self.jobs[job.job_id] = job
+            self.next_job_id += 1
+        if action in QUEUED_ACTIONS:
+            self.job_queue.put(job)
+        logging.info(f"BlueKitDaemon -> job {job.job_id} submitted - {action}")
+        return job
+
+    def worker(self) -> None:
+        while True:
+            job = self.job_queue.get()
+            self.run_job(job)
+
+    def run_job(self, job: Job) -> None:
+        job.status = JOB_RUNNING
+        job.started = time.time()
+        try:
+            job.result = self.execute(job.request)
+            job.status = JOB_DONE
+        except BaseException as e:  # sys.exit() and input() failures end the job, not the daemon
+            logging.exception(f"BlueKitDaemon -> job {job.job_id} failed")
+            job.error = repr(e)
+            job.status = JOB_FAILED
+        job.finished = time.time()
+        logging.info(f"BlueKitDaemon -> job {job.job_id} {job.status}")
+
+    def execute(self, request: dict):
+        bluekit = self.bluekit
+        action = request["action"]
+
+        if action == "list":
+            return bluekit.get_available_exploits_table()
+        elif action == "checksetup":
+            return bluekit.get_setup_status()
+        elif action == "report":
+            return Report(bluekit).generate_report(target=request["target"])
+        elif action == "reportjson":
+            Report(bluekit).generate_machine_readable_report(
+                request["target"], request.get("original_dir", os.getcwd())
+            )
+            return None
+
+        target = request["target"]
+        bluekit.reset_state()
+        bluekit.trace = request.get("trace", False)
+        bluekit.progress_events = request.get("progress_events")
+        bluekit.engine.record_transcripts = request.get("record_transcripts", False)
+        bluekit.engine.capture_hci = request.get("capture_hci", False)
+        bluekit.failure_policy = FailurePolicy.parse(
+            request.get("failure_policy") or POLICY_UNATTENDED
+        )
+        bluekit.resumes_parked = True  # see requeue_parked
+        bluekit.select_exploits(
+            request.get("hardware", []),
+            request.get("exploits", []),
+            request.get("exclude_exploits", []),
+        )
+        if action == "campaign":
+            bluekit.start_from_cli_all(target, request.get("parameters", []))
+            self.requeue_parked(request)
+            return bluekit.done_exploits
+        elif action == "checkpoint":
+            bluekit.start_from_a_checkpoint(target)
+            self.requeue_parked(request)
+            return bluekit.done_exploits
+        elif action == "recon":
+            return bluekit.recon.run_recon(target)
+        elif action == "checktarget":
+            return bluekit.check_target(target)
+
+    def requeue_parked(self, request: dict) -> None:
+        """A parked campaign is resumed by a later job, the queue keeps going meanwhile"""
+        if not self.bluekit.paused or self.bluekit.policy_decision != PARK:
+            return
+        rounds = request.get("parked", 0)
+        if rounds >= POLICY_PARK_ROUNDS:
+            return
+        resume = {**request, "action": "checkpoint", "parked": rounds + 1}
+        timer = threading.Timer(POLICY_PARK_DELAY, self.submit, (resume,))
+        timer.daemon = True
+        timer.start()
+        logging.info(
+            f"BlueKitDaemon -> {request['target']} parked, resumed in {POLICY_PARK_DELAY} s"
+        )
+
+
+class DaemonClient:
+    def __init__(self, socket_path: str = DAEMON_SOCKET):
+        self.socket_path = socket_path
+
+    def request(self, doc: dict, timeout=DAEMON_SOCKET_TIMEOUT) -> dict:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(doc).encode() + b"\n")
+            response = b""
+            while not response.endswith(b"\n"):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+        return json.loads(response)
+
+    def is_running(self) -> bool:
+        if not os.path.exists(self.socket_path):
+            return False
+        try:
+            return self.request({"command": "ping"})["status"] == "ok"
+        except (OSError, ValueError):
+            return False
+
+    def submit(self, job: dict) -> dict:
+        # Immediate actions are executed while the request is open
+        response = self.request({"command": "submit", "job": job}, timeout=None)
+        if response["status"] != "ok":
+            raise Exception(response["error"])
+        return response["job"]
+
+    def status(self, job_id=None) -> dict:
+        return self.request({"command": "status", "job_id": job_id})
+
+    def wait(self, job_id: int, interval: float = 2) -> dict:
+        while True:
+            job = self.status(job_id)["job"]
+            if job["status"] in (JOB_DONE, JOB_FAILED):
+                return job
+            time.sleep(interval)
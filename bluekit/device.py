@@ -0,0 +1,23 @@
+try:
+    from pybtool.device import Device
+except ImportError:  # hardware-free setups only have the simulator backend
+    Device = None
+
+
+# Class used by recon and verifyconn to talk to the local controller,
+# replaced by set_device_backend() (e.g. with the simulator)
+device_backend = Device
+
+# What a controller that doesn't answer raises, pybtool's HCI socket fails with OSError
+DEVICE_ERRORS = (OSError,)
+
+
+def set_device_backend(backend) -> None:
+    global device_backend
+    device_backend = backend
+
+
+def new_device(dev_id: int = 0):
+    if device_backend is None:
+        raise Exception("pybtool is not installed, run with --simulate or install it")
+    return device_backend(dev_id)
@@ -0,0 +1,197 @@
+import glob
+import logging
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tabulate import tabulate
+
+from bluekit import device
+from bluekit.constants import (
+    BLUETOOTH_CONTROLLERS_GLOB,
+    BTMGMT_FIND,
+    DEFAULT_ADAPTER,
+    DISCOVERY_DURATION,
+)
+from bluekit.lease import leases
+from bluekit.recon import Recon, get_dev_id, has_recon_data
+
+# hci0 dev_found: 40:4E:36:12:34:56 type LE Random rssi -82 flags 0x0000
+DEVICE_FOUND = re.compile(
+    r"hci\d+ dev_found: ([0-9A-Fa-f:]{17}) type (.+?) rssi (-?\d+)"
+)
+DEVICE_NAME = re.compile(r"^\s*name (.+)$")
+LE_ONLY_TYPES = ("LE Random", "LE Public")  # no BR/EDR to run recon over
+
+
+def list_controllers() -> list:
+    names = [os.path.basename(path) for path in glob.glob(BLUETOOTH_CONTROLLERS_GLOB)]
+    # hci0:256 entries are connections, not controllers
+    controllers = [name for name in names if re.fullmatch(r"hci\d+", name)]
+    return sorted(controllers, key=get_dev_id) or [DEFAULT_ADAPTER]
+
+
+def parse_btmgmt_find(output: str) -> list:
+    found = []
+    for line in output.split("\n"):
+        match = DEVICE_FOUND.search(line)
+        if match is not None:
+            found.append(
+                {
+                    "address": match.group(1).lower(),
+                    "type": match.group(2),
+                    "rssi": int(match.group(3)),
+                    "name": None,
+                }
+            )
+            continue
+        match = DEVICE_NAME.match(line)
+        if match is not None and len(found) > 0:
+            found[-1]["name"] = match.group(1).strip()
+    return found
+
+
+def btmgmt_find(controller: str, duration: float = DISCOVERY_DURATION) -> list:
+    """Interleaved BR/EDR inquiry and LE scan on one controller"""
+    command = BTMGMT_FIND.format(index=get_dev_id(controller))
+    try:
+        output = subprocess.run(
+            command, shell=True, capture_output=True, timeout=duration
+        ).stdout
+    except subprocess.TimeoutExpired as e:
+        output = e.stdout or b""  # whatever was found until then
+    return parse_btmgmt_find(output.decode(errors="replace"))
+
+
+def find_devices(controller: str, duration: float = DISCOVERY_DURATION) -> list:
+    backend = device.device_backend
+    if backend is not None and hasattr(backend, "find"):
+        # The simulator answers discovery itself
+        return backend(get_dev_id(controller)).find(duration)
+    return btmgmt_find(controller, duration)
+
+
+def merge_sightings(sightings: list) -> dict:
+    """One entry per address with the strongest RSSI and every controller that saw it"""
+    devices = {}
+    for sighting in sightings:
+        known = devices.get(sighting["address"])
+        if known is None:
+            devices[sighting["address"]] = {
+                **sighting,
+                "controllers": [sighting["controller"]],
+            }
+            continue
+        if sighting["controller"] not in known["controllers"]:
+            known["controllers"].append(sighting["controller"])
+        if sighting["rssi"] > known["rssi"]:
+            known["rssi"] = sighting["rssi"]
+            # A dual mode device stays BR/EDR even if its LE advertising is louder
+            if sighting["type"] not in LE_ONLY_TYPES:
+                known["type"] = sighting["type"]
+        elif known["type"] in LE_ONLY_TYPES:
+            known["type"] = sighting["type"]
+        if known["name"] is None:
+            known["name"] = sighting["name"]
+    return devices
+
+
+class Discovery:
+    """
+    Sweeps all local controllers at once and runs recon on every device
+    found that has no recon data yet. Each recon worker holds one controller,
+    so there are never more recons in flight than radios.
+    """
+
+    def __init__(self, controllers: list = None, recon: Recon = None):
+        self.controllers = controllers or list_controllers()
+        self.recon = recon or Recon()
+        self.swept = []  # controllers of the last sweep
+
+    def sweep(self, duration: float = DISCOVERY_DURATION, wait: bool = True) -> dict:
+        """Without wait, controllers in use by another job are left out"""
+        sightings = []
+        swept = []
+        lock = threading.Lock()
+
+        def scan(controller):
+            if wait:
+                leases.acquire(controller)
+            elif not leases.try_acquire(controller):
+                return
+            try:
+                found = find_devices(controller, duration)
+            finally:
+                leases.release(controller)
+            logging.info(
+                "Discovery.sweep -> %s found %d devices", controller, len(found)
+            )
+            with lock:
+                swept.append(controller)
+                sightings.extend({**f, "controller": controller} for f in found)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(self.controllers)) as pool:
+            list(pool.map(scan, self.controllers))
+        self.swept = swept
+        devices = merge_sightings(sightings)
+        logging.info(
+            "Discovery.sweep -> %d devices in %.1f s",
+            len(devices),
+            time.monotonic() - started,
+        )
+        return devices
+
+    def run_recon(self, devices: dict, force: bool = False) -> None:
+        """Sets "recon" of every device to cached, done, failed or le_only"""
+        free = queue.Queue()
+        for controller in self.controllers:
+            free.put(controller)
+
+        def recon(entry):
+            controller = free.get()
+            try:
+                if self.recon.run_recon(entry["address"], adapter=controller):
+                    entry["recon"] = "done"
+                else:
+                    entry["recon"] = "failed"
+            except Exception as e:
+                logging.error("Discovery.run_recon -> %s: %s", entry["address"], e)
+                entry["recon"] = "failed"
+            finally:
+                free.put(controller)
+
+        pending = []
+        for entry in devices.values():
+            if entry["type"] in LE_ONLY_TYPES:
+                entry["recon"] = "le_only"
+            elif not force and has_recon_data(entry["address"]):
+                entry["recon"] = "cached"
+            else:
+                pending.append(entry)
+        with ThreadPoolExecutor(max_workers=len(self.controllers)) as pool:
+            list(pool.map(recon, pending))
+
+    @staticmethod
+    def format_devices(devices: dict) -> str:
+        rows = [
+            [
+                entry["address"],
+                entry["type"],
+                entry["rssi"],
+                entry["name"] or "",
+                ", ".join(entry["controllers"]),
+                entry.get("recon", ""),
+            ]
+            for entry in sorted(devices.values(), key=lambda e: -e["rssi"])
+        ]
+        return tabulate(
+            rows,
+            ["Address", "Type", "RSSI", "Name", "Seen by", "Recon"],
+            tablefmt="pretty",
+            colalign=("left", "left", "right", "left", "left", "left"),
+        )
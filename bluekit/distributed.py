@@ -0,0 +1,355 @@
+import json
+import logging
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from bluekit.constants import (
+    COORDINATOR_HEARTBEAT_INTERVAL,
+    COORDINATOR_RESULTS_FILE,
+    COORDINATOR_UNSCHEDULABLE_TIMEOUT,
+    COORDINATOR_WORKER_TIMEOUT,
+    OUTPUT_DIRECTORY,
+    RETURN_CODE_ERROR,
+)
+
+
+class CoordinatorRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            response = self.server.coordinator.handle_request(json.loads(line))
+        except Exception as e:
+            logging.exception("Coordinator -> error while handling a request")
+            response = {"status": "error", "error": str(e)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class CoordinatorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Coordinator:
+    """
+    Hands out (target, exploit) jobs to workers on other test nodes. Workers
+    pull one job at a time, so idle nodes take the next job as soon as they
+    are free and only get exploits for hardware they verified. A target is
+    only tested by one worker at a time, and jobs of a worker that stops
+    sending heartbeats go back to the front of the queue. A job that no
+    live worker has the hardware for during COORDINATOR_UNSCHEDULABLE_TIMEOUT
+    fails as unschedulable.
+    """
+
+    def __init__(
+        self, jobs: list, report=None, results_file: str = COORDINATOR_RESULTS_FILE
+    ):
+        self.pending = deque()
+        for job_id, job in enumerate(jobs, start=1):
+            self.pending.append(dict(job, job_id=job_id))
+        self.total = len(self.pending)
+        self.assigned = {}  # job_id -> (worker_id, job)
+        self.unschedulable_since = {}  # job_id -> time no live worker could take it
+        self.results = {}
+        self.workers = {}
+        self.next_worker_id = 1
+        self.report = report
+        self.results_file = results_file
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.server = None
+
+    @staticmethod
+    def create_jobs(targets: list, exploits: list, parameters: list) -> list:
+        return [
+            {
+                "target": target,
+                "exploit": exploit.name,
+                "hardware": exploit.hardware,
+                "parameters": parameters,
+            }
+            for target in targets
+            for exploit in exploits
+        ]
+
+    def start(self, host: str, port: int) -> tuple:
+        self.server = CoordinatorServer((host, port), CoordinatorRequestHandler)
+        self.server.coordinator = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.monitor_workers, daemon=True).start()
+        logging.info(f"Coordinator -> listening on {self.server.server_address}")
+        return self.server.server_address
+
+    def wait(self) -> dict:
+        self.finished.wait()
+        return self.results
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handle_request(self, request: dict) -> dict:
+        command = request.get("command")
+        with self.lock:
+            if command == "register":
+                return self.register(request)
+            worker = self.workers.get(request.get("worker_id"))
+            if worker is None:
+                return {"status": "error", "error": "Unknown worker, register again"}
+            worker["last_seen"] = time.monotonic()
+            worker["alive"] = True
+            if command == "heartbeat":
+                return {"status": "ok"}
+            elif command == "pull":
+                return self.pull(request["worker_id"], worker)
+            elif command == "result":
+                return self.store_result(request, worker)
+        return {"status": "error", "error": f"Unknown command {command}"}
+
+    def register(self, request: dict) -> dict:
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        self.workers[worker_id] = {
+            "name": request.get("name", str(worker_id)),
+            "hardware": request.get("hardware", []),
+            "last_seen": time.monotonic(),
+            "alive": True,
+        }
+        logging.info(f"Coordinator -> registered worker {self.workers[worker_id]}")
+        print(
+            f"Worker {self.workers[worker_id]['name']} joined with {request.get('hardware')}"
+        )
+        return {"status": "ok", "worker_id": worker_id}
+
+    def pull(self, worker_id: int, worker: dict) -> dict:
+        busy_targets = {job["target"] for _, job in self.assigned.values()}
+        for job in self.pending:
+            if (
+                job["hardware"] in worker["hardware"]
+                and job["target"] not in busy_targets
+            ):
+                self.pending.remove(job)
+                self.assigned[job["job_id"]] = (worker_id, job)
+                logging.info(f"Coordinator -> job {job['job_id']} to {worker['name']}")
+                return {"status": "ok", "job": job, "done": False}
+        return {"status": "ok", "job": None, "done": self.finished.is_set()}
+
+    def store_result(self, request: dict, worker: dict) -> dict:
+        job_id = request["job_id"]
+        if job_id in self.results:
+            return {"status": "ok"}  # late result of a reassigned job
+        job = self.assigned.pop(job_id, (None, None))[1]
+        if job is None:
+            job = next((job for job in self.pending if job["job_id"] == job_id), None)
+            if job is None:
+                return {"status": "error", "error": f"Unknown job {job_id}"}
+            self.pending.remove(job)
+
+        self.finish_job(
+            job,
+            worker=worker["name"],
+            code=request.get("code"),
+            data=request.get("data"),
+            resources=request.get("resources"),
+            findings=request.get("findings"),
+            artifacts=request.get("artifacts"),
+            skipped=request.get("skipped", False),
+        )
+        return {"status": "ok"}
+
+    def finish_job(self, job: dict, **result) -> None:
+        result = dict(job, **result, finished_at=time.time())
+        self.results[job["job_id"]] = result
+        self.save_result(result)
+        print(
+            f"[{len(self.results)}/{self.total}] {job['target']} {job['exploit']} -> {result['code']} ({result['worker']})"
+        )
+        if len(self.results) == self.total:
+            self.finished.set()
+
+    def save_result(self, result: dict) -> None:
+        Path(self.results_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.results_file, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        if self.report is not None and not result["skipped"]:
+            Path(
+                OUTPUT_DIRECTORY.format(
+                    target=result["target"], exploit=result["exploit"]
+                )
+            ).mkdir(parents=True, exist_ok=True)
+            self.report.save_data(
+                exploit_name=result["exploit"],
+                target=result["target"],
+                data=result["data"],
+                code=result["code"],
+                resources=result.get("resources"),
+                findings=result.get("findings"),
+                artifacts=result.get("artifacts"),
+            )
+
+    def monitor_workers(self) -> None:
+        while not self.finished.is_set():
+            time.sleep(COORDINATOR_HEARTBEAT_INTERVAL)
+            with self.lock:
+                now = time.monotonic()
+                for worker_id, worker in self.workers.items():
+                    if (
+                        not worker["alive"]
+                        or now - worker["last_seen"] < COORDINATOR_WORKER_TIMEOUT
+                    ):
+                        continue
+                    worker["alive"] = False
+                    print(
+                        f"Worker {worker['name']} is not responding, reassigning its jobs"
+                    )
+                    for job_id, (owner, job) in list(self.assigned.items()):
+                        if owner == worker_id:
+                            del self.assigned[job_id]
+                            self.pending.appendleft(job)
+                self.fail_unschedulable(now)
+
+    def fail_unschedulable(self, now: float) -> None:
+        hardware = {
+            name
+            for worker in self.workers.values()
+            if worker["alive"]
+            for name in worker["hardware"]
+        }
+        for job in list(self.pending):
+            if job["hardware"] in hardware:
+                self.unschedulable_since.pop(job["job_id"], None)
+                continue
+            since = self.unschedulable_since.setdefault(job["job_id"], now)
+            if now - since < COORDINATOR_UNSCHEDULABLE_TIMEOUT:
+                continue
+            self.pending.remove(job)
+            self.finish_job(
+                job,
+                worker=None,
+                code=None,
+                data=f"Unschedulable, no worker with {job['hardware']} hardware",
+                skipped=True,
+            )
+
+
+class Worker:
+    """
+    Runs jobs pulled from a Coordinator on the hardware of this node.
+    `execute` gets a job and returns (code, data), optionally followed by a
+    dict of report details, or None when the exploit doesn't apply to the
+    target; by default it runs the exploit with BlueKit. Reports are only
+    saved by the coordinator.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        name: str,
+        hardware: list,
+        execute=None,
+        bluekit=None,
+    ):
+        self.address = (host, port)
+        self.name = name
+        self.hardware = hardware
+        self.bluekit = bluekit
+        self.execute = execute if execute is not None else self.run_exploit
+        self.worker_id = None
+        self.stopped = threading.Event()
+
+    def request(self, doc: dict) -> dict:
+        if self.worker_id is not None:
+            doc = dict(doc, worker_id=self.worker_id)
+        with socket.create_connection(
+            self.address, timeout=COORDINATOR_WORKER_TIMEOUT
+        ) as sock:
+            sock.sendall(json.dumps(doc).encode() + b"\n")
+            response = b""
+            while not response.endswith(b"\n"):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+        return json.loads(response)
+
+    def register(self) -> None:
+        self.worker_id = None
+        response = self.request(
+            {"command": "register", "name": self.name, "hardware": self.hardware}
+        )
+        self.worker_id = response["worker_id"]
+
+    def heartbeat(self) -> None:
+        while not self.stopped.wait(COORDINATOR_HEARTBEAT_INTERVAL):
+            try:
+                self.request({"command": "heartbeat"})
+            except OSError as e:
+                logging.info(f"Worker -> heartbeat failed - {e}")
+
+    def run(self) -> None:
+        self.register()
+        threading.Thread(target=self.heartbeat, daemon=True).start()
+        try:
+            while not self.stopped.is_set():
+                response = self.request({"command": "pull"})
+                if response["status"] != "ok":
+                    self.register()
+                    continue
+                job = response["job"]
+                if job is None:
+                    if response["done"]:
+                        break
+                    time.sleep(COORDINATOR_HEARTBEAT_INTERVAL)
+                    continue
+
+                try:
+                    result = self.execute(job)
+                except Exception as e:
+                    logging.exception(f"Worker -> job {job['job_id']} failed")
+                    result = (RETURN_CODE_ERROR, str(e))
+                if result is None:
+                    self.request(
+                        {"command": "result", "job_id": job["job_id"], "skipped": True}
+                    )
+                else:
+                    # The coordinator saves the report, details go along with it
+                    code, data, *details = result
+                    request = {
+                        "command": "result",
+                        "job_id": job["job_id"],
+                        "code": code,
+                        "data": data,
+                    }
+                    if details:
+                        request.update(details[0])
+                    self.request(request)
+        finally:
+            self.stopped.set()
+
+    def run_exploit(self, job: dict):
+        bluekit = self.bluekit
+        exploits = [
+            exploit
+            for exploit in bluekit.get_available_exploits()
+            if exploit.name == job["exploit"]
+        ]
+        exploits = bluekit.exploit_filter(target=job["target"], exploits=exploits)
+        if len(exploits) == 0:
+            return None
+        if not bluekit.check_target(job["target"], job["exploit"]):
+            return None  # reported as skipped, the decision is in events.jsonl
+        code, data = bluekit.test_exploit(job["target"], exploits[0], job["parameters"])
+        return (
+            code,
+            data,
+            {
+                "resources": bluekit.engine.last_resource_usage,
+                "findings": bluekit.engine.last_output.findings,
+                "artifacts": bluekit.engine.last_output.artifacts,
+            },
+        )
@@ -7,6 +7,8 @@ import re
 import psutil
 import subprocess
 import signal
+import select
+from contextlib import ExitStack, contextmanager
 
 sys.path.append("..")
 
@@ -17,9 +19,17 @@ from bluekit.constants import (
     TIMEOUT,
     OUTPUT_DIRECTORY,
     DEFAULT_CONNECTOR,
+    DEFAULT_ADAPTER,
     TOOLKIT_INSTALLATION_DIRECTORY,
     TYPE_DOS,
-    REGEX_EXPLOIT_OUTPUT_DATA,
+    HARDWARE_LEASE_TIMEOUT,
+    HARDWARE_LEASE_RESOURCES,
+    LOGGED_OUTPUT_LIMIT,
+    OUTPUT_CHUNK_SIZE,
+    PROCESS_EXIT_TIMEOUT,
+    EXPLOIT_TRANSPORT_ERRORS,
+    TRANSCRIPT_FILE,
+    HCI_CAPTURE_FILE_NAME,
 )
 from bluekit.constants import (
     RETURN_CODE_ERROR,
@@ -28,11 +38,23 @@ from bluekit.constants import (
     RETURN_CODE_NOT_VULNERABLE,
     RETURN_CODE_VULNERABLE,
 )
-from bluekit.constants import (
-    REGEX_EXPLOIT_OUTPUT_DATA_DATA,
-    REGEX_EXPLOIT_OUTPUT_DATA_CODE,
-)
 from bluekit.verifyconn import dos_checker
+from bluekit.recon import get_dev_id
+from bluekit.engine.pythonrunner import PythonRunner
+from bluekit.engine.resources import ResourceMonitor
+from bluekit.engine.transcript import Transcript
+from bluekit.hcimonitor import monitor
+from bluekit.watchdog import watchdog
+from bluekit.protocol import OutputParser
+from bluekit.lease import leases
+from bluekit.tracing import span
+from bluekit import metrics
+
+
+def get_resource_id(resource, hardware: str) -> str:
+    if resource is not None:
+        return resource.resource_id
+    return HARDWARE_LEASE_RESOURCES.get(hardware, hardware)
 
 
 class Engine:
@@ -40,6 +62,21 @@ class Engine:
         self.logger = logging.getLogger("mylogger")
         self.logger.setLevel(logging.DEBUG)
         self.pull_location = None
+        self.python_runner = None
+        self.last_resource_usage = None  # of the last exploit, see ResourceMonitor
+        self.hardware_pool = None
+        self.output_listener = None  # called with every chunk of exploit output
+        self.event_listener = (
+            None  # called with every protocol event, see bluekit.protocol
+        )
+        self.last_output = None  # OutputParser of the last exploit
+        self.record_transcripts = False  # keep timed stdout/stderr for bluekit.replay
+        self.transcript = None
+        self.capture_hci = False  # HCI trace per exploit, see bluekit.hcimonitor
+
+    def enable_python_runner(self) -> None:
+        self.python_runner = PythonRunner()
+        self.python_runner.preload()
 
     def construct_exploit_command(
         self,
@@ -142,6 +179,8 @@ class Engine:
         return exploit_command
 
     def run_test(self, target: str, current_exploit: Exploit, parameters: list) -> None:
+        start = time.monotonic()
+        self.last_resource_usage = None
         self.check_pull_location(target, current_exploit.name)
 
         pull_in_command = current_exploit.log_pull["in_command"]
@@ -153,41 +192,107 @@ class Engine:
         )
 
         print(f"Running exploit {current_exploit.name}")
+        parser = OutputParser(listener=self.event_listener)
+        self.last_output = parser
+        spawn_error = None
+
+        with self.capture_hci_trace(
+            target, current_exploit.name, current_exploit.hardware
+        ):
+            with self.lease_hardware(current_exploit.hardware) as resource:
+                env = None
+                if resource is not None:
+                    print(f"Using {resource}")
+                    exploit_command = resource.apply(exploit_command)
+                    env = resource.env
+                if self.record_transcripts:
+                    self.transcript = self.start_transcript(
+                        target, current_exploit, exploit_command
+                    )
 
-        if current_exploit.directory["change"]:
-            new_directory = TOOLKIT_INSTALLATION_DIRECTORY
-            if not current_exploit.directory["directory"].startswith("/"):
-                new_directory += "/"
-            new_directory += current_exploit.directory["directory"]
-
-            if_failed, data = self.execute_command(
-                target,
-                exploit_command,
-                current_exploit.name,
-                timeout=current_exploit.max_timeout,
-                change_directory=True,
-                directory=new_directory,
-            )
-        else:
-            if_failed, data = self.execute_command(
-                target,
-                exploit_command,
-                current_exploit.name,
-                timeout=current_exploit.max_timeout,
-            )
+                directory = None
+                if current_exploit.directory["change"]:
+                    directory = TOOLKIT_INSTALLATION_DIRECTORY
+                    if not current_exploit.directory["directory"].startswith("/"):
+                        directory += "/"
+                    directory += current_exploit.directory["directory"]
+                try:
+                    with span(
+                        "execute_command", timeout=current_exploit.max_timeout
+                    ) as args:
+                        if_failed, data = self.execute_command(
+                            target,
+                            exploit_command,
+                            current_exploit.name,
+                            timeout=current_exploit.max_timeout,
+                            change_directory=directory is not None,
+                            directory=directory,
+                            env=env,
+                            parser=parser,
+                            stop_on_result=current_exploit.stop_on_result,
+                        )
+                        args["timed_out"] = not if_failed
+                except OSError as e:
+                    # Spawning failed, e.g. fork or exec on this controller or board
+                    logging.error(
+                        "Engine.run_test -> %s not started - %s",
+                        current_exploit.name,
+                        e,
+                    )
+                    spawn_error = e
 
-        if current_exploit.type == TYPE_DOS:
-            # Possible to add a gray-box check here!!!!
-            response_code, data = dos_checker(target)
-        else:
-            logging.info("Engine.run_test -> data " + str(data))
-            response_code, data = self.process_raw_data(data, if_failed)
+            transport_ok = spawn_error is None and not any(
+                error in data for error in EXPLOIT_TRANSPORT_ERRORS
+            )
+            if spawn_error is not None:
+                response_code, data = RETURN_CODE_ERROR, str(spawn_error)
+            elif current_exploit.type == TYPE_DOS:
+                # Possible to add a gray-box check here!!!!
+                response_code, data = dos_checker(target)
+            else:
+                logging.info("Engine.run_test -> data %s", data[:LOGGED_OUTPUT_LIMIT])
+                with span("process_raw_data"):
+                    response_code, data = self.process_raw_data(data, if_failed, parser)
+
+        # A missing verdict or a timeout is common against targets that aren't
+        # vulnerable, only a board or controller that couldn't be used counts
+        watchdog.report(
+            get_resource_id(resource, current_exploit.hardware), transport_ok
+        )
 
         if not pull_in_command:
-            self.pull_information(target, current_exploit)
+            with span("pull_information"):
+                self.pull_information(target, current_exploit)
 
+        if self.transcript is not None:
+            self.transcript.close(response_code, data)
+            self.transcript = None
+
+        metrics.exploits_done.inc(type=current_exploit.type, code=response_code)
+        metrics.exploit_duration_seconds.observe(
+            time.monotonic() - start, hardware=current_exploit.hardware
+        )
+        metrics.last_exploit_timestamp.set(time.time())
         return response_code, data
 
+    def start_transcript(self, target, current_exploit, exploit_command):
+        path = TRANSCRIPT_FILE.format(
+            target=target,
+            exploit=current_exploit.name,
+            timestamp=time.strftime("%Y%m%d-%H%M%S"),
+        )
+        return Transcript(
+            path,
+            {
+                "exploit": current_exploit.name,
+                "target": target,
+                "type": current_exploit.type,
+                "command": exploit_command,
+                "timeout": current_exploit.max_timeout,
+                "stop_on_result": current_exploit.stop_on_result,
+            },
+        )
+
     def execute_command(
         self,
         target: str,
@@ -196,15 +301,23 @@ class Engine:
         timeout=TIMEOUT,
         change_directory=False,
         directory=None,
+        env=None,
+        parser=None,
+        stop_on_result=False,
     ) -> tuple:
         pid = None
+        # The working directory is passed to the process instead of chdir-ing,
+        # so engines of parallel campaigns don't change it under each other
         if change_directory:
-            os.chdir(directory)
-            logging.info("Engine.execute_command -> chdir to {}".format(directory))
+            cwd = directory
+            logging.info("Engine.execute_command -> running in {}".format(directory))
         else:
-            os.chdir(TOOLKIT_INSTALLATION_DIRECTORY)
+            cwd = TOOLKIT_INSTALLATION_DIRECTORY
+        if env is not None:
+            env = {**os.environ, **env}
 
         data = False, b""
+        monitor = None
 
         try:
             self.logger.info(
@@ -212,43 +325,171 @@ class Engine:
                     exploit_name, exploit_command
                 )
             )
-            command = subprocess.Popen(
-                " ".join(exploit_command),
-                stdout=subprocess.PIPE,
-                shell=True,
-                preexec_fn=os.setsid,
-            )  # for some reason doesn't accept tokenized exploit_command (leads to a bug)
+            command = None
+            if self.python_runner is not None:
+                command = self.python_runner.spawn(exploit_command, cwd, env)
+            if command is None:
+                command = subprocess.Popen(
+                    " ".join(exploit_command),
+                    stdout=subprocess.PIPE,
+                    # stderr only goes through bluekit when it is recorded
+                    stderr=subprocess.PIPE if self.transcript is not None else None,
+                    shell=True,
+                    preexec_fn=os.setsid,
+                    cwd=cwd,
+                    env=env,
+                )  # for some reason doesn't accept tokenized exploit_command (leads to a bug)
             pid = command.pid
+            monitor = ResourceMonitor(pid)
+            monitor.start()
 
             logging.info(
                 "Engine.execute_command -> sleeping for {} seconds".format(timeout)
             )
 
-            new_xdata = command.wait(timeout=timeout)
-            new_data = command.communicate()
+            new_data = self.read_output(command, timeout, parser, stop_on_result)
+            if command.poll() is None:
+                # stopped reading at the result, the exploit has nothing more to say
+                logging.info("Engine.execute_command -> result received, stopping")
+                monitor.stop()
+                self.kill_process_tree(command)
+                self.reap_process(command)
+            if self.transcript is not None:
+                self.transcript.finish(command.poll(), False)
             logging.info(
-                "Engine.execute_command -> command.communicate " + str(new_data)
+                "Engine.execute_command -> read_output %s",
+                new_data[:LOGGED_OUTPUT_LIMIT],
             )
-            if type(new_data) is int:
-                print(new_data)
-            else:
-                new_data = new_data[0]
             data = True, new_data
         except subprocess.TimeoutExpired as e:
+            metrics.exploit_timeouts.inc(exploit=exploit_name)
+            if self.transcript is not None:
+                self.transcript.finish(None, True)
+            monitor.stop()  # last sample before the tree is killed
             logging.info(
                 "Engine.execute_command -> Killing the exploit and sleeping for another 1 second"
             )
-            for child in psutil.Process(pid).children(recursive=True):
-                child.kill()
-            os.killpg(os.getpgid(command.pid), signal.SIGTERM)
+            self.kill_process_tree(command)
+            self.reap_process(command)
             time.sleep(1)
 
-        if change_directory:
-            os.chdir(TOOLKIT_INSTALLATION_DIRECTORY)
-
-        logging.info("Engine.execute_command -> data -> " + str(data))
+        if monitor is not None:
+            self.last_resource_usage = monitor.stop()
+        logging.info(
+            "Engine.execute_command -> data -> %s, %s",
+            data[0],
+            data[1][:LOGGED_OUTPUT_LIMIT],
+        )
         return data
 
+    def read_output(self, command, timeout, parser=None, stop_on_result=False) -> bytes:
+        """
+        communicate() that hands every chunk to output_listener and the parser
+        as it arrives. Stdout is drained continuously, so a full pipe never
+        blocks the exploit. With stop_on_result it returns at the first result.
+        """
+        chunks = []
+        end = None if timeout is None else time.monotonic() + timeout
+        streams = {command.stdout.fileno(): "stdout"}
+        if getattr(command, "stderr", None) is not None:
+            streams[command.stderr.fileno()] = "stderr"
+        open_fds = list(streams)
+        while len(open_fds) > 0:
+            remaining = None if end is None else max(0, end - time.monotonic())
+            ready, _, _ = select.select(open_fds, [], [], remaining)
+            if not ready:
+                raise subprocess.TimeoutExpired(command.args, timeout)
+            for fd in ready:
+                chunk = os.read(fd, OUTPUT_CHUNK_SIZE)
+                if not chunk:
+                    open_fds.remove(fd)
+                    continue
+                if self.transcript is not None:
+                    self.transcript.write(streams[fd], chunk)
+                if streams[fd] == "stderr":
+                    sys.stderr.buffer.write(chunk)  # as if it weren't piped
+                    sys.stderr.buffer.flush()
+                    continue
+                chunks.append(chunk)
+                if self.output_listener is not None:
+                    self.output_listener(chunk)
+                if parser is not None:
+                    parser.feed(chunk)
+                    if stop_on_result and parser.result is not None:
+                        return b"".join(chunks)
+        command.stdout.close()
+        command.wait(None if end is None else max(0, end - time.monotonic()))
+        return b"".join(chunks)
+
+    def kill_process_tree(self, command) -> None:
+        try:
+            for child in psutil.Process(command.pid).children(recursive=True):
+                child.kill()
+            os.killpg(os.getpgid(command.pid), signal.SIGTERM)
+        except (psutil.Error, ProcessLookupError):
+            pass  # exited on its own meanwhile
+
+    def reap_process(self, command) -> None:
+        # Closes the pipes read_output left open and waits, so no zombie is left behind
+        command.stdout.close()
+        if getattr(command, "stderr", None) is not None:
+            command.stderr.close()
+        try:
+            command.wait(PROCESS_EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logging.info("Engine.reap_process -> %d ignored SIGTERM", command.pid)
+            try:
+                os.killpg(os.getpgid(command.pid), signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            command.wait()
+
+    @contextmanager
+    def capture_hci_trace(self, target, exploit_name, hardware):
+        # Written next to the exploit's output, so the report index lists it as an artifact
+        if not self.capture_hci:
+            yield
+            return
+        path = (
+            OUTPUT_DIRECTORY.format(target=target, exploit=exploit_name)
+            + HCI_CAPTURE_FILE_NAME
+        )
+        # Parallel campaigns use other controllers, only the leased one's packets are kept
+        with monitor.capture(path, index=get_dev_id(self.get_adapter(hardware))):
+            yield
+
+    @staticmethod
+    def get_adapter(hardware: str) -> str:
+        """
+        Local controller an exploit's HCI traffic goes through. Boards and
+        phones bring their own, there it's only the DoS check on the default one.
+        """
+        adapter = HARDWARE_LEASE_RESOURCES.get(hardware, hardware)
+        return adapter if re.fullmatch(r"hci\d+", adapter) else DEFAULT_ADAPTER
+
+    @contextmanager
+    def lease_hardware(self, hardware: str):
+        with ExitStack() as stack:
+            # Only the wait for the lease is traced, not the time it is held
+            with span("lease_hardware", hardware=hardware):
+                if self.hardware_pool is not None and self.hardware_pool.is_pooled(
+                    hardware
+                ):
+                    resource = stack.enter_context(
+                        self.hardware_pool.lease(
+                            hardware, timeout=HARDWARE_LEASE_TIMEOUT
+                        )
+                    )
+                else:
+                    stack.enter_context(
+                        leases.lease(
+                            HARDWARE_LEASE_RESOURCES.get(hardware, hardware),
+                            timeout=HARDWARE_LEASE_TIMEOUT,
+                        )
+                    )
+                    resource = None
+            yield resource
+
     def execute_manual_exploit(
         self,
         target,
@@ -287,7 +528,8 @@ class Engine:
 
             new_data = command.communicate()[0]
             logging.info(
-                "Engine.execute_command -> command.communicate " + str(new_data)
+                "Engine.execute_command -> command.communicate %s",
+                new_data[:LOGGED_OUTPUT_LIMIT],
             )
             data = True, new_data
         except subprocess.TimeoutExpired as e:
@@ -302,48 +544,38 @@ class Engine:
         if change_directory:
             os.chdir(TOOLKIT_INSTALLATION_DIRECTORY)
 
-        logging.info("Engine.execute_command -> data -> " + str(data))
+        logging.info(
+            "Engine.execute_command -> data -> %s, %s",
+            data[0],
+            data[1][:LOGGED_OUTPUT_LIMIT],
+        )
         return data
 
-    def process_raw_data(self, data, if_failed):
-        # INEFFICIENTLY processes data line by line (there is room for improvement)
-        try:
-            # TODO: if data is empty, return error directly
-            mm = re.compile(REGEX_EXPLOIT_OUTPUT_DATA)
-            output = mm.search(data).group()
-            print(output)
-            logging.info(
-                "Engine.process_raw_data -> Found data from the exploit {}".format(
-                    output
-                )
-            )
-
-            mm2 = re.compile(REGEX_EXPLOIT_OUTPUT_DATA_CODE)
-            mm3 = re.compile(REGEX_EXPLOIT_OUTPUT_DATA_DATA)
-
-            output2 = int(mm2.search(output).group().rstrip(b",").split(b"=")[1])
-            logging.info(
-                "Engine.process_raw_data -> Found data from the exploit, code -> {}".format(
-                    output2
-                )
-            )
-            output3 = (mm3.search(output).group().split(b"=")[1]).decode()
-            logging.info(
-                "Engine.process_raw_data -> Found data from the exploit, data -> {}".format(
-                    output3
-                )
-            )
-
-            return int(output2), output3
-        except Exception as e:
-            logging.info(
-                "Engine.process_raw_data -> Error during extracting information from the regex "
-                + str(e)
-            )
+    def process_raw_data(self, data, if_failed, parser=None):
+        """
+        Verdict of the exploit output, from the parser that read it while the
+        exploit ran or, without one, from parsing the data now.
+        """
+        if parser is None:
+            parser = OutputParser()
+            parser.feed(data)
+        parser.close()
+        verdict = parser.get_verdict()
+        if verdict is None:
+            logging.info("Engine.process_raw_data -> No result reported by the exploit")
             return (
                 RETURN_CODE_NONE_OF_4_STATE_OBSERVED,
                 "Error during extracting information from the regex",
             )
+        if parser.result_line is not None:
+            print(parser.result_line)
+        logging.info(
+            "Engine.process_raw_data -> Found data from the exploit, code -> %s, data -> %s, findings -> %d",
+            verdict[0],
+            verdict[1],
+            len(parser.findings),
+        )
+        return verdict
 
     def pull_information(self, target, current_exploit: Exploit) -> None:
         # Basically copy from 1 directory to another one
@@ -360,7 +592,16 @@ class Engine:
             else:
                 directory = current_exploit.log_pull["pull_directory"]
 
-            shutil.copytree(directory, self.pull_location, dirs_exist_ok=True)
+            def copy_and_count(source, destination):
+                metrics.artifact_bytes_pulled.inc(os.path.getsize(source))
+                return shutil.copy2(source, destination)
+
+            shutil.copytree(
+                directory,
+                self.pull_location,
+                dirs_exist_ok=True,
+                copy_function=copy_and_count,
+            )
         else:
             self.logger.info("from_directory: false, is not yet implemented")
             return
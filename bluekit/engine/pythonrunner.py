@@ -0,0 +1,183 @@
+import importlib
+import logging
+import os
+import runpy
+import select
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from bluekit import log
+from bluekit.constants import (
+    PYTHON_RUNNER_INTERPRETERS,
+    PYTHON_RUNNER_PRELOAD_MODULES,
+    PYTHON_RUNNER_SHELL_CHARACTERS,
+)
+
+
+class ForkedProcess:
+    """
+    Minimal subset of subprocess.Popen for an exploit running in a forked child.
+    Engine.execute_command only relies on pid, stdout, wait() and communicate().
+    """
+
+    def __init__(self, pid: int, stdout, args: list):
+        self.pid = pid
+        self.stdout = stdout
+        self.args = args
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                self.returncode = -1
+                return self.returncode
+            if pid != 0:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if end is not None and time.monotonic() >= end:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(0.05)
+        return self.returncode
+
+    def communicate(self, timeout=None):
+        chunks = []
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if end is None else max(0, end - time.monotonic())
+            ready, _, _ = select.select([self.stdout], [], [], remaining)
+            if not ready:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            chunk = os.read(self.stdout.fileno(), 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.stdout.close()
+        self.wait()
+        return b"".join(chunks), None
+
+
+class PythonRunner:
+    """
+    Runs `python3 script.py ...` exploit commands in a forked child of the
+    bluekit process, so modules preloaded here (pybtool, scapy, ...) are not
+    imported again for every exploit. Commands that can't be run this way
+    return None from spawn() and the engine falls back to a normal subprocess.
+
+    Only the forking thread survives in the child, a lock another thread of
+    bluekit held at fork time stays locked there. The child resets logging,
+    whose listener thread is gone, and otherwise only runs the script, which
+    is why --prefork is refused for the multi-threaded modes
+    (--multipletargets, --daemon, --watch).
+    """
+
+    def __init__(self, preload_modules: list = PYTHON_RUNNER_PRELOAD_MODULES):
+        self.preload_modules = preload_modules
+        self.preloaded = []
+        self.children = []
+        self.lock = threading.Lock()  # spawn and reap run on session threads
+
+    def preload(self) -> None:
+        for module in self.preload_modules:
+            try:
+                importlib.import_module(module)
+                self.preloaded.append(module)
+            except Exception as e:
+                logging.info(
+                    "PythonRunner.preload -> could not preload {} - {}".format(module, e)
+                )
+        logging.info("PythonRunner.preload -> preloaded {}".format(self.preloaded))
+
+    def get_script_argv(self, exploit_command: list, cwd: str):
+        command = " ".join(exploit_command)
+        if any(character in command for character in PYTHON_RUNNER_SHELL_CHARACTERS):
+            return None
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            return None
+        if len(argv) < 2 or argv[0] not in PYTHON_RUNNER_INTERPRETERS:
+            return None
+        if not argv[1].endswith(".py"):
+            return None
+        if not os.path.isfile(os.path.join(cwd, argv[1])):
+            return None
+        return argv[1:]
+
+    def spawn(self, exploit_command: list, cwd: str, env: dict = None):
+        self.reap()
+        argv = self.get_script_argv(exploit_command, cwd)
+        if argv is None:
+            return None
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+        except OSError as e:
+            logging.info("PythonRunner.spawn -> fork failed, falling back - " + str(e))
+            return None
+
+        if pid == 0:
+            self.run_child(argv, cwd, env, read_fd, write_fd)
+
+        os.close(write_fd)
+        logging.info(
+            "PythonRunner.spawn -> forked {} for {}".format(pid, " ".join(argv))
+        )
+        process = ForkedProcess(pid, os.fdopen(read_fd, "rb"), exploit_command)
+        with self.lock:
+            self.children.append(process)
+        return process
+
+    @staticmethod
+    def run_child(argv: list, cwd: str, env: dict, read_fd: int, write_fd: int) -> None:
+        code = 0
+        try:
+            os.setsid()
+            log.reset_after_fork()
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.close(read_fd)
+            os.dup2(write_fd, 1)
+            os.close(write_fd)
+            os.chdir(cwd)
+            if env is not None:
+                os.environ.clear()
+                os.environ.update(env)
+            script = os.path.abspath(argv[0])
+            sys.argv = [script] + argv[1:]
+            sys.path[0] = os.path.dirname(script)
+            runpy.run_path(script, run_name="__main__")
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)
+
+    def reap(self) -> None:
+        with self.lock:
+            self.children = [child for child in self.children if child.poll() is None]
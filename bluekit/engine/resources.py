@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+
+import psutil
+
+from bluekit.constants import RESOURCE_SAMPLE_INTERVAL
+
+
+class ResourceMonitor:
+    """
+    Samples the process tree of a running exploit for CPU time, peak RSS,
+    disk I/O and child processes. Processes living shorter than the sample
+    interval are missed, so the numbers are lower bounds.
+    """
+
+    def __init__(self, pid: int, interval: float = RESOURCE_SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.processes = {}  # pid -> psutil.Process, cached for cpu and io counters
+        self.cpu_seconds = {}  # pid -> last seen user + system time
+        self.io_bytes = {}  # pid -> last seen (read, write)
+        self.peak_rss = 0
+        self.max_children = 0
+        self.samples = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def get_process(self, pid: int) -> psutil.Process:
+        if pid not in self.processes:
+            self.processes[pid] = psutil.Process(pid)
+        return self.processes[pid]
+
+    def sample(self) -> None:
+        try:
+            root = self.get_process(self.pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return  # already gone
+        rss = 0
+        for process in tree:
+            try:
+                process = self.get_process(process.pid)
+                with process.oneshot():
+                    cpu_times = process.cpu_times()
+                    rss += process.memory_info().rss
+                    try:
+                        io = process.io_counters()
+                        self.io_bytes[process.pid] = (io.read_bytes, io.write_bytes)
+                    except (psutil.AccessDenied, AttributeError):
+                        pass
+                self.cpu_seconds[process.pid] = cpu_times.user + cpu_times.system
+            except psutil.Error:
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+        self.max_children = max(self.max_children, len(tree) - 1)
+        self.samples += 1
+
+    def run(self) -> None:
+        # Sample often at first so short exploits are seen, then back off
+        wait = min(0.05, self.interval)
+        while True:
+            self.sample()
+            if self.stopped.wait(wait):
+                break
+            wait = min(wait * 2, self.interval)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> dict:
+        if self.finished is None:
+            self.finished = time.monotonic()
+            self.stopped.set()
+            if self.thread is not None:
+                self.thread.join()
+            self.sample()
+            logging.info(f"ResourceMonitor -> {self.pid} - {self.get_usage()}")
+        return self.get_usage()
+
+    def get_usage(self) -> dict:
+        end = self.finished if self.finished is not None else time.monotonic()
+        return {
+            "wall_seconds": round(end - self.started, 3),
+            "cpu_seconds": round(sum(self.cpu_seconds.values()), 3),
+            "peak_rss_bytes": self.peak_rss,
+            "read_bytes": sum(read for read, _ in self.io_bytes.values()),
+            "write_bytes": sum(write for _, write in self.io_bytes.values()),
+            "max_children": self.max_children,
+            "children_started": max(0, len(self.cpu_seconds) - 1),
+            "samples": self.samples,
+        }
+
+
+def format_resources(resources: dict) -> str:
+    if not resources:
+        return ""
+    megabyte = 1024 * 1024
+    return (
+        f"cpu {resources['cpu_seconds']:.1f}s, "
+        f"rss {resources['peak_rss_bytes'] / megabyte:.1f}MB, "
+        f"io {(resources['read_bytes'] + resources['write_bytes']) / megabyte:.1f}MB, "
+        f"{resources['max_children']} children"
+    )
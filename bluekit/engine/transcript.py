@@ -0,0 +1,93 @@
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+TRANSCRIPT_VERSION = 1
+
+
+class Transcript:
+    """
+    Timestamped record of an exploit run as JSON lines: a header with the
+    exploit and command, every output chunk with its stream and offset in
+    seconds, how the process ended and the verdict bluekit derived from it.
+    Chunks are stored as latin-1 text, which maps every byte to a character.
+    """
+
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "w")
+        self.started = time.monotonic()
+        self.write_line(
+            {"version": TRANSCRIPT_VERSION, "started": time.time(), **header}
+        )
+
+    def write_line(self, doc: dict) -> None:
+        self.file.write(json.dumps(doc) + "\n")
+
+    def get_offset(self) -> float:
+        return round(time.monotonic() - self.started, 6)
+
+    def write(self, stream: str, chunk: bytes) -> None:
+        self.write_line(
+            {"t": self.get_offset(), "stream": stream, "data": chunk.decode("latin-1")}
+        )
+
+    def finish(self, returncode, timed_out: bool) -> None:
+        self.write_line(
+            {
+                "t": self.get_offset(),
+                "event": "exit",
+                "returncode": returncode,
+                "timed_out": timed_out,
+            }
+        )
+
+    def close(self, code=None, data=None) -> None:
+        if code is not None:
+            self.write_line({"event": "verdict", "code": code, "data": data})
+        self.file.close()
+        logging.info("Transcript.close -> %s", self.path)
+
+
+def read_transcript(path: str) -> dict:
+    transcript = {"header": None, "chunks": [], "exit": None, "verdict": None}
+    with open(path) as f:
+        for line in f:
+            doc = json.loads(line)
+            if transcript["header"] is None:
+                if doc.get("version", 0) > TRANSCRIPT_VERSION:
+                    raise Exception(f"Unsupported transcript version in {path}")
+                transcript["header"] = doc
+            elif "stream" in doc:
+                transcript["chunks"].append(doc)
+            elif doc.get("event") in ("exit", "verdict"):
+                transcript[doc["event"]] = doc
+    return transcript
+
+
+def play(path: str, speed: float = 1.0) -> int:
+    """
+    Writes the recorded output again with its timing, `speed` times faster.
+    A run that timed out keeps going until it is killed, like the original.
+    """
+    transcript = read_transcript(path)
+    streams = {"stdout": sys.stdout.buffer, "stderr": sys.stderr.buffer}
+    started = time.monotonic()
+    for chunk in transcript["chunks"]:
+        delay = chunk["t"] / speed - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+        stream = streams[chunk["stream"]]
+        stream.write(chunk["data"].encode("latin-1"))
+        stream.flush()
+    ended = transcript["exit"]
+    if ended is None or ended["timed_out"]:
+        time.sleep(transcript["header"].get("timeout", 0) / speed + 5)
+        return 1
+    delay = ended["t"] / speed - (time.monotonic() - started)
+    if delay > 0:
+        time.sleep(delay)
+    return ended["returncode"] or 0
@@ -0,0 +1,249 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from tabulate import tabulate
+
+from bluekit.constants import (
+    RETURN_CODE_ERROR,
+    RETURN_CODE_NONE_OF_4_STATE_OBSERVED,
+    RETURN_CODE_NOT_APPLICABLE,
+    RETURN_CODE_NOT_TESTED,
+    RETURN_CODE_NOT_VULNERABLE,
+    RETURN_CODE_UNDEFINED,
+    RETURN_CODE_VULNERABLE,
+)
+from bluekit.constants import (
+    FLEET_DIRECTORY,
+    FLEET_WORKERS,
+    SKIP_DIRECTORIES,
+    TESTS_DIRECTORY,
+)
+
+REPORT_FILE_NAME = "output_report.json"
+RECON_FILE_NAME = "recon.json"
+NOT_APPLICABLE_FILE_NAME = "not_applicable.json"
+INDEX_FILE_NAME = "index.json"
+
+VERDICTS = {
+    RETURN_CODE_ERROR: "error",
+    RETURN_CODE_NOT_VULNERABLE: "not_vulnerable",
+    RETURN_CODE_VULNERABLE: "vulnerable",
+    RETURN_CODE_UNDEFINED: "undefined",
+    RETURN_CODE_NONE_OF_4_STATE_OBSERVED: "toolkit_error",
+    RETURN_CODE_NOT_TESTED: "not_tested",
+    RETURN_CODE_NOT_APPLICABLE: "not_applicable",
+}
+VERDICT_ORDER = list(VERDICTS.values())
+
+
+def get_verdict(code) -> str:
+    return VERDICTS.get(code, "toolkit_error")
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_target_signature(target_directory: str) -> str:
+    """
+    Changes whenever a result, the recon data or the not applicable list of
+    the target is written. Only stats files, nothing is read.
+    """
+    entries = []
+    with os.scandir(target_directory) as it:
+        for entry in it:
+            if entry.is_dir():
+                if entry.name == "recon":
+                    path = os.path.join(entry.path, RECON_FILE_NAME)
+                elif entry.name in SKIP_DIRECTORIES:
+                    continue
+                else:
+                    path = os.path.join(entry.path, REPORT_FILE_NAME)
+            elif entry.name in (NOT_APPLICABLE_FILE_NAME, INDEX_FILE_NAME):
+                path = entry.path
+            else:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return hashlib.sha1(repr(sorted(entries)).encode()).hexdigest()
+
+
+def read_target(target_directory: str) -> dict:
+    """Runs in a worker process, reads everything the fleet report needs of one target"""
+    index = read_json(os.path.join(target_directory, INDEX_FILE_NAME))
+    if index is not None:
+        results = index["exploits"]
+    else:
+        results = {}  # tested before Report kept an index
+        with os.scandir(target_directory) as it:
+            for entry in it:
+                if not entry.is_dir() or entry.name in SKIP_DIRECTORIES:
+                    continue
+                doc = read_json(os.path.join(entry.path, REPORT_FILE_NAME))
+                if doc is None:
+                    continue  # leftover directory of an exploit that didn't finish
+                results[entry.name] = doc
+    results = {
+        name: {"code": doc.get("code"), "data": doc.get("data")}
+        for name, doc in results.items()
+    }
+    recon = read_json(os.path.join(target_directory, "recon", RECON_FILE_NAME)) or {}
+    not_applicable = (
+        read_json(os.path.join(target_directory, NOT_APPLICABLE_FILE_NAME)) or {}
+    )
+    return {
+        "target": os.path.basename(os.path.normpath(target_directory)),
+        "vendor": recon.get("vendor"),
+        "bt_version": recon.get("version"),
+        "type": recon.get("type"),
+        "results": results,
+        "not_applicable": not_applicable,
+    }
+
+
+class FleetReport:
+    """
+    Aggregate report over every target in data/tests. Targets are read in
+    worker processes, and an index of per-target signatures lets a rerun
+    read only the targets that changed since the last one.
+    """
+
+    def __init__(
+        self,
+        tests_directory: str = TESTS_DIRECTORY,
+        output_directory: str = FLEET_DIRECTORY,
+        workers: int = FLEET_WORKERS,
+    ):
+        self.tests_directory = tests_directory
+        self.output_directory = output_directory
+        self.workers = workers
+        self.index_path = os.path.join(output_directory, "index.json")
+
+    def load_index(self) -> dict:
+        return read_json(self.index_path) or {}
+
+    def save_index(self, index: dict) -> None:
+        temp_path = f"{self.index_path}.{os.getpid()}"
+        with open(temp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
+
+    def get_targets(self) -> list:
+        if not os.path.isdir(self.tests_directory):
+            return []
+        with os.scandir(self.tests_directory) as it:
+            return sorted(entry.name for entry in it if entry.is_dir())
+
+    def collect(self) -> tuple:
+        """Returns the records of all targets and how many had to be read"""
+        previous = self.load_index()
+        index = {}
+        changed = []
+        for target in self.get_targets():
+            directory = os.path.join(self.tests_directory, target)
+            signature = get_target_signature(directory)
+            entry = previous.get(target)
+            if entry is not None and entry["signature"] == signature:
+                index[target] = entry
+            else:
+                index[target] = {"signature": signature}
+                changed.append(target)
+
+        if len(changed) > 0:
+            directories = [os.path.join(self.tests_directory, t) for t in changed]
+            chunksize = max(1, len(changed) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for target, record in zip(
+                    changed, pool.map(read_target, directories, chunksize=chunksize)
+                ):
+                    index[target]["record"] = record
+
+        Path(self.output_directory).mkdir(parents=True, exist_ok=True)
+        self.save_index(index)
+        return [entry["record"] for entry in index.values()], len(changed)
+
+    @staticmethod
+    def get_verdicts(record: dict, exploit_names: list) -> dict:
+        verdicts = {
+            name: get_verdict(result["code"])
+            for name, result in record["results"].items()
+        }
+        for name in exploit_names:
+            if name not in verdicts:
+                if name in record["not_applicable"]:
+                    verdicts[name] = "not_applicable"
+                else:
+                    verdicts[name] = "not_tested"
+        return verdicts
+
+    def build(self, exploit_names: list) -> dict:
+        started = time.monotonic()
+        records, read = self.collect()
+        matrix = {}  # exploit -> vendor -> verdict -> targets
+        with open(os.path.join(self.output_directory, "fleet.ndjson"), "w") as f:
+            for record in records:
+                verdicts = self.get_verdicts(record, exploit_names)
+                vendor = record["vendor"] or "unknown"
+                counts = {}
+                for name, verdict in verdicts.items():
+                    counts[verdict] = counts.get(verdict, 0) + 1
+                    by_verdict = matrix.setdefault(name, {}).setdefault(vendor, {})
+                    by_verdict[verdict] = by_verdict.get(verdict, 0) + 1
+                f.write(
+                    json.dumps({**record, "verdicts": verdicts, "counts": counts})
+                    + "\n"
+                )
+        self.save_matrix(matrix)
+        logging.info(
+            "FleetReport.build -> %d targets, %d read, %.2f s",
+            len(records),
+            read,
+            time.monotonic() - started,
+        )
+        return {"targets": len(records), "read": read, "matrix": matrix}
+
+    def save_matrix(self, matrix: dict) -> None:
+        with open(os.path.join(self.output_directory, "matrix.json"), "w") as f:
+            json.dump(matrix, f, indent=1, sort_keys=True)
+        with open(os.path.join(self.output_directory, "matrix.csv"), "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["exploit", "vendor"] + VERDICT_ORDER)
+            for exploit in sorted(matrix):
+                for vendor in sorted(matrix[exploit]):
+                    counts = matrix[exploit][vendor]
+                    writer.writerow(
+                        [exploit, vendor]
+                        + [counts.get(verdict, 0) for verdict in VERDICT_ORDER]
+                    )
+
+    def format_summary(self, matrix: dict) -> str:
+        # Vendors are only in matrix.csv, per vendor rows don't fit a terminal
+        table_data = []
+        for exploit in sorted(matrix):
+            totals = {}
+            for counts in matrix[exploit].values():
+                for verdict, count in counts.items():
+                    totals[verdict] = totals.get(verdict, 0) + count
+            table_data.append(
+                [exploit, len(matrix[exploit])]
+                + [totals.get(verdict, 0) for verdict in VERDICT_ORDER]
+            )
+        return tabulate(
+            table_data,
+            ["Exploit", "Vendors"] + VERDICT_ORDER,
+            tablefmt="pretty",
+            colalign=("left",),
+        )
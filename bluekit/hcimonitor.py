@@ -0,0 +1,202 @@
+"""
+In-process HCI capture through the kernel's monitor channel, the same
+source btmon reads. One reader thread per process keeps the latest
+packets of all controllers in a ring buffer; capture() saves the packets
+seen while its block runs as btsnoop (what btmon -w writes, opens in
+Wireshark) or, for a .pcap path, as a LINKTYPE_BLUETOOTH_LINUX_MONITOR pcap.
+Opening the channel needs CAP_NET_RAW, without it captures stay empty.
+"""
+
+import ctypes
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+from bluekit.constants import HCI_CAPTURE_RING_SIZE
+
+AF_BLUETOOTH = getattr(socket, "AF_BLUETOOTH", 31)
+BTPROTO_HCI = getattr(socket, "BTPROTO_HCI", 1)
+HCI_CHANNEL_MONITOR = 2
+HCI_DEV_NONE = 0xFFFF
+HCI_MAX_FRAME_SIZE = 65535 + 6
+MONITOR_HEADER = struct.Struct("<HHH")  # opcode, controller index, length
+
+# Monitor opcodes
+MONITOR_COMMAND_PKT = 2
+MONITOR_EVENT_PKT = 3
+
+BTSNOOP_HEADER = b"btsnoop\x00" + struct.pack(">II", 1, 2001)  # Linux monitor
+BTSNOOP_RECORD = struct.Struct(">IIIIq")
+BTSNOOP_EPOCH_DELTA = 0x00DCDDB30F2F8000  # microseconds from year 0 to 1970
+PCAP_HEADER = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 254)
+PCAP_RECORD = struct.Struct("<IIII")
+PCAP_MONITOR_HEADER = struct.Struct(">HH")  # controller index, opcode
+
+# HCI events decoded by bluekit
+HCI_EVENT_IO_CAPABILITY_RESPONSE = 0x32
+IO_CAPABILITIES = {
+    0: "DisplayOnly",
+    1: "DisplayYesNo",
+    2: "KeyboardOnly",
+    3: "NoInputNoOutput",
+}
+
+
+def open_monitor_socket() -> socket.socket:
+    sock = socket.socket(AF_BLUETOOTH, socket.SOCK_RAW, BTPROTO_HCI)
+    # socket.bind() can't select an HCI channel, sockaddr_hci is bound by hand
+    address = struct.pack("<HHH", AF_BLUETOOTH, HCI_DEV_NONE, HCI_CHANNEL_MONITOR)
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.bind(sock.fileno(), ctypes.c_char_p(address), len(address)) != 0:
+        errno = ctypes.get_errno()
+        sock.close()
+        raise OSError(errno, os.strerror(errno))
+    return sock
+
+
+def write_btsnoop(path: str, packets: list, drops: int = 0) -> None:
+    with open(path, "wb") as f:
+        f.write(BTSNOOP_HEADER)
+        for _, timestamp, index, opcode, data in packets:
+            f.write(
+                BTSNOOP_RECORD.pack(
+                    len(data),
+                    len(data),
+                    (index << 16) | opcode,
+                    drops,
+                    int(timestamp * 1000000) + BTSNOOP_EPOCH_DELTA,
+                )
+            )
+            f.write(data)
+
+
+def write_pcap(path: str, packets: list) -> None:
+    with open(path, "wb") as f:
+        f.write(PCAP_HEADER)
+        for _, timestamp, index, opcode, data in packets:
+            length = PCAP_MONITOR_HEADER.size + len(data)
+            seconds = int(timestamp)
+            f.write(
+                PCAP_RECORD.pack(
+                    seconds, int((timestamp - seconds) * 1000000), length, length
+                )
+            )
+            f.write(PCAP_MONITOR_HEADER.pack(index, opcode))
+            f.write(data)
+
+
+def get_io_capabilities(packets: list) -> list:
+    """(address, IO capability) of every IO Capability Response event"""
+    capabilities = []
+    for _, _, _, opcode, data in packets:
+        # event code, parameter length, address (little endian), IO capability, ...
+        if opcode != MONITOR_EVENT_PKT or len(data) < 9:
+            continue
+        if data[0] != HCI_EVENT_IO_CAPABILITY_RESPONSE:
+            continue
+        address = ":".join(f"{b:02x}" for b in reversed(data[2:8]))
+        capabilities.append((address, IO_CAPABILITIES.get(data[8], data[8])))
+    return capabilities
+
+
+class HciMonitor:
+    """
+    Ring buffer of the last HCI_CAPTURE_RING_SIZE monitor packets, each
+    kept as (sequence, timestamp, controller index, opcode, data).
+    """
+
+    def __init__(self, ring_size: int = HCI_CAPTURE_RING_SIZE):
+        self.packets = deque(maxlen=ring_size)
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.sock = None
+        self.unavailable = False
+
+    def start(self) -> bool:
+        with self.lock:
+            if self.thread is not None or self.unavailable:
+                return not self.unavailable
+            try:
+                self.sock = open_monitor_socket()
+            except OSError as e:
+                logging.warning("HciMonitor.start -> no HCI monitor channel - %s", e)
+                self.unavailable = True
+                return False
+            self.thread = threading.Thread(target=self.read, daemon=True)
+            self.thread.start()
+        return True
+
+    def read(self) -> None:
+        while True:
+            try:
+                frame = self.sock.recv(HCI_MAX_FRAME_SIZE)
+            except OSError as e:
+                logging.warning("HciMonitor.read -> stopped - %s", e)
+                return
+            if len(frame) < MONITOR_HEADER.size:
+                continue
+            opcode, index, length = MONITOR_HEADER.unpack_from(frame)
+            self.add(index, opcode, frame[MONITOR_HEADER.size :][:length])
+
+    def add(self, index: int, opcode: int, data: bytes, timestamp: float = None):
+        with self.lock:
+            self.sequence += 1
+            self.packets.append(
+                (
+                    self.sequence,
+                    time.time() if timestamp is None else timestamp,
+                    index,
+                    opcode,
+                    data,
+                )
+            )
+
+    def get_packets(self, after: int) -> tuple:
+        """Packets with a sequence number above `after` and how many were overwritten"""
+        with self.lock:
+            packets = [packet for packet in self.packets if packet[0] > after]
+            first = packets[0][0] if len(packets) > 0 else self.sequence + 1
+        return packets, first - after - 1
+
+    @contextmanager
+    def capture(self, path: str = None, index: int = None):
+        """
+        Yields the list the packets of the block are put in when it ends,
+        and writes them to path if one is given. With index, only packets of
+        that controller are kept, the ring holds those of all of them.
+        """
+        self.start()
+        start = self.sequence
+        captured = []
+        try:
+            yield captured
+        finally:
+            packets, drops = self.get_packets(start)
+            if index is not None:
+                packets = [packet for packet in packets if packet[2] == index]
+            captured.extend(packets)
+            if drops > 0:
+                logging.warning(
+                    "HciMonitor.capture -> %d packets lost, the ring buffer is too small",
+                    drops,
+                )
+            if path is not None:
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                if path.endswith(".pcap"):
+                    write_pcap(path, packets)
+                else:
+                    write_btsnoop(path, packets, drops)
+                logging.info(
+                    "HciMonitor.capture -> %d packets to %s", len(packets), path
+                )
+
+
+# Shared by the engine and recon of this process
+monitor = HciMonitor()
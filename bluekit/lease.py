@@ -0,0 +1,117 @@
+import fcntl
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from bluekit.constants import (
+    LEASE_DIRECTORY,
+    LEASE_POLL_INTERVAL,
+    LEASE_TIMEOUT,
+)
+
+
+class LeaseTimeout(Exception):
+    pass
+
+
+class LeaseManager:
+    """
+    Cross-process leases on controllers and boards (hci0, /dev/ttyUSB1, adb
+    serials). A lease is an flock on the resource's lock file, so the kernel
+    drops it when its owner process dies. The file holds the owner's metadata
+    while the lease is held. Leases are reentrant for the thread holding
+    them, other threads and processes queue.
+    """
+
+    def __init__(self, lock_directory: str = LEASE_DIRECTORY):
+        self.lock_directory = lock_directory
+        self.hostname = socket.gethostname()
+        self.held = {}  # resource -> [thread id, count, lock file descriptor]
+        self.lock = threading.Lock()
+
+    def lock_path(self, resource: str) -> str:
+        name = resource.strip("/").replace("/", "_").replace(":", "_")
+        return os.path.join(self.lock_directory, name + ".lock")
+
+    def read_owner(self, resource: str):
+        try:
+            with open(self.lock_path(resource)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None  # free, or its owner is still writing
+
+    def try_acquire(self, resource: str, owner: str = None) -> bool:
+        thread_id = threading.get_ident()
+        with self.lock:
+            if resource in self.held:
+                if self.held[resource][0] == thread_id:
+                    self.held[resource][1] += 1
+                    return True
+                return False
+
+        Path(self.lock_directory).mkdir(parents=True, exist_ok=True)
+        # The file is never removed, a lock on an unlinked file would lock nothing
+        fd = os.open(self.lock_path(resource), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        metadata = {
+            "resource": resource,
+            "pid": os.getpid(),
+            "thread": thread_id,
+            "hostname": self.hostname,
+            "owner": owner if owner is not None else " ".join(sys.argv),
+            "acquired_at": time.time(),
+        }
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, json.dumps(metadata).encode(), 0)
+
+        with self.lock:
+            self.held[resource] = [thread_id, 1, fd]
+        logging.info(f"LeaseManager -> acquired {resource}")
+        return True
+
+    def acquire(self, resource: str, timeout: float = LEASE_TIMEOUT, owner: str = None):
+        end = None if timeout is None else time.monotonic() + timeout
+        waiting = False
+        while not self.try_acquire(resource, owner=owner):
+            if not waiting:
+                current = self.read_owner(resource)
+                holder = "another thread" if current is None else current.get("owner")
+                print(f"Waiting for {resource}, it is in use by {holder}")
+                waiting = True
+            if end is not None and time.monotonic() >= end:
+                raise LeaseTimeout(f"Timed out waiting for a lease on {resource}")
+            time.sleep(LEASE_POLL_INTERVAL)
+
+    def release(self, resource: str) -> None:
+        with self.lock:
+            if resource not in self.held:
+                return
+            self.held[resource][1] -= 1
+            if self.held[resource][1] > 0:
+                return
+            fd = self.held.pop(resource)[2]
+        os.ftruncate(fd, 0)
+        os.close(fd)  # drops the flock
+        logging.info(f"LeaseManager -> released {resource}")
+
+    @contextmanager
+    def lease(self, resource: str, timeout: float = LEASE_TIMEOUT, owner: str = None):
+        self.acquire(resource, timeout=timeout, owner=owner)
+        try:
+            yield resource
+        finally:
+            self.release(resource)
+
+
+# Shared by the engine, recon and verifyconn of this process
+leases = LeaseManager()
@@ -0,0 +1,200 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import time
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+
+from bluekit.constants import (
+    LOG_FILE,
+    LOG_DEFAULT_LEVEL,
+    LOG_MAX_BYTES,
+    LOG_BACKUP_COUNT,
+    LOG_ROTATION_INTERVAL,
+)
+
+PACKAGE_PARENT = Path(__file__).resolve().parent.parent
+IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+
+listener = None
+queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON document per line, easy to grep with jq"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        doc = {
+            "time": record.created,
+            "level": record.levelname,
+            "module": get_module_name(record.name, record.pathname),
+            "function": record.funcName,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            doc["exception"] = record.exc_text
+        return json.dumps(doc, default=str)
+
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """Rolls over once the file reaches max_bytes or is `interval` seconds old"""
+
+    def __init__(
+        self, filename: str, max_bytes: int, backup_count: int, interval: float
+    ):
+        super().__init__(
+            filename, maxBytes=max_bytes, backupCount=backup_count, delay=True
+        )
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Formatting and writing happen in the listener thread. Arguments are only
+    turned into strings here if they could change before the record is written.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        args = record.args if isinstance(record.args, tuple) else (record.args,)
+        if not all(isinstance(arg, IMMUTABLE_TYPES) for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+@lru_cache(maxsize=None)
+def get_module_name(logger_name: str, pathname: str) -> str:
+    # Most modules log through the root logger, name those records by their file
+    if logger_name != "root":
+        return logger_name
+    try:
+        relative = Path(pathname).resolve().relative_to(PACKAGE_PARENT)
+    except ValueError:
+        return Path(pathname).stem
+    return ".".join(relative.with_suffix("").parts)
+
+
+class ModuleLevelFilter(logging.Filter):
+    def __init__(self, default_level: int, module_levels: dict):
+        super().__init__()
+        self.default_level = default_level
+        self.module_levels = module_levels
+
+    @lru_cache(maxsize=None)
+    def get_level(self, module: str) -> int:
+        # The most specific configured prefix wins, bluekit.engine covers bluekit.engine.engine
+        parts = module.split(".")
+        for end in range(len(parts), 0, -1):
+            level = self.module_levels.get(".".join(parts[:end]))
+            if level is not None:
+                return level
+        return self.default_level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        module = get_module_name(record.name, record.pathname)
+        return record.levelno >= self.get_level(module)
+
+
+def parse_level(level: str) -> int:
+    value = logging.getLevelName(level.strip().upper())
+    if not isinstance(value, int):
+        raise Exception(f"Unknown log level {level}")
+    return value
+
+
+def parse_verbosity(verbosity: str) -> tuple:
+    """
+    "debug" sets the default level, "warning,bluekit.recon=debug" also sets
+    the level of single modules or packages.
+    """
+    default_level = parse_level(LOG_DEFAULT_LEVEL)
+    module_levels = {}
+    for part in (verbosity or "").split(","):
+        if part.strip() == "":
+            continue
+        if "=" in part:
+            module, level = part.split("=", 1)
+            module_levels[module.strip()] = parse_level(level)
+        else:
+            default_level = parse_level(part)
+    return default_level, module_levels
+
+
+def setup_logging(verbosity: str = None, log_file: str = LOG_FILE):
+    global listener, queue_handler
+    stop_logging()
+
+    default_level, module_levels = parse_verbosity(verbosity)
+    Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+    file_handler = SizeAndTimeRotatingFileHandler(
+        log_file, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATION_INTERVAL
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(ModuleLevelFilter(default_level, module_levels))
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(min([default_level] + list(module_levels.values())))
+
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    return listener
+
+
+def stop_logging() -> None:
+    """Writes the queued records and detaches the handlers"""
+    global listener, queue_handler
+    if queue_handler is not None:
+        logging.getLogger().removeHandler(queue_handler)
+        queue_handler = None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+
+
+def reset_after_fork() -> None:
+    """
+    Leaves a forked child that runs other code (see PythonRunner) with logging
+    as a new interpreter has it. The listener thread isn't in the child, so
+    the queue handler would swallow every record, and basicConfig() would
+    do nothing while the root logger has a handler.
+    """
+    global listener, queue_handler
+    # os.fork() reinitialises the module and handler locks in the child,
+    # the detached handlers and their queue are never touched again
+    listener = None
+    queue_handler = None
+    loggers = [logging.getLogger()] + [
+        logger
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+atexit.register(stop_logging)
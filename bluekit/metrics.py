@@ -0,0 +1,277 @@
+import logging
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from bluekit.constants import METRICS_DUMP_INTERVAL, METRICS_HOST
+
+DURATION_BUCKETS = (1, 5, 10, 20, 40, 60, 120, 300, 600)
+PROBE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise Exception(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def format_labels(self, key: tuple, extra: tuple = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if len(pairs) == 0:
+            return ""
+        return (
+            "{"
+            + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs)
+            + "}"
+        )
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels))
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines += self.render_value(key, value)
+        return lines
+
+    def render_value(self, key: tuple, value) -> list:
+        return [f"{self.name}{self.format_labels(key)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        super().__init__(name, help, labelnames)
+        if len(self.labelnames) == 0:
+            self.values[()] = 0
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple = (),
+        buckets: tuple = DURATION_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            # cumulative bucket counts, sum, count
+            state = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render_value(self, key: tuple, value) -> list:
+        counts, total, count = value
+        lines = [
+            f"{self.name}_bucket{self.format_labels(key, [('le', format_value(bound))])} {bucket_count}"
+            for bound, bucket_count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_sum{self.format_labels(key)} {format_value(total)}")
+        lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise Exception(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple = (),
+        buckets: tuple = DURATION_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+# Shared by the engine, verifyconn and BlueKit of this process
+registry = MetricsRegistry()
+exploits_done = registry.counter(
+    "bluekit_exploits_done_total",
+    "Exploits run, by type and result code",
+    ("type", "code"),
+)
+exploits_pending = registry.gauge(
+    "bluekit_exploits_pending", "Exploits left in the running campaign", ("target",)
+)
+campaign_eta_seconds = registry.gauge(
+    "bluekit_campaign_eta_seconds",
+    "Expected seconds until the running campaign is done, from recorded durations",
+    ("target",),
+)
+exploit_duration_seconds = registry.histogram(
+    "bluekit_exploit_duration_seconds",
+    "Wall time of an exploit run including result processing",
+    ("hardware",),
+)
+exploit_timeouts = registry.counter(
+    "bluekit_exploit_timeouts_total", "Exploits killed after max_timeout", ("exploit",)
+)
+last_exploit_timestamp = registry.gauge(
+    "bluekit_last_exploit_timestamp_seconds",
+    "Unix time the last exploit finished, a stalled rig stops updating it",
+)
+liveness_probe_seconds = registry.histogram(
+    "bluekit_liveness_probe_seconds",
+    "Latency of a scan/connect/pair probe of the target, by returned status",
+    ("status",),
+    PROBE_BUCKETS,
+)
+adapter_resets = registry.counter(
+    "bluekit_adapter_resets_total", "Recoveries of an unresponsive controller"
+)
+policy_decisions = registry.counter(
+    "bluekit_policy_decisions_total",
+    "Decisions of the failure policy for unavailable targets",
+    ("decision",),
+)
+artifact_bytes_pulled = registry.counter(
+    "bluekit_artifact_bytes_pulled_total", "Bytes of exploit logs copied to the output"
+)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("MetricsServer -> " + format % args)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def start_http_exporter(
+    port: int, host: str = METRICS_HOST, registry: MetricsRegistry = registry
+):
+    server = MetricsServer((host, port), MetricsRequestHandler)
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"start_http_exporter -> serving metrics on {server.server_address}")
+    return server
+
+
+class MetricsFileWriter:
+    """
+    Dumps the registry to a file every `interval` seconds, e.g. for the
+    node_exporter textfile collector. The file is replaced atomically.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        interval: float = METRICS_DUMP_INTERVAL,
+        registry: MetricsRegistry = registry,
+    ):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+
+    def write(self) -> None:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}"
+        with open(temp_path, "w") as f:
+            f.write(self.registry.render())
+        os.replace(temp_path, self.path)
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logging.warning(
+                    f"MetricsFileWriter -> writing {self.path} failed - {e}"
+                )
+
+    def start(self) -> None:
+        self.write()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.write()
@@ -20,6 +20,17 @@ class Exploit():
             self.max_timeout = details["max_timeout"]
         except Exception as e:
             self.max_timeout = TIMEOUT
+
+        try:
+            self.requires = details["requires"]
+        except Exception as e:
+            self.requires = {}
+
+        # Kill the exploit once it reported its result over the bluekit protocol
+        try:
+            self.stop_on_result = details["stop_on_result"]
+        except Exception as e:
+            self.stop_on_result = False
     
     def to_json(self):
         return {
@@ -34,7 +45,9 @@ class Exploit():
             "parameters": self.parameters,
             "log_pull": self.log_pull,
             "directory": self.directory,
-            "max_timeout": self.max_timeout
+            "max_timeout": self.max_timeout,
+            "requires": self.requires,
+            "stop_on_result": self.stop_on_result
         }
 
 
@@ -0,0 +1,95 @@
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from bluekit.constants import (
+    POLICY_BACKOFF,
+    POLICY_EVENTS_FILE,
+    POLICY_MAX_BACKOFF,
+    POLICY_RETRIES,
+)
+from bluekit import metrics
+
+ASK = "ask"  # prompt on the terminal
+RETRY = "retry"  # probe the target again after a backoff
+SKIP = "skip"  # leave out the exploit about to run, it stays in the checkpoint
+PARK = "park"  # checkpoint, the target is resumed after the other targets
+NEXT = "next"  # checkpoint and give up on the target for this run
+ACTIONS = (ASK, RETRY, SKIP, PARK, NEXT)
+
+events_lock = threading.Lock()
+
+
+class FailurePolicy:
+    """
+    What a campaign does when its target fails check_target, written as
+    ACTION or retry[:RETRIES[:THEN]]. retry waits POLICY_BACKOFF seconds,
+    doubled for every next attempt up to POLICY_MAX_BACKOFF, and decides
+    THEN (park by default) once RETRIES attempts are used up.
+    """
+
+    def __init__(
+        self,
+        action: str = ASK,
+        retries: int = POLICY_RETRIES,
+        then: str = PARK,
+        backoff: float = POLICY_BACKOFF,
+        max_backoff: float = POLICY_MAX_BACKOFF,
+    ):
+        self.action = action
+        self.retries = retries
+        self.then = then
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def parse(cls, spec: str) -> "FailurePolicy":
+        # ValueError, argparse reports it as an invalid --failurepolicy
+        action, *options = spec.lower().split(":")
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown failure policy {action}")
+        if len(options) > 0 and action != RETRY:
+            raise ValueError(f"Only retry takes options, not {action}")
+        if len(options) > 2:
+            raise ValueError(f"Too many options in failure policy {spec}")
+        policy = cls(action)
+        if len(options) > 0:
+            policy.retries = int(options[0])
+        if len(options) > 1:
+            if options[1] in (RETRY, ASK) or options[1] not in ACTIONS:
+                raise ValueError(f"retry can't fall back to {options[1]}")
+            policy.then = options[1]
+        return policy
+
+    def __str__(self) -> str:
+        if self.action == RETRY:
+            return f"{RETRY}:{self.retries}:{self.then}"
+        return self.action
+
+    def decide(self, attempt: int) -> tuple:
+        """(decision, seconds to wait) for the attempt-th unavailability in a row"""
+        if self.action != RETRY:
+            return self.action, 0
+        if attempt > self.retries:
+            return self.then, 0
+        return RETRY, min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+
+def record_decision(target: str, decision: str, **details) -> None:
+    """Appends the decision to the target's events.jsonl"""
+    event = {
+        "event": "target_unavailable",
+        "time": time.time(),
+        "target": target,
+        "decision": decision,
+        **details,
+    }
+    path = POLICY_EVENTS_FILE.format(target=target)
+    with events_lock:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(event) + "\n")
+    metrics.policy_decisions.inc(decision=decision)
+    logging.info("FailurePolicy.record_decision -> %s", event)
@@ -0,0 +1,182 @@
+import cProfile
+import logging
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from tabulate import tabulate
+
+from bluekit.constants import (
+    GLOBAL_PROFILE_DIRECTORY,
+    PROFILE_DIRECTORY,
+    PROFILE_TOP_ALLOCATIONS,
+    PROFILE_TOP_FUNCTIONS,
+)
+
+# The profiler of this invocation, phases outside of --profile cost nothing
+current = None
+
+MEGABYTE = 1024 * 1024
+
+
+def format_function(function: tuple) -> str:
+    filename, line, name = function
+    if filename == "~":
+        return name  # built-in, e.g. <method 'poll' of 'select.poll' objects>
+    return f"{Path(filename).name}:{line}({name})"
+
+
+class Profiler:
+    """
+    Runs cProfile and tracemalloc per phase of an invocation and writes, for
+    each phase, the pstats file, its top functions and the allocations made
+    during the phase. Only the thread starting a phase is profiled, exploits
+    run in their own processes and are covered by the resource usage instead.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.phases = []
+        self.active = None
+
+    def start(self) -> None:
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self.save_summary()
+
+    @contextmanager
+    def phase(self, name: str):
+        if self.active is not None:
+            # cProfile can't nest, the outer phase already covers this block
+            yield
+            return
+        self.active = name
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            wall_seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            after = tracemalloc.take_snapshot()
+            self.active = None
+            self.save_phase(name, profile, before, after, wall_seconds, peak)
+
+    def save_phase(self, name, profile, before, after, wall_seconds, peak) -> None:
+        path = Path(self.directory)
+        profile.dump_stats(path / f"{name}.pstats")
+        stats = pstats.Stats(profile)
+
+        with open(path / f"{name}-functions.txt", "w") as f:
+            stats.stream = f
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+        allocations = after.filter_traces(filters).compare_to(
+            before.filter_traces(filters), "lineno"
+        )
+        with open(path / f"{name}-allocations.txt", "w") as f:
+            f.write(f"Peak traced memory: {peak / MEGABYTE:.1f} MB\n\n")
+            for allocation in allocations[:PROFILE_TOP_ALLOCATIONS]:
+                f.write(f"{allocation}\n")
+
+        own_times = [
+            (entry[2], function)
+            for function, entry in stats.stats.items()
+            if function[0] != "~"
+        ]
+        top_function = max(own_times, default=(0, None))
+        self.phases.append(
+            {
+                "name": name,
+                "wall_seconds": wall_seconds,
+                "calls": stats.total_calls,
+                "peak_bytes": peak,
+                "allocated_bytes": sum(a.size_diff for a in allocations),
+                "top_function": top_function[1],
+                "top_function_seconds": top_function[0],
+            }
+        )
+        logging.info("Profiler.save_phase -> %s - %s", name, self.phases[-1])
+
+    def format_summary(self) -> str:
+        table_data = [
+            [
+                phase["name"],
+                f"{phase['wall_seconds']:.2f}",
+                phase["calls"],
+                f"{phase['peak_bytes'] / MEGABYTE:.1f}",
+                f"{phase['allocated_bytes'] / MEGABYTE:.1f}",
+                (
+                    format_function(phase["top_function"])
+                    + f" {phase['top_function_seconds']:.2f}s"
+                    if phase["top_function"]
+                    else ""
+                ),
+            ]
+            for phase in self.phases
+        ]
+        return tabulate(
+            table_data,
+            [
+                "Phase",
+                "Wall (s)",
+                "Calls",
+                "Peak (MB)",
+                "Retained (MB)",
+                "Top self time",
+            ],
+            tablefmt="pretty",
+            colalign=("left",),
+        )
+
+    def save_summary(self) -> None:
+        summary = self.format_summary()
+        with open(Path(self.directory) / "summary.txt", "w") as f:
+            f.write(summary + "\n")
+        print(f"\nProfile of this run, details in {self.directory}\n")
+        print(summary)
+
+
+@contextmanager
+def profile_invocation(enabled: bool, target: str = None):
+    global current
+    if not enabled:
+        yield None
+        return
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    if target:
+        directory = PROFILE_DIRECTORY.format(target=target.lower(), timestamp=timestamp)
+    else:
+        directory = GLOBAL_PROFILE_DIRECTORY.format(timestamp=timestamp)
+    profiler = Profiler(directory)
+    profiler.start()
+    current = profiler
+    try:
+        yield profiler
+    finally:
+        current = None
+        profiler.stop()
+
+
+@contextmanager
+def phase(name: str):
+    """Profiles the enclosed block as its own phase when --profile is on"""
+    if current is None:
+        yield
+        return
+    with current.phase(name):
+        yield
@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from tqdm import tqdm
+
+from bluekit.constants import (
+    DURATION_HISTORY_FILE,
+    DURATION_HISTORY_WEIGHT,
+    PROGRESS_UPDATE_INTERVAL,
+)
+from bluekit import metrics
+
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class DurationHistory:
+    """
+    Expected run time per exploit, a moving average of the recorded runs
+    kept across campaigns. Exploits without history are expected to take
+    their max_timeout, so a fresh estimate errs on the late side.
+    """
+
+    def __init__(self, path: str = DURATION_HISTORY_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.durations = {}  # exploit name -> {"mean": seconds, "count": runs}
+        try:
+            with open(path) as f:
+                self.durations = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def expected(self, exploit) -> float:
+        with self.lock:
+            entry = self.durations.get(exploit.name)
+        if entry is None:
+            return float(exploit.max_timeout)
+        return entry["mean"]
+
+    def record(self, exploit_name: str, seconds: float) -> None:
+        with self.lock:
+            entry = self.durations.get(exploit_name)
+            if entry is None:
+                entry = {"mean": seconds, "count": 0}
+            else:
+                entry["mean"] += DURATION_HISTORY_WEIGHT * (seconds - entry["mean"])
+            entry["count"] += 1
+            self.durations[exploit_name] = entry
+            try:
+                self.save()
+            except OSError as e:
+                logging.warning("DurationHistory.record -> saving failed - %s", e)
+
+    def save(self) -> None:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}"
+        with open(temp_path, "w") as f:
+            json.dump(self.durations, f, indent=1)
+        os.replace(temp_path, self.path)
+
+
+class CampaignProgress:
+    """
+    Progress of one campaign weighted by the expected duration of every
+    exploit. Shown as a bar on a TTY and, with events_path, appended as
+    JSON lines for orchestration. Output of the running exploit refreshes
+    both, so a long exploit doesn't look like a stall.
+    """
+
+    def __init__(
+        self,
+        target: str,
+        exploits: list,
+        history: DurationHistory,
+        events_path: str = None,
+        show_bar: bool = True,
+    ):
+        self.target = target
+        self.history = history
+        self.expected = [history.expected(exploit) for exploit in exploits]
+        self.exploits = exploits
+        self.total = len(exploits)
+        self.done = 0
+        self.skipped = 0
+        self.pending_seconds = sum(self.expected)
+        self.started = time.monotonic()
+        self.current = None
+        self.current_started = None
+        self.current_fraction = None  # reported by the exploit, see bluekit.protocol
+        self.output_bytes = 0
+        self.last_update = 0
+        self.events = None
+        if events_path is not None:
+            Path(events_path).parent.mkdir(parents=True, exist_ok=True)
+            self.events = open(events_path, "a", buffering=1)
+        self.bar = None
+        if show_bar:
+            # desc holds the exploit count and ETA, tqdm's own ETA assumes equal steps
+            self.bar = tqdm(
+                total=1000,
+                bar_format="Testing exploits: {percentage:3.0f}%|{bar}| {desc}",
+            )
+        self.update("started")
+
+    def get_current_remaining(self) -> float:
+        if self.current is None:
+            return 0
+        elapsed = time.monotonic() - self.current_started
+        if self.current_fraction:
+            # The exploit's own progress beats the history once it reports any
+            return elapsed * (1 - self.current_fraction) / self.current_fraction
+        return max(self.expected[self.current] - elapsed, 0)
+
+    def get_state(self) -> dict:
+        remaining = self.pending_seconds + self.get_current_remaining()
+        elapsed = time.monotonic() - self.started
+        return {
+            "target": self.target,
+            "exploit": (
+                self.exploits[self.current].name if self.current is not None else None
+            ),
+            "done": self.done,
+            "skipped": self.skipped,
+            "total": self.total,
+            "fraction": elapsed / (elapsed + remaining) if elapsed + remaining else 1,
+            "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": round(remaining, 1),
+            "output_bytes": self.output_bytes,
+        }
+
+    def update(self, event: str, **details) -> None:
+        self.last_update = time.monotonic()
+        state = self.get_state()
+        metrics.campaign_eta_seconds.set(state["eta_seconds"], target=self.target)
+        if self.bar is not None:
+            self.bar.n = int(state["fraction"] * 1000)
+            self.bar.set_description_str(
+                f"{state['done']}/{state['total']} exploits, "
+                f"ETA {format_seconds(state['eta_seconds'])}"
+            )
+        if self.events is not None:
+            self.events.write(
+                json.dumps({"event": event, "time": time.time(), **state, **details})
+                + "\n"
+            )
+
+    def start_exploit(self, index: int) -> None:
+        self.current = index
+        self.current_started = time.monotonic()
+        self.current_fraction = None
+        self.output_bytes = 0
+        self.pending_seconds -= self.expected[index]
+        self.update("exploit_started")
+
+    def on_output(self, chunk: bytes) -> None:
+        self.output_bytes += len(chunk)
+        if time.monotonic() - self.last_update >= PROGRESS_UPDATE_INTERVAL:
+            self.update("output")
+
+    def on_exploit_event(self, event: dict) -> None:
+        details = {key: value for key, value in event.items() if key != "type"}
+        if event["type"] == "progress":
+            try:
+                self.current_fraction = min(max(float(event["fraction"]), 0), 1)
+            except (KeyError, TypeError, ValueError):
+                logging.info("CampaignProgress -> progress without fraction %s", event)
+        # Findings and results are passed on at once, progress only as often as output
+        if event["type"] != "progress" or (
+            time.monotonic() - self.last_update >= PROGRESS_UPDATE_INTERVAL
+        ):
+            self.update(f"exploit_{event['type']}", **details)
+
+    def finish_exploit(self, code: int = None) -> None:
+        elapsed = time.monotonic() - self.current_started
+        name = self.exploits[self.current].name
+        self.history.record(name, elapsed)
+        self.done += 1
+        self.current = None
+        self.current_fraction = None
+        self.update("exploit_done", finished=name, code=code)
+
+    # Not run in this campaign, e.g. the target or a resource wasn't available
+    def skip_exploit(self, index: int) -> None:
+        if self.current == index:
+            self.current = None
+            self.current_fraction = None
+        else:
+            self.pending_seconds -= self.expected[index]
+        self.skipped += 1
+        self.update("exploit_skipped", skipped=self.exploits[index].name)
+
+    def close(self) -> None:
+        finished = self.done + self.skipped == self.total
+        self.update("finished" if finished else "stopped")
+        if self.bar is not None:
+            self.bar.close()
+        if self.events is not None:
+            self.events.close()
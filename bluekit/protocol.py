@@ -0,0 +1,161 @@
+"""
+Line based result protocol between exploits and the engine.
+
+An exploit prints one JSON object per line behind the "BLUEKIT/1 " prefix:
+
+    BLUEKIT/1 {"type": "progress", "fraction": 0.5, "message": "pairing"}
+    BLUEKIT/1 {"type": "finding", "code": 2, "title": "LMP overflow", "data": "..."}
+    BLUEKIT/1 {"type": "artifact", "path": "capture.pcap", "description": "..."}
+    BLUEKIT/1 {"type": "result", "code": 2, "data": "..."}
+
+The legacy "BLUEEXPLOITER DATA: code=2, data=..." line is still understood
+and counts as a result. Output is parsed as it arrives, one pass per line.
+"""
+
+import json
+import logging
+import re
+
+from bluekit.constants import RETURN_CODE_VULNERABLE
+
+PROTOCOL_VERSION = 1
+PROTOCOL_PREFIX = b"BLUEKIT/"
+LEGACY_MARKER = b"BLUEEXPLOITER DATA:"
+LEGACY_RESULT = re.compile(rb"BLUEEXPLOITER DATA: code=(-?\d+), data=(.*)")
+EVENT_TYPES = ("result", "finding", "progress", "artifact")
+
+
+def emit(event_type: str, **fields) -> None:
+    line = json.dumps({"type": event_type, **fields})
+    print(f"{PROTOCOL_PREFIX.decode()}{PROTOCOL_VERSION} {line}", flush=True)
+
+
+def report_result(code: int, data: str = "") -> None:
+    emit("result", code=code, data=data)
+
+
+def report_finding(code: int, title: str, data: str = "") -> None:
+    emit("finding", code=code, title=title, data=data)
+
+
+def report_progress(fraction: float, message: str = "") -> None:
+    emit("progress", fraction=fraction, message=message)
+
+
+def report_artifact(path: str, description: str = "") -> None:
+    emit("artifact", path=path, description=description)
+
+
+class OutputParser:
+    """
+    Incremental parser of exploit output. Chunks can split lines anywhere,
+    the unfinished line is kept until its newline arrives. `listener` is
+    called with every event as soon as its line is complete.
+    """
+
+    def __init__(self, listener=None):
+        self.listener = listener
+        self.pending = []  # parts of the unfinished last line
+        self.result = None  # (code, data) of the first result
+        self.result_line = None
+        self.findings = []
+        self.artifacts = []
+        self.progress = None
+
+    def feed(self, chunk: bytes) -> None:
+        lines = chunk.split(b"\n")
+        if len(lines) == 1:
+            # Joined once the line is complete, appending per chunk would be quadratic
+            self.pending.append(chunk)
+            return
+        if len(self.pending) > 0:
+            lines[0] = b"".join(self.pending) + lines[0]
+            self.pending = []
+        if lines[-1]:
+            self.pending.append(lines[-1])
+        for line in lines[:-1]:
+            self.parse_line(line)
+
+    def close(self) -> None:
+        if len(self.pending) > 0:
+            self.parse_line(b"".join(self.pending))
+            self.pending = []
+
+    def parse_line(self, line: bytes) -> None:
+        line = line.rstrip(b"\r")
+        if line.startswith(PROTOCOL_PREFIX):
+            event = self.parse_event(line)
+        elif LEGACY_MARKER in line:
+            match = LEGACY_RESULT.search(line)
+            if match is None:
+                logging.info("OutputParser -> malformed legacy line %s", line[:200])
+                return
+            event = {
+                "type": "result",
+                "code": int(match.group(1)),
+                "data": match.group(2).decode(errors="replace"),
+            }
+        else:
+            return
+        if event is not None:
+            self.handle_event(event, line)
+
+    def parse_event(self, line: bytes):
+        version, _, payload = line[len(PROTOCOL_PREFIX) :].partition(b" ")
+        try:
+            if int(version) > PROTOCOL_VERSION:
+                logging.warning(
+                    "OutputParser -> unsupported protocol version %s", version
+                )
+                return None
+            event = json.loads(payload)
+        except ValueError:
+            logging.info("OutputParser -> malformed event %s", line[:200])
+            return None
+        if not isinstance(event, dict) or event.get("type") not in EVENT_TYPES:
+            logging.info("OutputParser -> unknown event %s", line[:200])
+            return None
+        if not self.is_valid(event):
+            logging.info("OutputParser -> malformed event %s", line[:200])
+            return None
+        return event
+
+    @staticmethod
+    def is_valid(event: dict) -> bool:
+        # Checked here so a broken exploit can't crash the engine while handling it
+        if event["type"] in ("result", "finding"):
+            code = event.get("code")
+            return isinstance(code, int) and not isinstance(code, bool)
+        if event["type"] == "artifact":
+            return isinstance(event.get("path"), str)
+        return True
+
+    def handle_event(self, event: dict, line: bytes) -> None:
+        if event["type"] == "result":
+            if self.result is not None:
+                return  # the first verdict counts, as with the legacy regex
+            self.result = (int(event["code"]), str(event.get("data", "")))
+            self.result_line = line
+        elif event["type"] == "finding":
+            self.findings.append(event)
+        elif event["type"] == "artifact":
+            self.artifacts.append(event["path"])
+        elif event["type"] == "progress":
+            self.progress = event
+        logging.info("OutputParser -> %s", event)
+        if self.listener is not None:
+            self.listener(event)
+
+    def get_verdict(self):
+        """
+        The reported result, else one derived from the findings: vulnerable
+        if any finding is, otherwise the code of the first one.
+        """
+        if self.result is not None:
+            return self.result
+        if len(self.findings) == 0:
+            return None
+        for finding in self.findings:
+            if finding.get("code") == RETURN_CODE_VULNERABLE:
+                return RETURN_CODE_VULNERABLE, finding.get("title", "")
+        return int(self.findings[0]["code"]), self.findings[0].get("title", "")
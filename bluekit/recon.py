@@ -5,10 +5,10 @@ import re
 import logging
 import time
 import signal
-from pybtool.device import Device
+from bluekit.device import Device, new_device
 
 from pathlib import Path
-from bluekit.verifyconn import check_device_status
+from bluekit.verifyconn import check_device_status, RETVAL_CONTROLLER_ERROR
 
 from bluekit.constants import (
     HCITOOL_INFO,
@@ -16,13 +16,14 @@ from bluekit.constants import (
     BLUING_BR_SDP,
     OUTPUT_DIRECTORY,
 )
-from bluekit.constants import LOG_FILE, REGEX_BT_MANUFACTURER
+from bluekit.constants import REGEX_BT_MANUFACTURER, DEFAULT_ADAPTER
+from bluekit.lease import leases
+from bluekit.hcimonitor import monitor
+from bluekit.tracing import span
 
 COMMANDS = [HCITOOL_INFO, SDPTOOL_INFO, BLUING_BR_SDP]
 invaisive_commands = [HCITOOL_INFO]
 
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO)
-
 
 class Recon:
     def __init__(self, mode: str = "classic"):
@@ -42,6 +43,8 @@ class Recon:
             print("Device advertising and connectable but not pairable")
         elif status == 5:
             print("Device advertising, connectable and pairable")
+        elif status == RETVAL_CONTROLLER_ERROR:
+            print("The local controller didn't answer")
 
     def run_command(self, target, command, filename):
         print(f"Running command -> {command}")
@@ -58,7 +61,12 @@ class Recon:
             return False
 
     def run_recon(
-        self, target: str, dev: Device = None, save: bool = True, timeout: int = 20
+        self,
+        target: str,
+        dev: Device = None,
+        save: bool = True,
+        timeout: int = 20,
+        adapter: str = DEFAULT_ADAPTER,
     ) -> bool:
         """
         Run the recon process on the target device.
@@ -70,9 +78,23 @@ class Recon:
         - Manufacturer
         - LMP features
         - Pairing features (i.e., I/O capabilities)
+        The adapter is leased for the whole recon, so other jobs can't use it meanwhile.
         """
+        with leases.lease(adapter), span("run_recon", target=target):
+            return self.run_recon_on_device(
+                target, dev, save, timeout, dev_id=get_dev_id(adapter)
+            )
+
+    def run_recon_on_device(
+        self,
+        target: str,
+        dev: Device = None,
+        save: bool = True,
+        timeout: int = 20,
+        dev_id: int = 0,
+    ) -> bool:
         if dev is None and self.mode == "classic":
-            dev = Device()
+            dev = new_device(dev_id)
         elif dev is None and self.mode == "le":
             # device = BcDevice()
             logging.error("LE recon not implemented yet")
@@ -87,18 +109,23 @@ class Recon:
         start_time = time.time()
         while not complete:
             # Check if dev is advertising
-            res[f"type"] = dev.scan(timeout=5, target=target)
+            with span("recon_scan"):
+                res[f"type"] = dev.scan(timeout=5, target=target)
             if res[f"type"] is not None:
                 res[f"advertising"] = True
             # Check if dev is connectable, default expect random address
-            if dev.connect(target):
+            with span("recon_connect"):
+                connected = dev.connect(target)
+            if connected:
                 res[f"connectable"] = True
                 # Tries to get the version and vendor
-                res["version"], res["vendor"] = dev.get_remote_version()
+                with span("recon_remote_version"):
+                    res["version"], res["vendor"] = dev.get_remote_version()
                 logging.info("Recon.py -> got version and vendor")
 
                 # Tries to get the ll/lmp remote features
-                features = dev.get_remote_features()
+                with span("recon_remote_features"):
+                    features = dev.get_remote_features()
                 print("Recon.py -> got remote features")
                 if self.mode == "classic":
                     res["lmp_features"] = features
@@ -106,16 +133,18 @@ class Recon:
                     res["ll_features"] = features
 
                 # Tries to get the pairing features (TODO: decode the value)
-                res[f"pairable"], res[f"pairing_features"] = dev.pair()
+                with span("recon_pair"):
+                    res[f"pairable"], res[f"pairing_features"] = dev.pair()
                 logging.info("Recon.py -> got pairing features")
 
                 dev.disconnect()
                 if not any(value is None for value in res.values()):  # Success
                     logging.info("Recon.py -> run_recon terminated successfully")
                     complete = True
-                elif time.time() - start_time > timeout:  # Timeout
-                    logging.info("Recon.py -> run_recon timed out")
-                    break
+            # Also for a device that is seen but never accepts the connection
+            if not complete and time.time() - start_time > timeout:  # Timeout
+                logging.info("Recon.py -> run_recon timed out")
+                break
 
         if complete and save:
             log_dir = OUTPUT_DIRECTORY.format(target=target, exploit="recon")
@@ -132,29 +161,12 @@ class Recon:
 
         return complete
 
-    # TODO: remove dependenci from hcidump
-    def start_hcidump(self):
-        logging.info("Starting hcidump -X...")
-        process = subprocess.Popen(
-            ["hcidump", "-X"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        return process
-
-    def stop_hcidump(self, process):
-        logging.info("Stopping hcidump -X...")
-        process.send_signal(subprocess.signal.SIGINT)
-        output, _ = process.communicate()
-        logging.info("hcidump -> " + str(output.decode()))
-        logging.info("hcidump -X stopped.")
-        return output
-
-    def get_hcidump(self, target):
-        hcidump_process = self.start_hcidump()
-        try:
-            time.sleep(1)
+    def get_hci_trace(self, target, path: str = None) -> list:
+        """HCI packets exchanged while checking the target, see bluekit.hcimonitor"""
+        # check_device_status runs on the default adapter
+        with monitor.capture(path, index=get_dev_id(DEFAULT_ADAPTER)) as packets:
             check_device_status(target=target)
-        finally:
-            return self.stop_hcidump(hcidump_process).decode().split("\n")
+        return packets
 
     def get_capabilities(self, target):
         data = load_recon_data_full(target)
@@ -179,6 +191,17 @@ class Recon:
         return data["lmp_features"] if self.mode == "classic" else data["ll_features"]
 
 
+def get_dev_id(adapter: str) -> int:
+    """hci1 -> 1"""
+    return int(adapter[len("hci") :])
+
+
+def has_recon_data(target: str) -> bool:
+    return Path(
+        OUTPUT_DIRECTORY.format(target=target, exploit="recon") + "recon.json"
+    ).exists()
+
+
 def load_recon_data_full(target: str):
     file_path = OUTPUT_DIRECTORY.format(target=target, exploit="recon") + "recon.json"
     if not Path(file_path).exists():
@@ -195,31 +218,6 @@ def load_recon_data(target: str):
     return data["vendor"], data["version"], data["type"]
 
 
-# def get_capabilities(self, target):
-#     output = self.get_hcidump(target)
-#     # Our capability is set as NoInputNoOutput so the other one should be a target device capability
-#     capabilities = set()
-#     numb_of_capabilities = 0
-#     for line in output:
-#         if line.strip().startswith("Capability:"):
-#             capabilities.add(line.strip().split(" ")[1])
-#             numb_of_capabilities += 1
-#     logging.info(
-#         "recon.py -> found the following capabilities " + str(capabilities)
-#     )
-#     if len(capabilities) == 0:
-#         logging.info("recon.py -> most likely legacy pairing")
-#         return None
-#     elif numb_of_capabilities == 1:
-#         logging.info("recon.py -> got only 1 capability " + str(capabilities))
-#         return capabilities.pop()
-#     capabilities.remove("NoInputNoOutput")
-#     capability = None
-#     if len(capabilities) == 0:
-#         return "NoInputNoOutput"
-#     else:
-#         return capabilities.pop()
-
 # def scan_additional_recon_data(self, target):
 #     # collect additional data - for now it's only capability
 
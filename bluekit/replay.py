@@ -0,0 +1,138 @@
+"""
+Offline replay of exploit transcripts recorded with --recordtranscripts.
+
+    python3 -m bluekit.replay check data/tests/<target>/transcripts/*.jsonl --speed 10
+    python3 -m bluekit.replay play <transcript> --speed 1
+
+Every transcript is played back by a child process, so it goes through
+Engine.execute_command and Engine.process_raw_data like a live exploit:
+timeouts, early termination on a result and verdict extraction all apply.
+check compares the replayed verdict with the recorded one.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from tabulate import tabulate
+
+from bluekit.constants import TYPE_DOS
+from bluekit.engine.engine import Engine
+from bluekit.engine.transcript import play, read_transcript
+from bluekit.protocol import OutputParser
+
+# Starting the replaying interpreter isn't part of the recorded run
+REPLAY_STARTUP_SECONDS = 2
+
+
+def replay_transcript(engine: Engine, path: str, speed: float = 1.0) -> dict:
+    header = read_transcript(path)["header"]
+    parser = OutputParser()
+    command = [sys.executable, "-m", "bluekit.replay", "play", path]
+    command += ["--speed", str(speed)]
+    started = time.monotonic()
+    if_failed, data = engine.execute_command(
+        header["target"],
+        command,
+        header["exploit"],
+        timeout=header["timeout"] / speed + REPLAY_STARTUP_SECONDS,
+        parser=parser,
+        stop_on_result=header.get("stop_on_result", False),
+    )
+    run_seconds = time.monotonic() - started
+    started = time.monotonic()
+    code, data = engine.process_raw_data(data, if_failed, parser)
+    return {
+        "code": code,
+        "data": data,
+        "run_seconds": run_seconds,
+        "parse_seconds": time.monotonic() - started,
+    }
+
+
+def check_transcripts(paths: list, speed: float = 1.0) -> list:
+    engine = Engine()
+    results = []
+    for path in paths:
+        transcript = read_transcript(path)
+        header = transcript["header"]
+        recorded = transcript["verdict"]
+        if header["type"] == TYPE_DOS or recorded is None:
+            # DoS verdicts come from pinging the target, not from the output
+            results.append(
+                {"path": path, "exploit": header["exploit"], "skipped": True}
+            )
+            continue
+        replayed = replay_transcript(engine, path, speed)
+        results.append(
+            {
+                "path": path,
+                "exploit": header["exploit"],
+                "skipped": False,
+                "recorded": recorded["code"],
+                "replayed": replayed["code"],
+                "match": (recorded["code"], recorded["data"])
+                == (replayed["code"], replayed["data"]),
+                "run_seconds": replayed["run_seconds"],
+                "parse_seconds": replayed["parse_seconds"],
+            }
+        )
+    return results
+
+
+def format_results(results: list) -> str:
+    rows = []
+    for result in results:
+        if result["skipped"]:
+            rows.append(
+                [os.path.basename(result["path"]), result["exploit"], "", "", "skipped"]
+            )
+            continue
+        rows.append(
+            [
+                os.path.basename(result["path"]),
+                result["exploit"],
+                result["recorded"],
+                result["replayed"],
+                "yes" if result["match"] else "NO",
+                f"{result['run_seconds']:.2f}",
+                f"{result['parse_seconds'] * 1000:.2f}",
+            ]
+        )
+    return tabulate(
+        rows,
+        ["Transcript", "Exploit", "Recorded", "Replayed", "Match", "Run s", "Parse ms"],
+        tablefmt="pretty",
+        colalign=("left", "left"),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bluekit transcript replay")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    play_parser = subparsers.add_parser("play", help="Write a transcript's output")
+    play_parser.add_argument("transcript")
+    play_parser.add_argument("--speed", default=1.0, type=float)
+
+    check_parser = subparsers.add_parser(
+        "check", help="Replay transcripts and compare the verdicts"
+    )
+    check_parser.add_argument("transcripts", nargs="+")
+    check_parser.add_argument("--speed", default=1.0, type=float)
+    args = parser.parse_args()
+
+    if args.command == "play":
+        sys.exit(play(args.transcript, args.speed))
+
+    results = check_transcripts(args.transcripts, args.speed)
+    print(format_results(results))
+    mismatches = [r for r in results if not r["skipped"] and not r["match"]]
+    if len(mismatches) > 0:
+        print(f"{len(mismatches)} of {len(results)} verdicts changed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
+import fcntl
 import json
 import logging
 import re
 import shutil
+import threading
+import time
+from contextlib import contextmanager
 from tabulate import tabulate
 from colorama import Fore, Back, Style, init
 from pathlib import Path
@@ -14,10 +18,14 @@ from bluekit.constants import (
     RETURN_CODE_NOT_VULNERABLE,
     RETURN_CODE_UNDEFINED,
     RETURN_CODE_VULNERABLE,
+    RETURN_CODE_NOT_APPLICABLE,
+    RETURN_CODE_NOT_TESTED,
 )
 from bluekit.constants import (
     TARGET_DIRECTORY,
+    NOT_APPLICABLE_FILE,
     REPORT_OUTPUT_FILE,
+    REPORT_INDEX_FILE,
     SKIP_DIRECTORIES,
     TOOLKIT_BLUEEXPLOITER_INSTALLATION_DIRECTORY,
     MAX_CHARS_DATA_TRUNCATION,
@@ -27,6 +35,8 @@ from bluekit.constants import (
     MACHINE_READABLE_REPORT_OUTPUT_FILE,
 )
 from bluekit.factories.exploitfactory import ExploitFactory
+from bluekit.engine.resources import format_resources
+from bluekit import snapshot
 
 
 def report_data(code, data):
@@ -54,15 +64,54 @@ def report_undefined(data):
     report_data(RETURN_CODE_UNDEFINED, data)
 
 
+# save_data of parallel campaigns and coordinator threads update the same index
+index_lock = threading.Lock()
+
+
+@contextmanager
+def lock_target(target):
+    """
+    Held for a read-modify-replace of index.json or not_applicable.json.
+    index_lock orders the threads of this process, an flock on a sidecar
+    file other bluekit processes (the daemon next to a --nodaemon run).
+    """
+    path = REPORT_INDEX_FILE.format(target=target) + ".lock"
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with index_lock, open(path, "a") as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
 class Report:
     def __init__(self, bluekit):
         self.exploitFactory = ExploitFactory()
         self.bluekit = bluekit
 
-    def save_data(self, exploit_name, target, data, code):
+    def save_data(
+        self,
+        exploit_name,
+        target,
+        data,
+        code,
+        resources=None,
+        findings=None,
+        artifacts=None,
+    ):
         doc = {"code": code, "data": data}
-        logging.info("Rport - save_data -> document -> " + str(doc))
-
+        if resources is not None:
+            doc["resources"] = resources
+        # Reported over the bluekit protocol, see bluekit.protocol
+        if findings:
+            doc["findings"] = findings
+        if artifacts:
+            doc["artifacts"] = artifacts
+        logging.info("Rport - save_data -> document -> %s", doc)
+
+        # Before writing the report, indexing an old target would count this run twice
+        self.update_index(target, exploit_name, doc)
         jsonfile = open(
             REPORT_OUTPUT_FILE.format(target=target, exploit=exploit_name), "w"
         )
@@ -70,6 +119,10 @@ class Report:
         jsonfile.close()
 
     def read_data(self, exploit_name, target):
+        doc = self.read_document(exploit_name, target)
+        return doc.get("code"), doc.get("data")
+
+    def read_document(self, exploit_name, target) -> dict:
         logging.info("Loading report output data")
         path = REPORT_OUTPUT_FILE.format(target=target, exploit=exploit_name)
         if Path(path).exists():
@@ -77,23 +130,137 @@ class Report:
                 REPORT_OUTPUT_FILE.format(target=target, exploit=exploit_name),
             )
             doc = json.load(jsonfile)
+            jsonfile.close()
             logging.info("Report output data is loaded")
-            logging.info("Report - read_data -> document -> " + str(doc))
-            return doc["code"], doc["data"]
-        return None, None
+            logging.info("Report - read_data -> document -> %s", doc)
+            return doc
+        return {}
+
+    def update_index(self, target, exploit_name, doc) -> None:
+        with lock_target(target):
+            index = self.read_index(target)
+            previous = index["exploits"].get(exploit_name, {})
+            index["exploits"][exploit_name] = {
+                **doc,
+                "first_run": previous.get("first_run", time.time()),
+                "last_run": time.time(),
+                "runs": previous.get("runs", 0) + 1,
+                "artifacts": sorted(
+                    set(self.get_artifacts(target, exploit_name))
+                    | set(doc.get("artifacts", []))
+                ),
+            }
+            self.save_index(target, index)
+
+    def read_index(self, target) -> dict:
+        """
+        Results of all finished exploits of the target, kept up to date by
+        save_data. Targets tested before the index existed are indexed once
+        from their exploit directories.
+        """
+        path = REPORT_INDEX_FILE.format(target=target)
+        try:
+            with open(path) as jsonfile:
+                return json.load(jsonfile)
+        except FileNotFoundError:
+            pass
+        index = self.build_index(target)
+        if len(index["exploits"]) > 0:
+            self.save_index(target, index)
+        return index
+
+    def build_index(self, target) -> dict:
+        index = {"exploits": {}}
+        path = Path(TARGET_DIRECTORY.format(target=target))
+        if not path.is_dir():
+            return index
+        for entry in path.iterdir():
+            if not entry.is_dir() or entry.name in SKIP_DIRECTORIES:
+                continue
+            # Directories without a report are left over from unfinished runs
+            doc = self.read_document(entry.name, target)
+            if len(doc) == 0:
+                continue
+            modified = (entry / Path(REPORT_OUTPUT_FILE).name).stat().st_mtime
+            index["exploits"][entry.name] = {
+                **doc,
+                "first_run": modified,
+                "last_run": modified,
+                "runs": 1,
+                "artifacts": self.get_artifacts(target, entry.name),
+            }
+        logging.info(
+            "Report.build_index -> indexed %d exploits of %s",
+            len(index["exploits"]),
+            target,
+        )
+        return index
+
+    def save_index(self, target, index) -> None:
+        path = REPORT_INDEX_FILE.format(target=target)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, "w") as jsonfile:
+            json.dump(index, jsonfile, indent=1)
+        os.replace(temp_path, path)
+
+    def save_snapshot(self, target, exploits: list, covered: list) -> str:
+        # Versioned copy of a campaign's results for diffing later runs, see bluekit.snapshot
+        index = self.read_index(target)
+        results = {
+            exploit: doc
+            for exploit, doc in index["exploits"].items()
+            if exploit in exploits
+        }
+        return snapshot.save_snapshot(
+            target, {"exploits": results}, self.get_recon(target), covered
+        )
+
+    def get_artifacts(self, target, exploit_name) -> list:
+        # Pulled logs and other files of the exploit, relative to the target directory
+        target_directory = Path(TARGET_DIRECTORY.format(target=target))
+        report_name = Path(REPORT_OUTPUT_FILE).name
+        return sorted(
+            str(path.relative_to(target_directory))
+            for path in (target_directory / exploit_name).rglob("*")
+            if path.is_file() and path.name != report_name
+        )
+
+    def save_not_applicable(self, target, not_applicable: dict, checked=None):
+        """
+        Merges the reasons into not_applicable.json. Exploits in checked that
+        have no reasons any more are removed, the rest of the file is kept
+        for the exploits checked by earlier calls.
+        """
+        Path(TARGET_DIRECTORY.format(target=target)).mkdir(parents=True, exist_ok=True)
+        with lock_target(target):
+            merged = {
+                exploit: reasons
+                for exploit, reasons in self.read_not_applicable(target).items()
+                if exploit not in (checked or [])
+            }
+            merged.update(not_applicable)
+            jsonfile = open(NOT_APPLICABLE_FILE.format(target=target), "w")
+            json.dump(merged, jsonfile, indent=6)
+            jsonfile.close()
+
+    def read_not_applicable(self, target) -> dict:
+        path = NOT_APPLICABLE_FILE.format(target=target)
+        if Path(path).exists():
+            jsonfile = open(path)
+            not_applicable = json.load(jsonfile)
+            jsonfile.close()
+            return not_applicable
+        return {}
 
     def get_done_exploits(self, target):
-        path = Path(TARGET_DIRECTORY.format(target=target))
-        exploits = [
-            entry.name
-            for entry in path.iterdir()
-            if entry.is_dir() and entry.name not in SKIP_DIRECTORIES
-        ]
-        logging.info("Extracted following completed exploits: " + str(exploits))
+        exploits = list(self.read_index(target)["exploits"])
+        logging.info("Extracted following completed exploits: %s", exploits)
         return exploits
 
     def generate_report(self, target):
-        done_exploits = self.get_done_exploits(target=target)
+        results = self.read_index(target)["exploits"]
+        done_exploits = list(results)
         all_exploits = self.exploitFactory.get_all_exploits()
         skipped_exploits = [
             exploit.name
@@ -101,22 +268,23 @@ class Report:
             if exploit.name not in done_exploits
         ]
 
-        logging.info("Report.generate_report -> done_exploits = " + str(done_exploits))
-        logging.info("Report.generate_report -> all_exploits = " + str(all_exploits))
+        logging.info("Report.generate_report -> done_exploits = %s", done_exploits)
+        logging.info("Report.generate_report -> all_exploits = %s", all_exploits)
         logging.info(
-            "Report.generate_report -> skipped_exploits = " + str(skipped_exploits)
+            "Report.generate_report -> skipped_exploits = %s", skipped_exploits
         )
 
-        headers = ["Index", "Exploit", "Result", "Data"]
+        headers = ["Index", "Exploit", "Result", "Data", "Resources"]
         table_data = []
         index = 1
         sorted_done_exploits = sorted(done_exploits, key=lambda x: x[2])
         for exploit in sorted_done_exploits:
-            code, data = self.read_data(exploit_name=exploit, target=target)
+            doc = results[exploit]
+            code, data = doc.get("code"), doc.get("data")
             if code is None:
                 code = RETURN_CODE_NONE_OF_4_STATE_OBSERVED
                 data = "Error during loading the report"
-            logging.info("data - " + str(data))
+            logging.info("data - %s", data)
             if data is None:
                 data = "Error with data"
             symbol = ""
@@ -182,49 +350,63 @@ class Report:
                         data[:MAX_CHARS_DATA_TRUNCATION],
                     ]
                 )
+            table_data[-1].append(format_resources(doc.get("resources")))
             index += 1
+        not_applicable = self.read_not_applicable(target=target)
         for skipped_exploit in skipped_exploits:
-            table_data.append(
-                [
-                    index,
-                    f"{Fore.WHITE}{skipped_exploit}{Style.RESET_ALL}",
-                    f"{Fore.WHITE}Not tested{Style.RESET_ALL}",
-                    "",
-                ]
-            )
+            if skipped_exploit in not_applicable:
+                table_data.append(
+                    [
+                        index,
+                        f"{Fore.WHITE}{skipped_exploit}{Style.RESET_ALL}",
+                        f"{Fore.WHITE}Skipped – not applicable{Style.RESET_ALL}",
+                        ", ".join(not_applicable[skipped_exploit])[
+                            :MAX_CHARS_DATA_TRUNCATION
+                        ],
+                        "",
+                    ]
+                )
+            else:
+                table_data.append(
+                    [
+                        index,
+                        f"{Fore.WHITE}{skipped_exploit}{Style.RESET_ALL}",
+                        f"{Fore.WHITE}Not tested{Style.RESET_ALL}",
+                        "",
+                        "",
+                    ]
+                )
             index += 1
 
-        logging.info("Report.generate_report -> table_data = " + str(table_data))
+        logging.info("Report.generate_report -> table_data = %s", table_data)
 
         table = tabulate(
             table_data,
             headers,
             tablefmt="pretty",
-            colalign=("center", "left", "left", "left"),
+            colalign=("center", "left", "left", "left", "left"),
         )
 
         return table
 
-    def get_manufacturer(self, target) -> str:
+    def get_recon(self, target) -> dict:
         file_path = Path(
             OUTPUT_DIRECTORY.format(target=target, exploit="recon") + "recon.json"
         )
         if file_path.is_file():
             with open(file_path, "r") as f:
-                data = json.load(f)
-                return data["vendor"]
+                return json.load(f)
+        return {}
+
+    def get_manufacturer(self, target) -> str:
+        return self.get_recon(target).get("vendor")
 
     def get_bt_version(self, target) -> float:
-        file_path = Path(
-            OUTPUT_DIRECTORY.format(target=target, exploit="recon") + "recon.json"
-        )
-        if file_path.is_file():
-            with open(file_path, "r") as f:
-                data = json.load(f)
-                return data["version"]
+        return self.get_recon(target).get("version")
 
-    def generate_machine_readable_report(self, target):
-        done_exploits = self.get_done_exploits(target=target)
+    def generate_machine_readable_report(self, target, original_dir=None):
+        results = self.read_index(target)["exploits"]
+        done_exploits = list(results)
         all_exploits = self.exploitFactory.get_all_exploits()
         skipped_exploits = [
             exploit.name
@@ -232,10 +414,10 @@ class Report:
             if exploit.name not in done_exploits
         ]
 
-        logging.info("Report.generate_report -> done_exploits = " + str(done_exploits))
-        logging.info("Report.generate_report -> all_exploits = " + str(all_exploits))
+        logging.info("Report.generate_report -> done_exploits = %s", done_exploits)
+        logging.info("Report.generate_report -> all_exploits = %s", all_exploits)
         logging.info(
-            "Report.generate_report -> skipped_exploits = " + str(skipped_exploits)
+            "Report.generate_report -> skipped_exploits = %s", skipped_exploits
         )
 
         index = 1
@@ -245,31 +427,51 @@ class Report:
         sorted_done_exploits_json = []
         skipped_exploits_json = []
         for exploit in sorted_done_exploits:
-            code, data = self.read_data(exploit_name=exploit, target=target)
+            doc = results[exploit]
+            code, data = doc.get("code"), doc.get("data")
             if code is None:
                 code = RETURN_CODE_NONE_OF_4_STATE_OBSERVED
                 data = "Error during loading the report"
-            logging.info("data - " + str(data))
+            logging.info("data - %s", data)
             sorted_done_exploits_json.append(
-                {"index": index, "name": exploit, "code": code, "data": data}
-            )
-            index += 1
-        for skipped_exploit in skipped_exploits:
-            skipped_exploits_json.append(
                 {
                     "index": index,
-                    "name": skipped_exploit,
-                    "code": 6,
-                    "data": "Not tested",
+                    "name": exploit,
+                    "code": code,
+                    "data": data,
+                    "resources": doc.get("resources"),
                 }
             )
             index += 1
+        not_applicable = self.read_not_applicable(target=target)
+        for skipped_exploit in skipped_exploits:
+            if skipped_exploit in not_applicable:
+                skipped_exploits_json.append(
+                    {
+                        "index": index,
+                        "name": skipped_exploit,
+                        "code": RETURN_CODE_NOT_APPLICABLE,
+                        "data": "Skipped – not applicable: "
+                        + ", ".join(not_applicable[skipped_exploit]),
+                    }
+                )
+            else:
+                skipped_exploits_json.append(
+                    {
+                        "index": index,
+                        "name": skipped_exploit,
+                        "code": RETURN_CODE_NOT_TESTED,
+                        "data": "Not tested",
+                    }
+                )
+            index += 1
 
         output_json["done_exploits"] = sorted_done_exploits_json
         output_json["skipped_exploits"] = skipped_exploits_json
         output_json["manually_added_exploits"] = list()
-        output_json["bt_version"] = self.get_bt_version(target=target)
-        output_json["manufacturer"] = self.get_manufacturer(target=target)
+        recon = self.get_recon(target=target)
+        output_json["bt_version"] = recon.get("version")
+        output_json["manufacturer"] = recon.get("vendor")
         output_json["mac_address"] = target
         output_json["vehicle_name"] = ""
         output_json["vehicle manufacturer"] = ""
@@ -293,7 +495,9 @@ class Report:
         # Copy the report to current directory with MAC address in filename
 
         # Get the original directory from BlueKit instance
-        dest_file = os.path.join(self.bluekit.original_dir, f"{target}_report.json")
+        if original_dir is None:
+            original_dir = self.bluekit.original_dir
+        dest_file = os.path.join(original_dir, f"{target}_report.json")
         logging.info(f"Attempting to copy report to: {dest_file}")
         try:
             shutil.copy2(source_file, dest_file)
@@ -0,0 +1,203 @@
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from glob import glob
+
+from bluekit.constants import (
+    ESP32_DEFAULT_HOST_PORT,
+    ESP32_TTY_GLOB,
+    HARDWARE_REDISCOVERY_INTERVAL,
+    LEASE_POLL_INTERVAL,
+)
+from bluekit.lease import LeaseTimeout, leases
+from bluekit.setupverfication.setupverification import (
+    INTERNABLUE_CHECK_SETUP,
+    INTERNABLUE_CHECK_SETUP_GET_NEXUS,
+)
+
+
+class HardwareResource:
+    """
+    One physical setup an exploit can run on, e.g. an ESP32 board (identified
+    by its host port) or a Nexus 5 (identified by its adb serial).
+    """
+
+    def __init__(self, hardware: str, resource_id: str, substitutions=None, env=None):
+        self.hardware = hardware
+        self.resource_id = resource_id
+        self.substitutions = substitutions if substitutions is not None else {}
+        self.env = env if env is not None else {}
+
+    def apply(self, exploit_command: list) -> list:
+        command = []
+        for part in exploit_command:
+            for old, new in self.substitutions.items():
+                part = part.replace(old, new)
+            command.append(part)
+        return command
+
+    def __repr__(self):
+        return f"{self.hardware}:{self.resource_id}"
+
+
+def get_usb_parent(tty: str):
+    # Both serial ports of an ESP32 board hang off the same USB device
+    return get_usb_device(f"/sys/class/tty/{os.path.basename(tty)}/device")
+
+
+def get_usb_device(sysfs_path: str):
+    device = os.path.realpath(sysfs_path)
+    while device != "/" and not os.path.exists(os.path.join(device, "idVendor")):
+        device = os.path.dirname(device)
+    return None if device == "/" else device
+
+
+def tty_number(tty: str) -> int:
+    match = re.search(r"(\d+)$", tty)
+    return int(match.group(1)) if match else 0
+
+
+def discover_esp32() -> list:
+    ttys = sorted(glob(ESP32_TTY_GLOB), key=tty_number)
+    groups = {}
+    for tty in ttys:
+        parent = get_usb_parent(tty)
+        groups.setdefault(parent, []).append(tty)
+
+    if None in groups or (len(groups) == 1 and len(ttys) > 2):
+        # No usable sysfs information, fall back to consecutive ports
+        pairs = [ttys[i : i + 2] for i in range(0, len(ttys) - 1, 2)]
+    else:
+        pairs = [group for group in groups.values() if len(group) >= 2]
+
+    # The second port of a pair is the host port bt_exploiter talks to
+    return [
+        HardwareResource(
+            "esp32", pair[1], substitutions={ESP32_DEFAULT_HOST_PORT: pair[1]}
+        )
+        for pair in pairs
+    ]
+
+
+def list_nexus5_devices() -> list:
+    devices = []
+    try:
+        output = subprocess.check_output(
+            INTERNABLUE_CHECK_SETUP, shell=True, stderr=subprocess.PIPE
+        ).decode()
+    except subprocess.CalledProcessError:
+        logging.info("HardwarePool -> list_nexus5_devices -> adb is not available")
+        return devices
+    for line in output.split("\n"):
+        if "\tdevice" in line:
+            device = line.split("\t")[0]
+            try:
+                properties = subprocess.check_output(
+                    INTERNABLUE_CHECK_SETUP_GET_NEXUS.format(device=device),
+                    shell=True,
+                    stderr=subprocess.PIPE,
+                ).decode()
+            except subprocess.CalledProcessError:
+                continue
+            if "[ro.product.model]: [Nexus 5]" in properties:
+                devices.append(device)
+    return devices
+
+
+def discover_nexus5() -> list:
+    return [
+        HardwareResource("nexus5", serial, env={"ANDROID_SERIAL": serial})
+        for serial in list_nexus5_devices()
+    ]
+
+
+# Hardware name -> discovery function returning HardwareResources
+hardware_discovery = {
+    "esp32": discover_esp32,
+    "nexus5": discover_nexus5,
+}
+
+
+class HardwarePool:
+    """
+    Hands out exclusive leases on every discovered board and phone, so that
+    several campaigns can share one host without driving the same hardware.
+    Hardware without a discovery function (e.g. the default adapter) is not
+    pooled and lease() yields None for it. A campaign waits for busy
+    hardware, and for hardware that isn't plugged in yet, until its timeout.
+    """
+
+    def __init__(self):
+        self.resources = {}
+        self.leased = set()
+        self.condition = threading.Condition()
+
+    def discover(self, hardware_names: list = None) -> dict:
+        resources = {}
+        for hardware in hardware_names or list(hardware_discovery):
+            resources[hardware] = hardware_discovery[hardware]()
+            logging.info(f"HardwarePool -> discovered {resources[hardware]}")
+        with self.condition:
+            self.resources.update(resources)
+            self.condition.notify_all()
+        return resources
+
+    def is_pooled(self, hardware: str) -> bool:
+        return hardware in hardware_discovery
+
+    def size(self, hardware: str) -> int:
+        return len(self.resources.get(hardware, []))
+
+    def try_acquire(self, hardware: str):
+        # Other bluekit processes on this host are excluded by the lease files
+        for resource in self.resources.get(hardware, []):
+            if resource.resource_id not in self.leased and leases.try_acquire(
+                resource.resource_id
+            ):
+                self.leased.add(resource.resource_id)
+                return resource
+        return None
+
+    def acquire(self, hardware: str, timeout: float = None) -> HardwareResource:
+        end = None if timeout is None else time.monotonic() + timeout
+        rediscover = time.monotonic() + HARDWARE_REDISCOVERY_INTERVAL
+        if self.size(hardware) == 0:
+            print(f"No {hardware} in the pool, waiting for one to be plugged in")
+        with self.condition:
+            while True:
+                resource = self.try_acquire(hardware)
+                if resource is not None:
+                    logging.info(f"HardwarePool -> leased {resource}")
+                    return resource
+                if self.size(hardware) == 0 and time.monotonic() >= rediscover:
+                    self.discover([hardware])
+                    rediscover = time.monotonic() + HARDWARE_REDISCOVERY_INTERVAL
+                    continue
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise LeaseTimeout(f"Timed out waiting for {hardware} hardware")
+                if remaining is None or remaining > LEASE_POLL_INTERVAL:
+                    remaining = LEASE_POLL_INTERVAL
+                self.condition.wait(remaining)
+
+    def release(self, resource: HardwareResource) -> None:
+        with self.condition:
+            leases.release(resource.resource_id)
+            self.leased.discard(resource.resource_id)
+            self.condition.notify_all()
+        logging.info(f"HardwarePool -> released {resource}")
+
+    @contextmanager
+    def lease(self, hardware: str, timeout: float = None):
+        if not self.is_pooled(hardware):
+            yield None
+            return
+        resource = self.acquire(hardware, timeout=timeout)
+        try:
+            yield resource
+        finally:
+            self.release(resource)
@@ -1,30 +1,96 @@
 import subprocess
 import logging
+import threading
+import time
+import os
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+
+from bluekit.constants import SETUP_VERIFICATION_TTL, SETUP_VERIFICATION_WATCH_PATHS
 
 BRAKTOOTH_CHECK_SETUP = "ls /dev/ttyUSB*"
 
 INTERNABLUE_CHECK_SETUP = "adb devices"
 INTERNABLUE_CHECK_SETUP_GET_NEXUS = "adb -s {device} shell getprop"
 
+# Hardware name -> verification function, filled by @register_verifier
+hardware_verfier = {}
+
+
+def register_verifier(name: str):
+    def decorator(function):
+        hardware_verfier[name] = function
+        return function
+
+    return decorator
+
+
+def get_device_stamp() -> tuple:
+    """
+    Modification times of /dev and the USB bus directories. They change
+    whenever a device node is added or removed, so a different stamp means
+    a board or phone was plugged in or out since the last check.
+    """
+    stamp = []
+    for pattern in SETUP_VERIFICATION_WATCH_PATHS:
+        for path in sorted(glob(pattern)):
+            try:
+                stamp.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                pass
+    return tuple(stamp)
+
 
 class SetupVerifier:
-    def verify_setup(self, hardware) -> bool:
+    def __init__(self, ttl: float = SETUP_VERIFICATION_TTL):
+        self.ttl = ttl
+        self.cache = {}  # hardware name -> (result, checked at, device stamp)
+        self.lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.cache = {}
+
+    def get_cached(self, name: str, device_stamp: tuple):
+        with self.lock:
+            if name not in self.cache:
+                return None
+            result, checked_at, stamp = self.cache[name]
+        if stamp != device_stamp or time.monotonic() - checked_at > self.ttl:
+            return None
+        return result
+
+    def verify_setup(self, hardware, device_stamp: tuple = None) -> bool:
         if hardware.needs_setup_verification:
             if hardware.name not in hardware_verfier:
                 logging.warning(f"Hardware - {hardware.name} is not registered")
                 return False
 
-            return hardware_verfier[hardware.name]()
+            if device_stamp is None:
+                device_stamp = get_device_stamp()
+            result = self.get_cached(hardware.name, device_stamp)
+            if result is None:
+                result = hardware_verfier[hardware.name]()
+                with self.lock:
+                    self.cache[hardware.name] = (result, time.monotonic(), device_stamp)
+            return result
 
         return True
 
     def verify_setup_multiple_hardware(self, multiple_hardware) -> dict:
-        hardware_verification = {}
-        for hardware in multiple_hardware:
-            hardware_verification[hardware.name] = self.verify_setup(hardware)
-        return hardware_verification
+        device_stamp = get_device_stamp()
+        with ThreadPoolExecutor(max_workers=max(1, len(multiple_hardware))) as pool:
+            results = pool.map(
+                lambda hardware: self.verify_setup(hardware, device_stamp),
+                multiple_hardware,
+            )
+            return {
+                hardware.name: result
+                for hardware, result in zip(multiple_hardware, results)
+            }
 
     @staticmethod
+    @register_verifier("esp32")
     def check_setup_esp32() -> bool:
         try:
             output = (
@@ -47,6 +113,7 @@ class SetupVerifier:
         return False
 
     @staticmethod
+    @register_verifier("nexus5")
     def check_setup_nexus5() -> bool:
         try:
             output = subprocess.check_output(
@@ -72,10 +139,3 @@ class SetupVerifier:
             )
         logging.info("SetupVerfier -> check_setup_nexus5 -> Setup is not ready")
         return False
-
-
-# Add your hardware verification function
-hardware_verfier = {
-    "esp32": SetupVerifier.check_setup_esp32,
-    "nexus5": SetupVerifier.check_setup_nexus5,
-}
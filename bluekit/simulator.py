@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+from bluekit.constants import (
+    SIMULATOR_CONFIG_FILE,
+    SIMULATOR_STATE_FILE,
+    TYPE_DOS,
+    TYPE_POC,
+)
+from bluekit import protocol
+
+# Behaviour of a simulated target, override per target in simulator.json:
+# {"seed": 1, "targets": {"aa:bb:cc:dd:ee:ff": {"pair_latency": 2.0}}}
+DEFAULT_TARGET = {
+    "advertising": True,
+    "connectable": True,
+    "pairable": True,
+    "type": "BR/EDR",
+    "name": "Simulated Target",
+    "rssi": -60,
+    "version": 5.0,
+    "vendor": "Simulated Vendor",
+    "lmp_features": {"page0": {"secure_simple_pairing": True}},
+    "pairing_features": {"io_capabilities": "NoInputNoOutput"},
+    "scan_latency": 0.1,
+    "connect_latency": 0.1,
+    "pair_latency": 0.1,
+    "scan_failure_probability": 0.0,
+    "connect_failure_probability": 0.0,
+    "pair_failure_probability": 0.0,
+    "reboot_time": 5.0,  # seconds the target stays down after a DoS
+}
+
+
+def load_config(config_file: str = SIMULATOR_CONFIG_FILE) -> dict:
+    if Path(config_file).exists():
+        with open(config_file) as f:
+            return json.load(f)
+    return {}
+
+
+def get_target_config(target: str, config: dict) -> dict:
+    target_config = dict(DEFAULT_TARGET)
+    target_config.update(config.get("defaults", {}))
+    target_config.update(config.get("targets", {}).get(target.lower(), {}))
+    return target_config
+
+
+def load_state(state_file: str = SIMULATOR_STATE_FILE) -> dict:
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def mark_target_down(target: str, seconds: float, state_file=SIMULATOR_STATE_FILE):
+    state = load_state(state_file)
+    state[target.lower()] = {"down_until": time.time() + seconds}
+    temp_file = f"{state_file}.{os.getpid()}"
+    with open(temp_file, "w") as f:
+        json.dump(state, f)
+    os.replace(temp_file, state_file)
+
+
+def is_target_down(target: str, state_file=SIMULATOR_STATE_FILE) -> bool:
+    return (
+        load_state(state_file).get(target.lower(), {}).get("down_until", 0)
+        > time.time()
+    )
+
+
+class SimulatedDevice:
+    """
+    Stand-in for pybtool.device.Device. Targets behave as configured in
+    simulator.json, with latencies, random failures and downtime after a
+    simulated DoS shared between processes through the state file.
+    """
+
+    def __init__(self, dev_id: int = 0, config: dict = None):
+        self.dev_id = dev_id
+        self.config = config if config is not None else load_config()
+        self.random = random.Random(self.config.get("seed"))
+        self.powered = False
+        self.connected = None
+
+    def attempt(self, target: str, operation: str) -> bool:
+        target_config = get_target_config(target, self.config)
+        time.sleep(target_config[f"{operation}_latency"])
+        if is_target_down(target):
+            return False
+        return self.random.random() >= target_config[f"{operation}_failure_probability"]
+
+    def power_on(self):
+        self.powered = True
+
+    def power_off(self):
+        self.powered = False
+        self.connected = None
+
+    def scan(self, timeout: int = 5, target: str = None):
+        if target is None:
+            return None
+        target_config = get_target_config(target, self.config)
+        if not target_config["advertising"] or not self.attempt(target, "scan"):
+            return None
+        return target_config["type"]
+
+    def find(self, duration: float = 0) -> list:
+        """Like btmgmt find, every configured target that advertises and is up"""
+        found = []
+        for target in self.config.get("targets", {}):
+            target_config = get_target_config(target, self.config)
+            if target_config["advertising"] and not is_target_down(target):
+                found.append(
+                    {
+                        "address": target.lower(),
+                        "type": target_config["type"],
+                        "rssi": target_config["rssi"],
+                        "name": target_config["name"],
+                    }
+                )
+        time.sleep(min(duration, DEFAULT_TARGET["scan_latency"]))
+        return found
+
+    def connect(self, target: str) -> bool:
+        target_config = get_target_config(target, self.config)
+        if not target_config["connectable"] or not self.attempt(target, "connect"):
+            return False
+        self.connected = target
+        return True
+
+    def disconnect(self):
+        self.connected = None
+
+    def pair(self):
+        if self.connected is None:
+            return False, None
+        target_config = get_target_config(self.connected, self.config)
+        if not target_config["pairable"] or not self.attempt(self.connected, "pair"):
+            return False, None
+        return True, target_config["pairing_features"]
+
+    def get_remote_version(self):
+        if self.connected is None:
+            return None, None
+        target_config = get_target_config(self.connected, self.config)
+        return target_config["version"], target_config["vendor"]
+
+    def get_remote_features(self):
+        if self.connected is None:
+            return None
+        return get_target_config(self.connected, self.config)["lmp_features"]
+
+
+def run_exploit(args) -> None:
+    """Fake exploit script printing the usual BLUEEXPLOITER DATA line or protocol events."""
+    time.sleep(args.delay)
+    if args.output_bytes > 0:
+        line = b"x" * 1023 + b"\n"
+        remaining = args.output_bytes
+        while remaining > 0:
+            sys.stdout.buffer.write(line[:remaining])
+            remaining -= len(line)
+        sys.stdout.buffer.flush()
+    if args.dos:
+        config = get_target_config(args.target, load_config())
+        mark_target_down(args.target, config["reboot_time"])
+    if args.protocol:
+        protocol.report_progress(0.5, "simulated attack")
+        protocol.report_finding(args.code, "simulated finding", args.data)
+        protocol.report_result(args.code, args.data)
+        time.sleep(args.linger)  # stop_on_result doesn't wait for this
+    else:
+        print(f"BLUEEXPLOITER DATA: code={args.code}, data={args.data}")
+
+
+def write_catalog(home: str, count: int, delay: float = 0.1, output_bytes: int = 0):
+    """Creates a BLUEKIT_HOME with `count` fake exploits for hardware-free runs."""
+    for directory in ["exploits", "hardware", "data/tests", ".logs"]:
+        Path(home, directory).mkdir(parents=True, exist_ok=True)
+    with open(Path(home, "hardware", "default.yaml"), "w") as f:
+        yaml.safe_dump(
+            {
+                "name": "default",
+                "description": "Simulated adapter",
+                "setup_verification": "",
+                "needs_setup_verification": False,
+                "working_directory": None,
+                "bt_version_min": 1.0,
+                "bt_version_max": 5.4,
+            },
+            f,
+        )
+    for index in range(count):
+        dos = index % 4 == 3
+        command = f"{sys.executable} -m bluekit.simulator exploit --code {1 + index % 2} --delay {delay} --output-bytes {output_bytes}"
+        if dos:
+            command += " --dos"
+        exploit = {
+            "name": f"simulated_{index:05d}",
+            "author": "bluekit simulator",
+            "type": TYPE_DOS if dos else TYPE_POC,
+            "mass_testing": True,
+            "bt_version_min": 1.0,
+            "bt_version_max": 5.4,
+            "hardware": "default",
+            "command": command,
+            "parameters": [
+                {
+                    "name": "--target",
+                    "name_required": True,
+                    "type": "str",
+                    "help": "Target MAC address",
+                    "required": True,
+                    "is_target_param": True,
+                    "parameter_connector": " ",
+                }
+            ],
+            "log_pull": {"in_command": False, "from_directory": False},
+            "directory": {"change": False},
+        }
+        with open(Path(home, "exploits", f"{exploit['name']}.yaml"), "w") as f:
+            yaml.safe_dump(exploit, f, sort_keys=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bluekit target simulator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    exploit_parser = subparsers.add_parser("exploit", help="Run a fake exploit")
+    exploit_parser.add_argument("--target", required=True, type=str)
+    exploit_parser.add_argument("--code", default=1, type=int)
+    exploit_parser.add_argument("--data", default="simulated", type=str)
+    exploit_parser.add_argument("--delay", default=0.1, type=float)
+    exploit_parser.add_argument("--output-bytes", default=0, type=int)
+    exploit_parser.add_argument("--dos", action="store_true")
+    exploit_parser.add_argument(
+        "--protocol", action="store_true", help="Report over the bluekit protocol"
+    )
+    exploit_parser.add_argument("--linger", default=0, type=float)
+
+    setup_parser = subparsers.add_parser(
+        "setup", help="Create a simulated BLUEKIT_HOME"
+    )
+    setup_parser.add_argument("home", type=str)
+    setup_parser.add_argument("--exploits", default=40, type=int)
+    setup_parser.add_argument("--delay", default=0.1, type=float)
+    setup_parser.add_argument("--output-bytes", default=0, type=int)
+
+    args = parser.parse_args()
+    if args.command == "exploit":
+        run_exploit(args)
+    elif args.command == "setup":
+        write_catalog(args.home, args.exploits, args.delay, args.output_bytes)
+        print(
+            f"Simulated setup created, run bluekit with BLUEKIT_HOME={args.home} --simulate"
+        )
+
+
+if __name__ == "__main__":
+    main()
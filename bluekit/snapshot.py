@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from tabulate import tabulate
+
+from bluekit.constants import RUN_SNAPSHOT_DIRECTORY, TESTS_DIRECTORY
+from bluekit.fleet import get_verdict, read_json
+
+CURRENT = "current"  # selects the live index instead of a snapshot
+
+
+def save_snapshot(target: str, index: dict, recon: dict, covered: list = None) -> str:
+    """
+    Freezes the results and recon data of a finished campaign. covered names
+    the exploits the campaign ran or tried to run, by default those with a
+    result in index.
+    """
+    directory = Path(RUN_SNAPSHOT_DIRECTORY.format(target=target))
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"run-{time.strftime('%Y%m%d-%H%M%S')}"
+    path = directory / f"{name}.json"
+    suffix = 1
+    while path.exists():
+        suffix += 1
+        path = directory / f"{name}-{suffix}.json"
+    snapshot = {
+        "target": target,
+        "created": time.time(),
+        "exploits": {
+            exploit: {key: doc.get(key) for key in ("code", "data", "last_run")}
+            for exploit, doc in index["exploits"].items()
+        },
+        "covered": sorted(index["exploits"] if covered is None else covered),
+        "recon": recon,
+    }
+    temp_path = f"{path}.{os.getpid()}"
+    with open(temp_path, "w") as f:
+        json.dump(snapshot, f, indent=1)
+    os.replace(temp_path, path)
+    logging.info("save_snapshot -> %s", path)
+    return str(path)
+
+
+def list_snapshots(target: str) -> list:
+    """Snapshot files of the target, oldest first"""
+    directory = RUN_SNAPSHOT_DIRECTORY.format(target=target)
+    if not os.path.isdir(directory):
+        return []
+    with os.scandir(directory) as it:
+        names = [entry.name for entry in it if entry.name.endswith(".json")]
+    # run-<date>-<time>[-<n>], sorting by the numbers keeps -10 after -9
+    return [
+        os.path.join(directory, name)
+        for name in sorted(
+            names, key=lambda n: [int(p) for p in n[4:-5].split("-") if p.isdigit()]
+        )
+    ]
+
+
+def select_snapshot(target: str, selector: str, current: dict = None) -> tuple:
+    """
+    A selector is "current" for the live results, a position like -1 for the
+    latest snapshot, or the beginning of a snapshot name like run-20240130.
+    Returns the name and the snapshot.
+    """
+    if selector == CURRENT:
+        return CURRENT, current
+    snapshots = list_snapshots(target)
+    try:
+        path = snapshots[int(selector)]
+    except ValueError:
+        matches = [p for p in snapshots if os.path.basename(p).startswith(selector)]
+        if len(matches) != 1:
+            raise Exception(f"{selector} matches {len(matches)} snapshots of {target}")
+        path = matches[0]
+    except IndexError:
+        raise Exception(f"{target} has only {len(snapshots)} snapshots")
+    return Path(path).stem, read_json(path)
+
+
+def flatten(doc: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in (doc or {}).items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def diff_snapshots(old: dict, new: dict) -> dict:
+    """
+    An exploit is removed if the newer run covered it without a result, e.g.
+    it isn't applicable any more. Exploits the newer run didn't cover, like
+    those left out with -e, are not compared.
+    """
+    old_exploits, new_exploits = old["exploits"], new["exploits"]
+    new_covered = set(new.get("covered", new_exploits))
+    changed = [
+        {
+            "exploit": name,
+            "old": get_verdict(old_exploits[name]["code"]),
+            "new": get_verdict(new_exploits[name]["code"]),
+        }
+        for name in sorted(set(old_exploits) & set(new_exploits))
+        if old_exploits[name]["code"] != new_exploits[name]["code"]
+    ]
+    added = [
+        {"exploit": name, "verdict": get_verdict(new_exploits[name]["code"])}
+        for name in sorted(set(new_exploits) - set(old_exploits))
+    ]
+    removed = [
+        {"exploit": name, "verdict": get_verdict(old_exploits[name]["code"])}
+        for name in sorted(set(old_exploits) - set(new_exploits))
+        if name in new_covered
+    ]
+    old_recon, new_recon = flatten(old.get("recon")), flatten(new.get("recon"))
+    recon = [
+        {"field": field, "old": old_recon.get(field), "new": new_recon.get(field)}
+        for field in sorted(set(old_recon) | set(new_recon))
+        if old_recon.get(field) != new_recon.get(field)
+    ]
+    return {"changed": changed, "added": added, "removed": removed, "recon": recon}
+
+
+def has_changes(diff: dict) -> bool:
+    return any(len(diff[key]) > 0 for key in ("changed", "added", "removed", "recon"))
+
+
+def format_diff(diff: dict) -> str:
+    rows = [["verdict", c["exploit"], c["old"], c["new"]] for c in diff["changed"]]
+    rows += [["added", a["exploit"], "", a["verdict"]] for a in diff["added"]]
+    rows += [["removed", r["exploit"], r["verdict"], ""] for r in diff["removed"]]
+    rows += [["recon", r["field"], r["old"], r["new"]] for r in diff["recon"]]
+    if len(rows) == 0:
+        return "No changes"
+    return tabulate(
+        rows,
+        ["Change", "Exploit / field", "Old", "New"],
+        tablefmt="pretty",
+        colalign=("left", "left", "left", "left"),
+    )
+
+
+def diff_fleet(tests_directory: str = TESTS_DIRECTORY) -> list:
+    """Diffs the last two snapshots of every target that has two"""
+    results = []
+    if not os.path.isdir(tests_directory):
+        return results
+    with os.scandir(tests_directory) as it:
+        targets = sorted(entry.name for entry in it if entry.is_dir())
+    for target in targets:
+        snapshots = list_snapshots(target)
+        if len(snapshots) < 2:
+            continue
+        diff = diff_snapshots(read_json(snapshots[-2]), read_json(snapshots[-1]))
+        results.append(
+            (target, Path(snapshots[-2]).stem, Path(snapshots[-1]).stem, diff)
+        )
+    return results
+
+
+def format_fleet_diff(results: list) -> str:
+    rows = [
+        [
+            target,
+            old,
+            new,
+            ", ".join(
+                f"{c['exploit']} {c['old']}->{c['new']}" for c in diff["changed"]
+            ),
+            len(diff["added"]),
+            len(diff["removed"]),
+            ", ".join(r["field"] for r in diff["recon"]),
+        ]
+        for target, old, new, diff in results
+        if has_changes(diff)
+    ]
+    if len(rows) == 0:
+        return f"No changes between the last two runs of {len(results)} targets"
+    return tabulate(
+        rows,
+        [
+            "Target",
+            "Old run",
+            "New run",
+            "Verdict changes",
+            "Added",
+            "Removed",
+            "Recon changes",
+        ],
+        tablefmt="pretty",
+        colalign=("left", "left", "left", "left"),
+    )
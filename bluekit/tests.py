@@ -1,12 +1,79 @@
 import unittest
+import unittest.mock
+import contextlib
+import json
+import tempfile
+import threading
+import time
+import types
+import os
+import sys
+import glob
+import itertools
+import shutil
+import logging
+import multiprocessing
+import subprocess
+import urllib.request
+import yaml
+from pathlib import Path
 
 from bluekit.constants import TOOLKIT_BLUEEXPLOITER_INSTALLATION_DIRECTORY
-from bluekit.bluekit import BlueKit
+from bluekit.constants import OUTPUT_DIRECTORY, TOOLKIT_INSTALLATION_DIRECTORY, DEFAULT_ADAPTER
+from bluekit.bluekit import BlueKit, runs_locally
 from bluekit.factories.hardwarefactory import HardwareFactory
 from bluekit.factories.exploitfactory import ExploitFactory
 from bluekit.models.exploit import Exploit
+from bluekit.constants import RETURN_CODE_ERROR, RETURN_CODE_NONE_OF_4_STATE_OBSERVED
 from bluekit.engine.engine import Engine
+from bluekit.engine.pythonrunner import PythonRunner
 from bluekit.checkpoint import Checkpoint
+from bluekit.setupverfication import setupverification
+from bluekit.report import Report
+from bluekit import report
+from bluekit.applicability import check_requirements
+from bluekit.lease import LeaseManager, LeaseTimeout
+from bluekit.setupverfication import hardwarepool
+from bluekit import distributed
+from bluekit.daemon import BlueKitDaemon, DaemonClient
+from bluekit.tracing import trace_campaign, span, load_trace, summarize
+from bluekit.metrics import MetricsRegistry, start_http_exporter
+from bluekit.engine.resources import ResourceMonitor
+from bluekit import log
+from bluekit import profiling
+from bluekit.fleet import FleetReport
+from bluekit import snapshot
+from bluekit.protocol import OutputParser
+from bluekit.engine.transcript import Transcript
+from bluekit import replay
+from bluekit.discovery import Discovery, parse_btmgmt_find, merge_sightings
+from bluekit.watch import Watcher
+from bluekit import hcimonitor
+from bluekit import watchdog
+from bluekit import verifyconn
+from bluekit import metrics
+from bluekit import policy
+from bluekit.policy import FailurePolicy
+from bluekit.constants import POLICY_UNATTENDED, POLICY_UNATTENDED_SINGLE
+from bluekit.progress import CampaignProgress, DurationHistory
+
+
+def use_temporary_home(test, *modules) -> str:
+    """Points the installation paths of the modules at a directory removed after the test"""
+    home = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, home)
+    for module in modules:
+        for name, value in vars(module).items():
+            if (
+                name.isupper()
+                and isinstance(value, str)
+                and value.startswith(TOOLKIT_INSTALLATION_DIRECTORY)
+            ):
+                path = home + value[len(TOOLKIT_INSTALLATION_DIRECTORY) :]
+                patcher = unittest.mock.patch.object(module, name, path)
+                patcher.start()
+                test.addCleanup(patcher.stop)
+    return home
 
 
 # done TODO add max_timeout to the following tests
@@ -191,6 +258,51 @@ class TestBlueExploiter(unittest.TestCase):
             self.assertIn(hardware.name, ["esp32", "nexus5"])
 
 
+class TestPythonRunner(unittest.TestCase):
+    def test_spawn_and_reap(self):
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, "exploit.py"), "w") as f:
+            f.write("import sys\nprint('hello', sys.argv[1])\nsys.exit(3)\n")
+        runner = PythonRunner(preload_modules=[])
+        process = runner.spawn(["python3", "exploit.py", "AA"], directory)
+        self.assertIsNotNone(process)
+        output, _ = process.communicate(timeout=10)
+        self.assertEqual(output, b"hello AA\n")
+        self.assertEqual(process.returncode, 3)
+        self.assertEqual(runner.children, [process])
+        runner.reap()
+        self.assertEqual(runner.children, [])
+
+        # Shell syntax, other interpreters and missing scripts go to a subprocess
+        for command in [
+            ["python3", "exploit.py", "|", "cat"],
+            ["bash", "exploit.py"],
+            ["python3", "missing.py"],
+        ]:
+            self.assertIsNone(runner.spawn(command, directory))
+
+    def test_child_logging_is_reset(self):
+        # bluekit's root logger feeds a listener thread that isn't in the child
+        log.setup_logging(log_file=os.path.join(use_temporary_home(self), "bluekit.log"))
+        self.addCleanup(log.stop_logging)
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, "exploit.py"), "w") as f:
+            f.write(
+                "import logging, sys\n"
+                "logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')\n"
+                "logging.info('from the exploit')\n"
+            )
+        process = PythonRunner(preload_modules=[]).spawn(["python3", "exploit.py"], directory)
+        output, _ = process.communicate(timeout=10)
+        self.assertEqual(output, b"from the exploit\n")
+        self.assertIn(log.queue_handler, logging.getLogger().handlers)
+
+    def test_preload(self):
+        runner = PythonRunner(preload_modules=["json", "bluekit_missing_module"])
+        runner.preload()
+        self.assertEqual(runner.preloaded, ["json"])
+
+
 class TestEngine(unittest.TestCase):
     def test_construct_exploit_command_exception(self):
         details = test_data["exploit"]
@@ -245,10 +357,64 @@ class TestEngine(unittest.TestCase):
             [
                 "internalblue_KNOB.sh",
                 "AA:AA:AA:AA:AA:AA",
-                "/home/weil/Desktop/University/Thesis/data/tests/AA:AA:AA:AA:AA:AA/internalblue_knob/",
+                OUTPUT_DIRECTORY.format(
+                    target="AA:AA:AA:AA:AA:AA", exploit="internalblue_knob"
+                ),
             ],
         )
 
+    def test_execute_command_large_output(self):
+        # More output than fits in the pipe buffer must not block until the timeout
+        engine = Engine()
+        command = [sys.executable, "-m", "bluekit.simulator", "exploit",
+                   "--target AA:AA:AA:AA:AA:AA", "--delay 0", "--output-bytes 1048576"]
+        start = time.monotonic()
+        finished, data = engine.execute_command(test_data["target"], command, "large_output", timeout=20)
+        self.assertTrue(finished)
+        self.assertLess(time.monotonic() - start, 20)
+        self.assertEqual(engine.process_raw_data(data, finished), (1, "simulated"))
+
+    def test_execute_command_stop_on_result(self):
+        # The exploit keeps running after its result, it is stopped and reaped
+        engine = Engine()
+        command = [sys.executable, "-m", "bluekit.simulator", "exploit",
+                   "--target AA:AA:AA:AA:AA:AA", "--delay 0", "--protocol", "--linger 60"]
+        parser = OutputParser()
+        processes = []
+        popen = subprocess.Popen
+
+        def record(*args, **kwargs):
+            processes.append(popen(*args, **kwargs))
+            return processes[-1]
+
+        start = time.monotonic()
+        with unittest.mock.patch("subprocess.Popen", side_effect=record):
+            finished, _ = engine.execute_command(
+                test_data["target"], command, "lingering", timeout=20, parser=parser, stop_on_result=True
+            )
+        self.assertTrue(finished)
+        self.assertLess(time.monotonic() - start, 20)
+        self.assertEqual(parser.get_verdict(), (1, "simulated"))
+        self.assertTrue(processes[0].stdout.closed)
+        self.assertIsNotNone(processes[0].returncode)
+
+    def test_execute_command_timeout_reaps(self):
+        engine = Engine()
+        command = [sys.executable, "-m", "bluekit.simulator", "exploit",
+                   "--target AA:AA:AA:AA:AA:AA", "--delay 60"]
+        processes = []
+        popen = subprocess.Popen
+
+        def record(*args, **kwargs):
+            processes.append(popen(*args, **kwargs))
+            return processes[-1]
+
+        with unittest.mock.patch("subprocess.Popen", side_effect=record):
+            finished, _ = engine.execute_command(test_data["target"], command, "lingering", timeout=1)
+        self.assertFalse(finished)
+        self.assertTrue(processes[0].stdout.closed)
+        self.assertIsNotNone(processes[0].returncode)
+
 
 class TestCheckpoint(unittest.TestCase):
     def test_preserve_state(self):
@@ -270,4 +436,1115 @@ class TestCheckpoint(unittest.TestCase):
         exploit_pool, exploits, target, parameters = chp.load_state(test_data["target"])
 
 
+class TestApplicability(unittest.TestCase):
+    recon_data = {
+        "type": "BR/EDR",
+        "advertising": True,
+        "connectable": True,
+        "version": 4.2,
+        "vendor": "Broadcom Corporation",
+        "lmp_features": {"page0": {"Secure Simple Pairing": False}},
+        "pairable": True,
+        "pairing_features": {"io_capabilities": "NoInputNoOutput"},
+    }
+
+    def test_applicable(self):
+        requires = {"pairable": True, "vendor": ["broadcom corporation"]}
+        self.assertListEqual(check_requirements(requires, self.recon_data), [])
+
+    def test_not_applicable(self):
+        requires = {
+            "lmp_features": ["secure_simple_pairing"],
+            "pairing_features": {"io_capabilities": ["DisplayYesNo"]},
+        }
+        self.assertEqual(len(check_requirements(requires, self.recon_data)), 2)
+
+    def test_missing_recon_data(self):
+        requires = {"lmp_features": ["le_supported"], "advertising_type": "LE"}
+        self.assertListEqual(
+            check_requirements(requires, {"lmp_features": {}, "type": None}), []
+        )
+
+    def test_pairing_exploits_are_pruned(self):
+        exploits = {}
+        directory = os.path.join(os.path.dirname(__file__), "..", "exploits")
+        for name in [
+            "custom_method_confusion_check",
+            "custom_insecure_numeric_comparison_implementation",
+            "internalblue_CVE_2018_5383_Invalid_second",
+        ]:
+            with open(os.path.join(directory, name + ".yaml")) as f:
+                exploits[name] = yaml.safe_load(f)["requires"]
+        ssp_display = dict(
+            self.recon_data,
+            lmp_features={"page0": {"Secure Simple Pairing": True}},
+            pairing_features={"io_capabilities": "DisplayYesNo"},
+        )
+        for name, requires in exploits.items():
+            # legacy pairing only and Just Works
+            self.assertNotEqual(check_requirements(requires, self.recon_data), [])
+            self.assertEqual(check_requirements(requires, ssp_display), [])
+
+    def test_not_applicable_is_merged(self):
+        use_temporary_home(self, report)
+        result = Report(None)
+        result.save_not_applicable("target", {"a": ["pairable is False"]}, ["a"])
+        result.save_not_applicable("target", {"b": ["vendor is x"]}, ["b", "c"])
+        self.assertEqual(
+            result.read_not_applicable("target"),
+            {"a": ["pairable is False"], "b": ["vendor is x"]},
+        )
+        # a is applicable with newer recon data
+        result.save_not_applicable("target", {}, ["a"])
+        self.assertEqual(list(result.read_not_applicable("target")), ["b"])
+
+
+class TestSetupVerifier(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        setupverification.register_verifier("test_board")(
+            lambda: self.calls.append(1) or True
+        )
+        self.addCleanup(setupverification.hardware_verfier.pop, "test_board")
+        self.dev = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dev)
+        patcher = unittest.mock.patch.object(
+            setupverification, "SETUP_VERIFICATION_WATCH_PATHS", [self.dev]
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.hardware = types.SimpleNamespace(
+            name="test_board", needs_setup_verification=True
+        )
+
+    def test_result_is_cached_until_dev_changes(self):
+        verifier = setupverification.SetupVerifier(ttl=60)
+        self.assertTrue(verifier.verify_setup(self.hardware))
+        self.assertTrue(verifier.verify_setup(self.hardware))
+        self.assertEqual(len(self.calls), 1)
+        os.utime(self.dev, ns=(0, os.stat(self.dev).st_mtime_ns + 10**9))  # plugged in
+        self.assertEqual(
+            verifier.verify_setup_multiple_hardware([self.hardware]),
+            {"test_board": True},
+        )
+        self.assertEqual(len(self.calls), 2)
+
+    def test_result_expires(self):
+        verifier = setupverification.SetupVerifier(ttl=0.05)
+        verifier.verify_setup(self.hardware)
+        time.sleep(0.1)
+        verifier.verify_setup(self.hardware)
+        self.assertEqual(len(self.calls), 2)
+
+
+class TestHardwarePool(unittest.TestCase):
+    def setUp(self):
+        # Lease files of the test don't go to the installation
+        patcher = unittest.mock.patch.object(
+            hardwarepool, "leases", LeaseManager(tempfile.mkdtemp())
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_esp32_ports_are_paired_per_board(self):
+        parents = {
+            "/dev/ttyUSB0": "/sys/usb1",
+            "/dev/ttyUSB1": "/sys/usb1",
+            "/dev/ttyUSB2": "/sys/usb2",
+            "/dev/ttyUSB3": "/sys/usb2",
+        }
+        with unittest.mock.patch.object(
+            hardwarepool, "glob", return_value=list(reversed(list(parents)))
+        ), unittest.mock.patch.object(
+            hardwarepool, "get_usb_parent", side_effect=parents.get
+        ):
+            boards = hardwarepool.discover_esp32()
+        self.assertEqual(
+            [board.resource_id for board in boards], ["/dev/ttyUSB1", "/dev/ttyUSB3"]
+        )
+        self.assertEqual(
+            boards[1].apply(["--host-port=/dev/ttyUSB1"]), ["--host-port=/dev/ttyUSB3"]
+        )
+
+    def test_leases_are_exclusive(self):
+        board = hardwarepool.HardwareResource("esp32", "/dev/ttyUSB1")
+        with unittest.mock.patch.dict(
+            hardwarepool.hardware_discovery, {"esp32": lambda: [board]}
+        ):
+            pool = hardwarepool.HardwarePool()
+            self.assertEqual(pool.discover()["esp32"], [board])
+            with pool.lease("esp32") as resource:
+                self.assertIs(resource, board)
+                with self.assertRaises(LeaseTimeout):
+                    pool.acquire("esp32", timeout=0.2)
+            with pool.lease("esp32") as resource:
+                self.assertIs(resource, board)
+            with pool.lease("default") as resource:
+                self.assertIsNone(resource)  # not pooled
+
+    def test_empty_pool_waits_for_hardware(self):
+        looks = []
+        board = hardwarepool.HardwareResource("esp32", "/dev/ttyUSB1")
+
+        def discover():
+            looks.append(time.monotonic())
+            return [board] if len(looks) > 1 else []  # plugged in after the first look
+
+        with unittest.mock.patch.dict(
+            hardwarepool.hardware_discovery, {"esp32": discover}
+        ), unittest.mock.patch.object(
+            hardwarepool, "HARDWARE_REDISCOVERY_INTERVAL", 0.1
+        ), unittest.mock.patch.object(
+            hardwarepool, "LEASE_POLL_INTERVAL", 0.05
+        ):
+            pool = hardwarepool.HardwarePool()
+            pool.discover(["esp32"])
+            self.assertIs(pool.acquire("esp32", timeout=5), board)
+
+    def test_multiple_targets_run_in_parallel(self):
+        started = []
+        barrier = threading.Barrier(2, timeout=5)
+
+        def start_from_cli_all(session, target, parameters):
+            started.append(target)
+            barrier.wait()  # both targets are tested at the same time
+            if target == "bb:bb:bb:bb:bb:bb":
+                sys.exit()  # stops only this target
+
+        bluekit = BlueKit(handle_signals=False)
+        bluekit.engine.hardware_pool = hardwarepool.HardwarePool()
+        with unittest.mock.patch.object(
+            BlueKit, "start_from_cli_all", start_from_cli_all
+        ):
+            bluekit.start_from_cli_multiple(
+                ["aa:aa:aa:aa:aa:aa", "bb:bb:bb:bb:bb:bb"], []
+            )
+        self.assertCountEqual(started, ["aa:aa:aa:aa:aa:aa", "bb:bb:bb:bb:bb:bb"])
+        self.assertEqual(len(bluekit.target_sessions), 2)
+
+
+class TestLeaseManager(unittest.TestCase):
+    def test_lease_is_exclusive(self):
+        manager = LeaseManager(tempfile.mkdtemp())
+        result = []
+        with manager.lease("hci0"):
+            with manager.lease("hci0"):  # reentrant for the holding thread
+                thread = threading.Thread(
+                    target=lambda: result.append(manager.try_acquire("hci0"))
+                )
+                thread.start()
+                thread.join()
+        self.assertListEqual(result, [False])
+        self.assertIsNone(manager.read_owner("hci0"))
+
+    def test_lease_ends_with_its_process(self):
+        directory = tempfile.mkdtemp()
+        acquired = multiprocessing.Event()
+
+        def hold():
+            LeaseManager(directory).acquire("/dev/ttyUSB1")
+            acquired.set()
+            time.sleep(60)
+
+        holder = multiprocessing.get_context("fork").Process(target=hold)
+        holder.start()
+        self.assertTrue(acquired.wait(10))
+        manager = LeaseManager(directory)
+        self.assertFalse(manager.try_acquire("/dev/ttyUSB1"))
+        self.assertEqual(manager.read_owner("/dev/ttyUSB1")["pid"], holder.pid)
+
+        holder.kill()  # no release, the kernel drops the lock
+        holder.join()
+        self.assertTrue(manager.try_acquire("/dev/ttyUSB1"))
+        manager.release("/dev/ttyUSB1")
+        self.assertIsNone(manager.read_owner("/dev/ttyUSB1"))
+
+
+class TestDaemon(unittest.TestCase):
+    def test_local_settings_are_not_submitted(self):
+        base = dict(
+            daemon=False, nodaemon=False, coordinator=None, worker=None, profile=None,
+            fleetreport=False, discover=None, watch=None, diff=None, simulate=False,
+            prefork=False, metricsport=None, metricsfile=None,
+        )
+        self.assertFalse(runs_locally(types.SimpleNamespace(**base)))
+        for flag, value in [("simulate", True), ("prefork", True),
+                            ("metricsport", 9100), ("metricsfile", "metrics.prom")]:
+            args = types.SimpleNamespace(**dict(base, **{flag: value}))
+            self.assertTrue(runs_locally(args), flag)
+
+    def test_client_round_trip(self):
+        bluekit = unittest.mock.MagicMock()
+        bluekit.get_available_exploits_table.return_value = "table"
+        bluekit.recon.run_recon.return_value = True
+        socket_path = os.path.join(tempfile.mkdtemp(), "bluekit.sock")
+        daemon = BlueKitDaemon(bluekit, socket_path)
+        threading.Thread(target=daemon.serve_forever, daemon=True).start()
+        client = DaemonClient(socket_path)
+        for _ in range(50):
+            if client.is_running():
+                break
+            time.sleep(0.1)
+        self.addCleanup(client.request, {"command": "shutdown"})
+
+        job = client.submit({"action": "list"})
+        self.assertEqual((job["status"], job["result"]), ("done", "table"))
+        job = client.submit({"action": "recon", "target": "aa:bb:cc:dd:ee:ff"})
+        job = client.wait(job["job_id"], interval=0.1)
+        self.assertEqual((job["status"], job["result"]), ("done", True))
+        bluekit.recon.run_recon.assert_called_once_with("aa:bb:cc:dd:ee:ff")
+        with self.assertRaises(Exception):
+            client.submit({"action": "campaign"})  # no target
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        for name, value in [
+            ("COORDINATOR_HEARTBEAT_INTERVAL", 0.1),
+            ("COORDINATOR_WORKER_TIMEOUT", 0.5),
+            ("COORDINATOR_UNSCHEDULABLE_TIMEOUT", 0.3),
+        ]:
+            patcher = unittest.mock.patch.object(distributed, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_dead_worker_jobs_are_reassigned(self):
+        jobs = distributed.Coordinator.create_jobs(
+            ["AA:AA:AA:AA:AA:AA", "BB:BB:BB:BB:BB:BB"],
+            [
+                Exploit(dict(test_data["exploit"], directory={"change": False})),
+                Exploit(dict(test_data["exploit2"], directory={"change": False})),
+            ],
+            [],
+        )
+        coordinator = distributed.Coordinator(
+            jobs, results_file=os.path.join(tempfile.mkdtemp(), "results.jsonl")
+        )
+        host, port = coordinator.start("127.0.0.1", 0)
+
+        # Takes a job and never reports back
+        stuck = distributed.Worker(
+            host, port, "stuck", ["esp32"], execute=lambda job: time.sleep(60)
+        )
+        stuck.heartbeat = lambda: None
+        threading.Thread(target=stuck.run, daemon=True).start()
+        time.sleep(0.3)
+
+        workers = [
+            distributed.Worker(
+                host, port, name, ["esp32", "nexus5"], execute=lambda job: (1, "")
+            )
+            for name in ["worker1", "worker2"]
+        ]
+        threads = [threading.Thread(target=worker.run) for worker in workers]
+        for thread in threads:
+            thread.start()
+        results = coordinator.wait()
+        for thread in threads:
+            thread.join(5)
+        coordinator.stop()
+
+        self.assertEqual(len(results), 4)
+        self.assertNotIn("stuck", [result["worker"] for result in results.values()])
+
+    def test_jobs_without_hardware_fail(self):
+        jobs = distributed.Coordinator.create_jobs(
+            ["AA:AA:AA:AA:AA:AA"],
+            [Exploit(dict(test_data["exploit"], directory={"change": False}))],
+            [],
+        )
+        coordinator = distributed.Coordinator(
+            jobs, results_file=os.path.join(tempfile.mkdtemp(), "results.jsonl")
+        )
+        host, port = coordinator.start("127.0.0.1", 0)
+        worker = distributed.Worker(
+            host, port, "worker", ["nexus5"], execute=lambda job: (1, "")
+        )
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        result = coordinator.wait()[1]
+        thread.join(5)
+        coordinator.stop()
+
+        self.assertTrue(result["skipped"])
+        self.assertIsNone(result["worker"])
+        self.assertFalse(thread.is_alive())
+
+    def test_results_are_saved_once_by_the_coordinator(self):
+        jobs = distributed.Coordinator.create_jobs(
+            ["AA:AA:AA:AA:AA:AA", "BB:BB:BB:BB:BB:BB"],
+            [Exploit(dict(test_data["exploit"], directory={"change": False}))],
+            [],
+        )
+        report = unittest.mock.MagicMock()
+        coordinator = distributed.Coordinator(
+            jobs,
+            report=report,
+            results_file=os.path.join(tempfile.mkdtemp(), "results.jsonl"),
+        )
+        use_temporary_home(self, distributed)
+        host, port = coordinator.start("127.0.0.1", 0)
+
+        bluekit = unittest.mock.MagicMock()
+        bluekit.exploit_filter.side_effect = lambda target, exploits: exploits
+        bluekit.get_available_exploits.return_value = [
+            Exploit(dict(test_data["exploit"], directory={"change": False}))
+        ]
+        bluekit.test_exploit.side_effect = [
+            (RETURN_CODE_NONE_OF_4_STATE_OBSERVED, "out"),
+            RuntimeError("adapter gone"),
+        ]
+        bluekit.engine.last_resource_usage = {"max_rss_kb": 1}
+        bluekit.engine.last_output.findings = [{"cve": "CVE-2020-0022"}]
+        bluekit.engine.last_output.artifacts = []
+        worker = distributed.Worker(host, port, "worker", ["esp32"], bluekit=bluekit)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        results = coordinator.wait()
+        thread.join(5)
+        coordinator.stop()
+
+        bluekit.report.save_data.assert_not_called()
+        self.assertEqual(report.save_data.call_count, 2)
+        saved = {
+            call.kwargs["target"]: call.kwargs for call in report.save_data.mock_calls
+        }
+        self.assertEqual(
+            saved["AA:AA:AA:AA:AA:AA"]["findings"], [{"cve": "CVE-2020-0022"}]
+        )
+        self.assertEqual(saved["BB:BB:BB:BB:BB:BB"]["code"], RETURN_CODE_ERROR)
+        self.assertEqual(results[2]["data"], "adapter gone")
+
+
+class TestTracing(unittest.TestCase):
+    def test_self_time_excludes_nested_spans(self):
+        path = os.path.join(tempfile.mkdtemp(), "trace.json")
+        with trace_campaign(test_data["target"], path=path):
+            with span("outer"):
+                time.sleep(0.05)
+                with span("inner") as args:
+                    time.sleep(0.1)
+                    args["code"] = 1
+        with span("not_traced"):
+            pass
+
+        events = load_trace(path)
+        self.assertEqual(sorted(e["name"] for e in events), ["campaign", "inner", "outer"])
+        self.assertEqual([e["args"] for e in events if e["name"] == "inner"], [{"code": 1}])
+        totals = {entry["name"]: entry for entry in summarize(events)}
+        self.assertEqual(summarize(events)[0]["name"], "inner")
+        self.assertLess(totals["outer"]["self"], totals["inner"]["self"])
+        self.assertGreaterEqual(totals["outer"]["total"], totals["inner"]["total"])
+
+
+class TestMetrics(unittest.TestCase):
+    def test_exposition_over_http(self):
+        registry = MetricsRegistry()
+        done = registry.counter("test_done_total", "Done", ("code",))
+        probe = registry.histogram("test_probe_seconds", "Probe", buckets=(0.5, 1))
+        done.inc(code=1)
+        done.inc(2, code=1)
+        probe.observe(0.7)
+        self.assertRaises(Exception, done.inc, exploit="knob")
+
+        server = start_http_exporter(0, registry=registry)
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+                body = response.read().decode()
+        finally:
+            server.shutdown()
+        self.assertIn('test_done_total{code="1"} 3', body)
+        self.assertIn('test_probe_seconds_bucket{le="0.5"} 0', body)
+        self.assertIn('test_probe_seconds_bucket{le="1"} 1', body)
+        self.assertIn('test_probe_seconds_bucket{le="+Inf"} 1', body)
+        self.assertIn("test_probe_seconds_count 1", body)
+
+
+class TestResourceMonitor(unittest.TestCase):
+    def test_samples_process_tree(self):
+        # Holds 64 MB, burns CPU and runs a child process for a while
+        code = ("import subprocess, time; child = subprocess.Popen(['sleep', '1']); "
+                "memory = bytearray(64 * 1024 * 1024); start = time.time()\n"
+                "while time.time() - start < 0.8: pass\nchild.wait()")
+        process = subprocess.Popen([sys.executable, "-c", code])
+        monitor = ResourceMonitor(process.pid, interval=0.1)
+        monitor.start()
+        process.wait()
+        usage = monitor.stop()
+        self.assertGreater(usage["cpu_seconds"], 0.3)
+        self.assertGreater(usage["peak_rss_bytes"], 64 * 1024 * 1024)
+        self.assertEqual(usage["max_children"], 1)
+        self.assertGreater(usage["samples"], 3)
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.max_bytes = log.LOG_MAX_BYTES
+
+    def tearDown(self):
+        log.stop_logging()
+        log.LOG_MAX_BYTES = self.max_bytes
+        logging.getLogger().setLevel(logging.WARNING)
+
+    def test_module_levels_and_rotation(self):
+        log_file = os.path.join(tempfile.mkdtemp(), "application.log")
+        log.LOG_MAX_BYTES = 2000
+        log.setup_logging("warning,bluekit.tests=debug,other=error", log_file=log_file)
+        logging.debug("debug from the tests %s", {"code": 1})
+        logging.getLogger("other").warning("filtered")
+        logging.getLogger("other").error("kept")
+        for i in range(50):
+            logging.info("line %d", i)
+        log.stop_logging()
+
+        self.assertTrue(os.path.exists(log_file + ".1"))
+        records = []
+        for path in sorted(glob.glob(log_file + "*"), reverse=True):
+            with open(path) as f:
+                records += [json.loads(line) for line in f]
+        self.assertEqual(records[0]["message"], "debug from the tests {'code': 1}")
+        self.assertEqual(records[0]["module"], "bluekit.tests")
+        self.assertEqual(records[1]["message"], "kept")
+        self.assertEqual(records[-1]["message"], "line 49")
+        self.assertNotIn("filtered", [record["message"] for record in records])
+
+
+class TestProfiling(unittest.TestCase):
+    def test_phases(self):
+        directory = tempfile.mkdtemp()
+        profiler = profiling.Profiler(directory)
+        profiler.start()
+        with profiler.phase("work"):
+            data = [str(i) * 10 for i in range(20000)]
+            with profiler.phase("nested"):
+                sorted(data)
+        profiler.stop()
+
+        self.assertEqual([phase["name"] for phase in profiler.phases], ["work"])
+        self.assertGreater(profiler.phases[0]["peak_bytes"], 0)
+        for name in ["work.pstats", "work-functions.txt", "work-allocations.txt"]:
+            self.assertTrue(os.path.exists(os.path.join(directory, name)))
+        with open(os.path.join(directory, "summary.txt")) as f:
+            self.assertIn("work", f.read())
+
+
+class TestProgress(unittest.TestCase):
+    def test_eta_weighted_by_history(self):
+        directory = tempfile.mkdtemp()
+        history = DurationHistory(os.path.join(directory, "durations.json"))
+        history.record("slow", 100)
+        history.record("slow", 200)
+        details = dict(test_data["exploit"], directory={"change": False})
+        fast = Exploit(dict(details, name="fast", max_timeout=5))
+        slow = Exploit(dict(details, name="slow"))
+        events_path = os.path.join(directory, "progress.jsonl")
+
+        progress = CampaignProgress(
+            "aa", [fast, slow], history, events_path=events_path, show_bar=False
+        )
+        self.assertEqual(progress.get_state()["eta_seconds"], 135)
+        progress.start_exploit(0)
+        progress.on_output(b"x" * 10)
+        progress.finish_exploit(1)
+        self.assertAlmostEqual(progress.get_state()["eta_seconds"], 130, delta=1)
+        progress.close()
+
+        with open(events_path) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual(
+            [event["event"] for event in events],
+            ["started", "exploit_started", "exploit_done", "stopped"],
+        )
+        self.assertEqual(events[2]["output_bytes"], 10)
+        self.assertIn("fast", DurationHistory(history.path).durations)
+
+    def test_progress_without_fraction(self):
+        directory = tempfile.mkdtemp()
+        history = DurationHistory(os.path.join(directory, "durations.json"))
+        exploit = Exploit(dict(test_data["exploit"], directory={"change": False}))
+        progress = CampaignProgress("aa", [exploit], history, show_bar=False)
+        progress.start_exploit(0)
+        progress.on_exploit_event({"type": "progress", "fraction": 0.5})
+        progress.on_exploit_event({"type": "progress", "fraction": "half"})
+        progress.on_exploit_event({"type": "progress", "message": "pairing"})
+        self.assertEqual(progress.current_fraction, 0.5)
+        progress.close()
+
+    def test_exploit_skipped_on_lease_timeout(self):
+        directory = tempfile.mkdtemp()
+        details = dict(test_data["exploit"], directory={"change": False})
+        exploits = [
+            Exploit(dict(details, name="busy", max_timeout=50)),
+            Exploit(dict(details, name="free", max_timeout=5)),
+        ]
+        bluekit = BlueKit(handle_signals=False)
+        bluekit.durations = DurationHistory(os.path.join(directory, "durations.json"))
+        bluekit.progress_events = os.path.join(directory, "progress.jsonl")
+        bluekit.report = unittest.mock.MagicMock()
+        bluekit.engine = unittest.mock.MagicMock()
+        bluekit.check_target = lambda target, exploit: True
+        bluekit.preserve_state = unittest.mock.MagicMock()
+        bluekit.test_exploit = unittest.mock.MagicMock(
+            side_effect=[LeaseTimeout("Timed out waiting for a lease"), (1, "")]
+        )
+        with unittest.mock.patch("bluekit.bluekit.CampaignProgress") as progress:
+            progress.side_effect = lambda *args, **kwargs: CampaignProgress(
+                *args, **kwargs, show_bar=False
+            )
+            bluekit.test_one_by_one("aa", [], exploits)
+
+        with open(bluekit.progress_events) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual(
+            [event["event"] for event in events],
+            [
+                "started",
+                "exploit_started",
+                "exploit_skipped",
+                "exploit_started",
+                "exploit_done",
+                "finished",
+            ],
+        )
+        self.assertIsNone(events[2]["exploit"])
+        self.assertEqual(events[2]["eta_seconds"], 5)
+        self.assertEqual((events[-1]["done"], events[-1]["skipped"]), (1, 1))
+        self.assertNotIn("busy", bluekit.durations.durations)
+        bluekit.preserve_state.assert_called_once()
+
+
+class TestFleetReport(unittest.TestCase):
+    def write(self, path, doc):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(doc, f)
+
+    def test_incremental_matrix(self):
+        tests_directory = tempfile.mkdtemp()
+        for target, vendor, code in [("aa", "Acme", 2), ("bb", "Acme", 1)]:
+            self.write(
+                os.path.join(tests_directory, target, "recon", "recon.json"),
+                {"vendor": vendor, "version": 5.0, "type": "BR/EDR"},
+            )
+            self.write(
+                os.path.join(tests_directory, target, "knob", "output_report.json"),
+                {"code": code, "data": ""},
+            )
+        os.makedirs(os.path.join(tests_directory, "bb", "leftover"))
+        fleet = FleetReport(tests_directory, tempfile.mkdtemp(), workers=2)
+
+        result = fleet.build(["knob", "bias"])
+        self.assertEqual(result["read"], 2)
+        self.assertEqual(
+            result["matrix"]["knob"]["Acme"], {"vulnerable": 1, "not_vulnerable": 1}
+        )
+        self.assertEqual(result["matrix"]["bias"]["Acme"], {"not_tested": 2})
+        self.assertNotIn("leftover", result["matrix"])
+
+        self.write(
+            os.path.join(tests_directory, "bb", "bias", "output_report.json"),
+            {"code": 2, "data": ""},
+        )
+        result = fleet.build(["knob", "bias"])
+        self.assertEqual(result["read"], 1)
+        self.assertEqual(result["matrix"]["bias"]["Acme"]["vulnerable"], 1)
+        with open(os.path.join(fleet.output_directory, "fleet.ndjson")) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+
+class TestReportIndex(unittest.TestCase):
+    def setUp(self):
+        use_temporary_home(self, report)
+
+    def test_index_updated_by_save_data(self):
+        target = "AA:BB:CC:DD:EE:42"
+        result = Report(None)
+        for exploit in ["knob", "leftover"]:
+            Path(report.OUTPUT_DIRECTORY.format(target=target, exploit=exploit)).mkdir(
+                parents=True
+            )
+        with open(
+            report.OUTPUT_DIRECTORY.format(target=target, exploit="knob") + "x.log", "w"
+        ):
+            pass
+        result.save_data("knob", target, "first", 1)
+        result.save_data("knob", target, "second", 2)
+
+        self.assertEqual(result.get_done_exploits(target), ["knob"])
+        entry = result.read_index(target)["exploits"]["knob"]
+        self.assertEqual((entry["code"], entry["data"], entry["runs"]), (2, "second", 2))
+        self.assertEqual(entry["artifacts"], ["knob/x.log"])
+
+        # Targets tested before the index existed are indexed from their directories
+        os.remove(report.REPORT_INDEX_FILE.format(target=target))
+        self.assertEqual(result.get_done_exploits(target), ["knob"])
+        self.assertTrue(os.path.exists(report.REPORT_INDEX_FILE.format(target=target)))
+
+    def test_processes_share_the_index(self):
+        target = "AA:BB:CC:DD:EE:43"
+        Path(report.OUTPUT_DIRECTORY.format(target=target, exploit="knob")).mkdir(
+            parents=True
+        )
+
+        def save(exploit):
+            for _ in range(20):
+                Report(None).update_index(target, exploit, {"code": 1})
+
+        # Forked, the children keep the temporary home
+        processes = [
+            multiprocessing.get_context("fork").Process(target=save, args=(exploit,))
+            for exploit in ["knob", "knob", "bias"]
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+        exploits = Report(None).read_index(target)["exploits"]
+        self.assertEqual((exploits["knob"]["runs"], exploits["bias"]["runs"]), (40, 20))
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.home = use_temporary_home(self, snapshot)
+
+    def test_diff_runs(self):
+        target = "aa:bb:cc:dd:ee:43"
+        recon = {"vendor": "Acme", "lmp_features": {"page0": {"ssp": True}}}
+        index = {"exploits": {"knob": {"code": 2}, "bias": {"code": 1}}}
+        for _ in range(11):
+            snapshot.save_snapshot(target, index, recon)
+        index = {"exploits": {"knob": {"code": 1}, "invalid_timing": {"code": 0}}}
+        recon = {"vendor": "Acme", "lmp_features": {"page0": {"ssp": False}}}
+        path = snapshot.save_snapshot(
+            target, index, recon, ["knob", "invalid_timing", "bias"]
+        )
+
+        self.assertEqual(snapshot.list_snapshots(target)[-1], path)
+        _, old = snapshot.select_snapshot(target, "-2")
+        _, new = snapshot.select_snapshot(target, "-1")
+        diff = snapshot.diff_snapshots(old, new)
+        self.assertEqual(
+            diff["changed"],
+            [{"exploit": "knob", "old": "vulnerable", "new": "not_vulnerable"}],
+        )
+        self.assertEqual(diff["added"], [{"exploit": "invalid_timing", "verdict": "error"}])
+        self.assertEqual(diff["removed"], [{"exploit": "bias", "verdict": "not_vulnerable"}])
+        self.assertEqual(diff["recon"][0]["field"], "lmp_features.page0.ssp")
+
+    def test_subset_run(self):
+        # A -e knob run says nothing about the other exploits
+        target = "aa:bb:cc:dd:ee:43"
+        index = {"exploits": {"knob": {"code": 2}, "bias": {"code": 1}}}
+        snapshot.save_snapshot(target, index, {})
+        snapshot.save_snapshot(target, {"exploits": {"knob": {"code": 1}}}, {})
+
+        _, old = snapshot.select_snapshot(target, "-2")
+        _, new = snapshot.select_snapshot(target, "-1")
+        diff = snapshot.diff_snapshots(old, new)
+        self.assertEqual(
+            diff["changed"],
+            [{"exploit": "knob", "old": "vulnerable", "new": "not_vulnerable"}],
+        )
+        self.assertEqual(diff["removed"], [])
+
+    def test_diff_fleet_without_tests(self):
+        self.assertEqual(
+            snapshot.diff_fleet(os.path.join(self.home, "data", "tests")), []
+        )
+
+
+class TestProtocol(unittest.TestCase):
+    def test_incremental_parsing(self):
+        events = []
+        parser = OutputParser(listener=events.append)
+        output = (
+            b"noise\n"
+            b'BLUEKIT/1 {"type": "progress", "fraction": 0.5}\n'
+            b'BLUEKIT/1 {"type": "finding", "code": 2, "title": "overflow"}\n'
+            b'BLUEKIT/1 {"type": "artifact", "path": "capture.pcap"}\n'
+            b'BLUEKIT/9 {"type": "result", "code": 0}\n'
+            b"BLUEEXPLOITER DATA: code=1, data=a=b, c\n"
+            b'BLUEKIT/1 {"type": "result", "code": 2, "data": "late"}'
+        )
+        for i in range(0, len(output), 7):
+            parser.feed(output[i : i + 7])
+        parser.close()
+
+        self.assertEqual(parser.get_verdict(), (1, "a=b, c"))
+        self.assertEqual(parser.artifacts, ["capture.pcap"])
+        self.assertEqual(
+            [event["type"] for event in events],
+            ["progress", "finding", "artifact", "result"],
+        )
+
+    def test_verdict_from_findings(self):
+        parser = OutputParser()
+        parser.feed(b'BLUEKIT/1 {"type": "finding", "code": 1, "title": "a"}\n')
+        parser.feed(b'BLUEKIT/1 {"type": "finding", "code": 2, "title": "b"}\n')
+        self.assertEqual(parser.get_verdict(), (2, "b"))
+        self.assertEqual(OutputParser().get_verdict(), None)
+
+    def test_malformed_events_are_dropped(self):
+        events = []
+        parser = OutputParser(listener=events.append)
+        parser.feed(b'BLUEKIT/1 {"type": "result", "code": "2"}\n')
+        parser.feed(b'BLUEKIT/1 {"type": "result"}\n')
+        parser.feed(b'BLUEKIT/1 {"type": "finding", "code": null, "title": "a"}\n')
+        parser.feed(b'BLUEKIT/1 {"type": "artifact", "path": ["a", "b"]}\n')
+        parser.feed(b'BLUEKIT/1 {"type": "artifact"}\n')
+        self.assertEqual(events, [])
+        self.assertEqual(parser.get_verdict(), None)
+        parser.feed(b'BLUEKIT/1 {"type": "result", "code": 0}\n')
+        self.assertEqual(parser.get_verdict(), (0, ""))
+
+
+class TestReplay(unittest.TestCase):
+    def test_replay_matches_recording(self):
+        path = os.path.join(tempfile.mkdtemp(), "transcript.jsonl")
+        transcript = Transcript(
+            path,
+            {
+                "exploit": "recorded",
+                "target": "aa:bb:cc:dd:ee:ff",
+                "type": "PoC",
+                "command": [],
+                "timeout": 10,
+                "stop_on_result": True,
+            },
+        )
+        transcript.write("stdout", b"connecting\n")
+        transcript.write("stderr", b"warning\n")
+        transcript.write("stdout", b"BLUEEXPLOITER DATA: code=2, data=found\n")
+        transcript.finish(None, True)  # kept running after its result
+        transcript.close(2, "found")
+
+        results = replay.check_transcripts([path], speed=100)
+        self.assertTrue(results[0]["match"])
+        self.assertEqual(results[0]["replayed"], 2)
+        # stop_on_result ends the replay long before the timeout
+        self.assertLess(results[0]["run_seconds"], 5)
+
+
+class TestDiscovery(unittest.TestCase):
+    def test_sightings_are_merged_by_address(self):
+        output = (
+            "Discovery started\n"
+            "hci0 type 7 discovering on\n"
+            "hci0 dev_found: AA:BB:CC:DD:EE:01 type BR/EDR rssi -70 flags 0x0000\n"
+            "name Car 1\n"
+            "hci0 dev_found: 40:4E:36:12:34:56 type LE Random rssi -82 flags 0x0004\n"
+            "AD flags 0x06\n"
+            "hci0 type 7 discovering off\n"
+        )
+        found = parse_btmgmt_find(output)
+        self.assertEqual(found[0]["name"], "Car 1")
+        self.assertEqual(found[1]["type"], "LE Random")
+        sightings = [dict(f, controller="hci0") for f in found]
+        sightings.append(dict(found[0], rssi=-50, name=None, controller="hci1"))
+
+        devices = merge_sightings(sightings)
+        self.assertEqual(len(devices), 2)
+        self.assertEqual(devices["aa:bb:cc:dd:ee:01"]["rssi"], -50)
+        self.assertEqual(devices["aa:bb:cc:dd:ee:01"]["name"], "Car 1")
+        self.assertEqual(devices["aa:bb:cc:dd:ee:01"]["controllers"], ["hci0", "hci1"])
+
+        # Louder LE advertising of a dual mode device doesn't hide its BR/EDR
+        sightings.append(dict(found[0], type="LE Public", rssi=-30, controller="hci2"))
+        self.assertEqual(merge_sightings(sightings)["aa:bb:cc:dd:ee:01"]["type"], "BR/EDR")
+
+    def test_recon_workers_share_the_controllers(self):
+        in_use = set()
+        lock = threading.Lock()
+        recons = []
+        overlaps = []  # controllers handed to two workers at once
+
+        class FakeRecon:
+            def run_recon(self, target, adapter):
+                with lock:
+                    if adapter in in_use:
+                        overlaps.append(adapter)
+                    in_use.add(adapter)
+                    recons.append(target)
+                time.sleep(0.05)
+                with lock:
+                    in_use.discard(adapter)
+                return target != "aa:bb:cc:dd:ee:03"
+
+        devices = {
+            f"aa:bb:cc:dd:ee:0{i}": {"address": f"aa:bb:cc:dd:ee:0{i}", "type": "BR/EDR"}
+            for i in range(6)
+        }
+        devices["40:4e:36:12:34:56"] = {"address": "40:4e:36:12:34:56", "type": "LE Random"}
+        discovery = Discovery(controllers=["hci0", "hci1"], recon=FakeRecon())
+        discovery.run_recon(devices, force=True)
+
+        self.assertEqual(overlaps, [])
+        self.assertEqual(sorted(recons), sorted(devices)[1:])
+        self.assertEqual(devices["40:4e:36:12:34:56"]["recon"], "le_only")
+        self.assertEqual(devices["aa:bb:cc:dd:ee:03"]["recon"], "failed")
+        self.assertEqual(devices["aa:bb:cc:dd:ee:05"]["recon"], "done")
+
+    def test_recon_of_an_unconnectable_device_times_out(self):
+        connects = []
+
+        class Unconnectable:
+            def __init__(self, dev_id):
+                pass
+
+            def power_on(self):
+                pass
+
+            def power_off(self):
+                pass
+
+            def scan(self, timeout=None, target=None):
+                return "BR/EDR"
+
+            def connect(self, target):
+                connects.append(target)
+                if len(connects) > 100:
+                    raise AssertionError("recon never gives up")
+                return False
+
+        address = "aa:bb:cc:dd:ee:46"
+        devices = {address: {"address": address, "type": "BR/EDR"}}
+        with unittest.mock.patch(
+            "bluekit.device.device_backend", Unconnectable
+        ), unittest.mock.patch(
+            "bluekit.recon.leases", LeaseManager(use_temporary_home(self))
+        ), unittest.mock.patch("bluekit.recon.time") as clock:
+            clock.time.side_effect = itertools.count(0, 5)  # each attempt takes 5 s
+            Discovery(controllers=["hci0"]).run_recon(devices, force=True)
+        self.assertEqual(devices[address]["recon"], "failed")
+        self.assertLessEqual(len(connects), 5)
+
+
+class TestWatcher(unittest.TestCase):
+    def test_campaigns_follow_the_device(self):
+        watcher = Watcher(
+            None, ["car*", "aa:bb:cc:dd:ee:02"], [], Discovery(controllers=["hci0"])
+        )
+        car = {"address": "aa:bb:cc:dd:ee:01", "name": "Car 1"}
+        other = {"address": "aa:bb:cc:dd:ee:03", "name": "Phone"}
+        watcher.update({car["address"]: car, other["address"]: other})
+        self.assertEqual(list(watcher.campaigns), [car["address"]])
+        self.assertEqual(watcher.queue.qsize(), 1)
+
+        session = BlueKit(handle_signals=False)
+        campaign = watcher.campaigns[car["address"]]
+        campaign.update(state="running", session=session)
+        watcher.update({})
+        self.assertEqual(campaign["state"], "running")
+        watcher.update({})
+        self.assertEqual(campaign["state"], "pausing")
+        self.assertTrue(session.pause_requested.is_set())
+        self.assertFalse(session.check_target(car["address"]))
+
+        campaign["state"] = "paused"
+        watcher.update({car["address"]: car})
+        self.assertEqual(campaign["state"], "queued")
+        self.assertEqual(watcher.queue.qsize(), 2)
+
+
+class TestHciMonitor(unittest.TestCase):
+    def test_capture_window_and_btsnoop(self):
+        monitor = hcimonitor.HciMonitor(ring_size=3)
+        monitor.unavailable = True  # no monitor channel, packets are added by hand
+        monitor.add(0, hcimonitor.MONITOR_COMMAND_PKT, b"before")
+        path = os.path.join(tempfile.mkdtemp(), "hci.btsnoop")
+        with monitor.capture(path) as packets:
+            # IO Capability Response of 11:22:33:44:55:66 with NoInputNoOutput
+            event = bytes([0x32, 9, 0x66, 0x55, 0x44, 0x33, 0x22, 0x11, 3, 0, 0])
+            monitor.add(1, hcimonitor.MONITOR_EVENT_PKT, event, timestamp=1.5)
+        self.assertEqual([packet[4] for packet in packets], [event])
+        self.assertEqual(
+            hcimonitor.get_io_capabilities(packets),
+            [("11:22:33:44:55:66", "NoInputNoOutput")],
+        )
+
+        with open(path, "rb") as f:
+            capture = f.read()
+        self.assertEqual(capture[:16], hcimonitor.BTSNOOP_HEADER)
+        length, _, flags, drops, timestamp = hcimonitor.BTSNOOP_RECORD.unpack_from(
+            capture, 16
+        )
+        self.assertEqual((length, flags, drops), (len(event), (1 << 16) | 3, 0))
+        self.assertEqual(timestamp - hcimonitor.BTSNOOP_EPOCH_DELTA, 1500000)
+
+        with monitor.capture() as packets:
+            for _ in range(5):
+                monitor.add(0, hcimonitor.MONITOR_EVENT_PKT, b"x")
+        self.assertEqual(len(packets), 3)  # the ring keeps the last 3
+
+    def test_capture_of_the_leased_controller(self):
+        monitor = hcimonitor.HciMonitor()
+        monitor.unavailable = True
+        with monitor.capture(index=1) as packets:
+            monitor.add(0, hcimonitor.MONITOR_EVENT_PKT, b"other campaign")
+            monitor.add(1, hcimonitor.MONITOR_EVENT_PKT, b"this exploit")
+        self.assertEqual([packet[4] for packet in packets], [b"this exploit"])
+
+        self.assertEqual(Engine.get_adapter("default"), "hci0")
+        self.assertEqual(Engine.get_adapter("hci1"), "hci1")
+        self.assertEqual(Engine.get_adapter("esp32"), "hci0")
+
+
+class TestDeviceStatus(unittest.TestCase):
+    def setUp(self):
+        patcher = unittest.mock.patch(
+            "bluekit.verifyconn.leases", LeaseManager(use_temporary_home(self))
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_controller_errors_are_failed_probes(self):
+        class Wedged:
+            def __init__(self, dev_id):
+                pass
+
+            def power_on(self):
+                raise OSError(110, "Connection timed out")
+
+        class Absent(Wedged):
+            def power_on(self):
+                pass
+
+            def scan(self, target):
+                return None
+
+            def connect(self, target):
+                return False
+
+        with unittest.mock.patch("bluekit.verifyconn.watchdog") as dog:
+            with unittest.mock.patch("bluekit.device.device_backend", Wedged):
+                self.assertEqual(
+                    verifyconn.check_device_status("aa:bb:cc:dd:ee:49"),
+                    verifyconn.RETVAL_CONTROLLER_ERROR,
+                )
+            dog.report.assert_called_once_with(DEFAULT_ADAPTER, False)
+
+            # An absent target is a working controller
+            with unittest.mock.patch("bluekit.device.device_backend", Absent):
+                self.assertEqual(
+                    verifyconn.check_device_status("aa:bb:cc:dd:ee:49"),
+                    verifyconn.RETVAL_TARGET_NOT_AVAILABLE,
+                )
+            dog.report.assert_called_with(DEFAULT_ADAPTER, True)
+
+            # A missing pybtool is a setup error, not a wedged controller
+            with unittest.mock.patch("bluekit.device.device_backend", None):
+                with self.assertRaisesRegex(Exception, "pybtool is not installed"):
+                    verifyconn.check_device_status("aa:bb:cc:dd:ee:49")
+            self.assertEqual(dog.report.call_count, 2)
+
+
+class TestEngineWatchdog(unittest.TestCase):
+    def run_exploit(self, output=b"", error=None):
+        engine = Engine()
+        exploit = Exploit(dict(test_data["exploit"], directory={"change": False}))
+        with unittest.mock.patch.object(
+            engine, "construct_exploit_command", return_value=[]
+        ), unittest.mock.patch.object(
+            engine, "check_pull_location"
+        ), unittest.mock.patch.object(
+            engine, "pull_information"
+        ), unittest.mock.patch.object(
+            engine, "lease_hardware", return_value=contextlib.nullcontext()
+        ), unittest.mock.patch.object(
+            engine, "execute_command", side_effect=error, return_value=(False, output)
+        ), unittest.mock.patch(
+            "bluekit.engine.engine.watchdog"
+        ) as dog:
+            code, _ = engine.run_test("aa:bb:cc:dd:ee:49", exploit, [])
+        dog.report.assert_called_once()
+        return code, dog.report.call_args[0]
+
+    def test_only_transport_errors_are_failures(self):
+        # Timing out without a verdict is what many targets that aren't vulnerable do
+        self.assertEqual(
+            self.run_exploit(), (RETURN_CODE_NONE_OF_4_STATE_OBSERVED, ("/dev/ttyUSB1", True))
+        )
+        output = b"could not open port /dev/ttyUSB1: [Errno 2] No such file or directory\n"
+        self.assertEqual(self.run_exploit(output)[1], ("/dev/ttyUSB1", False))
+        self.assertEqual(
+            self.run_exploit(error=OSError(12, "Cannot allocate memory")),
+            (RETURN_CODE_ERROR, ("/dev/ttyUSB1", False)),
+        )
+
+
+class TestAdapterWatchdog(unittest.TestCase):
+    def setUp(self):
+        # Recovery holds the resource's lease
+        patcher = unittest.mock.patch.object(
+            watchdog, "leases", LeaseManager(use_temporary_home(self))
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_board_is_recovered_after_repeated_failures(self):
+        steps = []
+
+        class Watchdog(watchdog.AdapterWatchdog):
+            def get_steps(self, resource):
+                return [("replug", lambda: steps.append(resource) or True)]
+
+        board = "/dev/ttyUSB9"
+        dog = Watchdog(threshold=2)
+        resets = metrics.adapter_resets.get()
+        with unittest.mock.patch.object(watchdog, "WATCHDOG_SETTLE_TIME", 0):
+            dog.report(board, False)
+            dog.report(board, True)  # a success starts the count over
+            dog.report(board, False)
+            self.assertEqual(steps, [])
+            dog.report(board, False)
+        self.assertEqual(steps, [board])
+        self.assertEqual(metrics.adapter_resets.get(), resets + 1)
+        dog.report("nexus5", False)  # nothing to recover for phones
+        self.assertNotIn("nexus5", dog.failures)
+
+
+class TestFailurePolicy(unittest.TestCase):
+    def test_parse_and_backoff(self):
+        policy = FailurePolicy.parse("retry:2:skip")
+        policy.backoff = 10
+        self.assertEqual(str(policy), "retry:2:skip")
+        self.assertEqual(policy.decide(1), ("retry", 10))
+        self.assertEqual(policy.decide(2), ("retry", 20))
+        self.assertEqual(policy.decide(3), ("skip", 0))
+        self.assertEqual(FailurePolicy.parse("park").decide(1), ("park", 0))
+        for spec in ("later", "skip:2", "retry:2:ask"):
+            with self.assertRaises(ValueError):
+                FailurePolicy.parse(spec)
+
+    def test_unavailable_target_is_skipped_without_prompt(self):
+        use_temporary_home(self, policy)
+        target = "aa:bb:cc:dd:ee:50"
+        events = policy.POLICY_EVENTS_FILE.format(target=target)
+        session = BlueKit(handle_signals=False)
+        session.failure_policy = FailurePolicy.parse("retry:1:skip")
+        session.failure_policy.backoff = 0
+        with unittest.mock.patch(
+            "bluekit.bluekit.check_device_status", return_value=0
+        ), unittest.mock.patch("builtins.input") as prompt:
+            self.assertFalse(session.check_target(target, "exploit"))
+        prompt.assert_not_called()
+        self.assertEqual(session.policy_decision, "skip")
+        with open(events) as f:
+            decisions = [json.loads(line) for line in f]
+        self.assertEqual([d["decision"] for d in decisions], ["retry", "skip"])
+        self.assertEqual(decisions[1]["exploit"], "exploit")
+
+    def test_unattended_defaults(self):
+        bluekit = BlueKit(handle_signals=False)
+        with unittest.mock.patch("sys.stdin.isatty", return_value=False):
+            # Nothing resumes a parked single target run
+            self.assertEqual(str(bluekit.get_failure_policy()), POLICY_UNATTENDED_SINGLE)
+            bluekit.failure_policy = FailurePolicy.parse("ask")
+            session = bluekit.new_target_session()
+        # Parallel sessions never prompt, even with --failurepolicy ask
+        with unittest.mock.patch("sys.stdin.isatty", return_value=True):
+            self.assertEqual(str(session.get_failure_policy()), POLICY_UNATTENDED)
+            self.assertEqual(str(bluekit.get_failure_policy()), "ask")
+
+
 unittest.main()
@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from tabulate import tabulate
+
+from bluekit.constants import TRACE_FILE
+
+# The trace of the campaign running in this thread, parallel target sessions
+# each run in their own thread and write their own file
+current = threading.local()
+
+
+class Trace:
+    """
+    Spans of one campaign as Chrome trace events, the file opens in
+    chrome://tracing and ui.perfetto.dev.
+    """
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.pid = os.getpid()
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": 0,
+                "args": {"name": name},
+            }
+        ]
+
+    def add_span(
+        self, name: str, category: str, start: float, end: float, args: dict
+    ) -> None:
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.started) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def save(self) -> None:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}"
+        with self.lock, open(temp_path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        os.replace(temp_path, self.path)
+
+
+@contextmanager
+def trace_campaign(target: str, enabled: bool = True, path: str = None):
+    if not enabled:
+        yield None
+        return
+    if path is None:
+        path = TRACE_FILE.format(
+            target=target, timestamp=time.strftime("%Y%m%d-%H%M%S")
+        )
+    previous = getattr(current, "trace", None)
+    trace = Trace(path, f"bluekit {target}")
+    current.trace = trace
+    try:
+        with span("campaign", "campaign", target=target):
+            yield trace
+    finally:
+        current.trace = previous
+        trace.save()
+        logging.info(f"trace_campaign -> trace saved to {path}")
+        print(f"Trace saved to {path}")
+
+
+@contextmanager
+def span(name: str, category: str = "phase", **args):
+    """
+    Records the enclosed block in the campaign trace of this thread, if any.
+    The yielded dict can be updated with results known only at the end.
+    """
+    trace = getattr(current, "trace", None)
+    if trace is None:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        trace.add_span(name, category, start, time.perf_counter(), args)
+
+
+def load_trace(path: str) -> list:
+    with open(path) as f:
+        doc = json.load(f)
+    events = doc["traceEvents"] if isinstance(doc, dict) else doc
+    return [event for event in events if event.get("ph") == "X"]
+
+
+def summarize(events: list) -> list:
+    """
+    Totals per span name. Self time excludes nested spans, so the phases
+    that actually took the time come first instead of their parents.
+    """
+    totals = {}
+    for event in events:
+        entry = totals.setdefault(
+            event["name"],
+            {"name": event["name"], "category": event.get("cat"), "count": 0},
+        )
+        entry["count"] += 1
+        entry["total"] = entry.get("total", 0) + event["dur"]
+        entry["self"] = entry.get("self", 0) + event["dur"]
+
+    by_thread = {}
+    for event in events:
+        by_thread.setdefault(event["tid"], []).append(event)
+    for thread_events in by_thread.values():
+        stack = []
+        for event in sorted(thread_events, key=lambda e: (e["ts"], -e["dur"])):
+            while stack and stack[-1]["ts"] + stack[-1]["dur"] <= event["ts"]:
+                stack.pop()
+            if stack:
+                totals[stack[-1]["name"]]["self"] -= event["dur"]
+            stack.append(event)
+
+    return sorted(totals.values(), key=lambda entry: entry["self"], reverse=True)
+
+
+def print_trace_summary(path: str, top: int = 20) -> None:
+    events = load_trace(path)
+    if len(events) == 0:
+        print(f"No spans in {path}")
+        return
+    wall_time = max(e["ts"] + e["dur"] for e in events) - min(e["ts"] for e in events)
+    table_data = [
+        [
+            entry["name"],
+            entry["category"],
+            entry["count"],
+            f"{entry['self'] / 1e6:.2f}",
+            f"{entry['total'] / 1e6:.2f}",
+            f"{entry['total'] / 1e6 / entry['count']:.3f}",
+            f"{100 * entry['self'] / wall_time:.1f}",
+        ]
+        for entry in summarize(events)[:top]
+    ]
+    print(f"Top time sinks of {path} ({wall_time / 1e6:.1f} s):\n")
+    print(
+        tabulate(
+            table_data,
+            [
+                "Span",
+                "Category",
+                "Count",
+                "Self (s)",
+                "Total (s)",
+                "Mean (s)",
+                "Self %",
+            ],
+            tablefmt="pretty",
+            colalign=("left", "left"),
+        )
+    )
@@ -1,7 +1,9 @@
 import subprocess
 import argparse
+import logging
 import re
 import os
+import time
 from pathlib import Path
 
 from bluekit.constants import (
@@ -18,8 +20,12 @@ from bluekit.constants import (
     RETURN_CODE_UNDEFINED,
     RETURN_CODE_VULNERABLE,
 )
-from bluekit.constants import OUTPUT_DIRECTORY
-from pybtool.device import Device
+from bluekit.constants import OUTPUT_DIRECTORY, DEFAULT_ADAPTER
+from bluekit.lease import leases
+from bluekit.device import DEVICE_ERRORS, new_device
+from bluekit.tracing import span
+from bluekit.watchdog import watchdog
+from bluekit import metrics
 
 RETVAL_TARGET_NOT_AVAILABLE = 0
 RETVAL_TARGET_CONN_ONLY = 1
@@ -27,6 +33,7 @@ RETVAL_TARGET_PAIRABLE = 2
 RETVAL_TARGET_ADV_ONLY = 3
 RETVAL_TARGET_ADV_CONN = 4
 RETVAL_TARGET_ADV_CONN_PAIRABLE = 5
+RETVAL_CONTROLLER_ERROR = -1  # the local controller failed, says nothing of the target
 
 
 def check_device_status(target: str) -> int:
@@ -40,44 +47,69 @@ def check_device_status(target: str) -> int:
             3: Found, not connectable
             4: Found, connectable, not pairable
             5: Found, connectable, pairable
+           -1: The local controller failed, see RETVAL_CONTROLLER_ERROR
     """
-    # Initialize the device, default dev ID is 0
-    dev = Device()
-    dev.power_on()
+    with leases.lease(DEFAULT_ADAPTER):
+        start = time.monotonic()
+        try:
+            status = probe_device_status(target)
+        except DEVICE_ERRORS as e:  # the controller didn't answer, left to the watchdog
+            logging.warning("check_device_status -> %s failed - %s", DEFAULT_ADAPTER, e)
+            status = RETVAL_CONTROLLER_ERROR
+        metrics.liveness_probe_seconds.observe(time.monotonic() - start, status=status)
+        watchdog.report(DEFAULT_ADAPTER, status != RETVAL_CONTROLLER_ERROR)
+        return status
 
-    scan_success = dev.scan(target=target)
-    connect_success = dev.connect(target)
 
-    if not connect_success:
-        return 0 if not scan_success else 3
+def probe_device_status(target: str) -> int:
+    with span("check_device_status") as args:
+        # Initialize the device, default dev ID is 0
+        dev = new_device()
+        dev.power_on()
 
-    pair_success = dev.pair()
+        with span("scan"):
+            scan_success = dev.scan(target=target)
+        with span("connect"):
+            connect_success = dev.connect(target)
+        args["scan"] = scan_success is not None
+        args["connect"] = connect_success
 
-    if not pair_success:
-        return 1 if not scan_success else 4
+        if not connect_success:
+            return 0 if not scan_success else 3
 
-    dev.disconnect()
-    dev.power_off()
+        with span("pair"):
+            pair_success, _ = dev.pair()
+        args["pair"] = pair_success
 
-    return 2 if not scan_success else 5
+        if not pair_success:
+            return 1 if not scan_success else 4
+
+        dev.disconnect()
+        dev.power_off()
+
+        return 2 if not scan_success else 5
 
 
 def dos_checker(target: str):
     try:
-        not_available = 0
-        while True:
-            # for i in range(NUMBER_OF_DOS_TESTS):
-            status = check_device_status(target)
-            if status in (1, 2, 4, 5):  # Connectable and/or pairable
-                return RETURN_CODE_NOT_VULNERABLE, str(not_available)
-
-            not_available += 1
-
-            if (
-                not_available > MAX_NUMBER_OF_DOS_TEST_TO_FAIL
-                or not_available > NUMBER_OF_DOS_TESTS
-            ):
-                return RETURN_CODE_VULNERABLE, str(not_available)
+        with leases.lease(DEFAULT_ADAPTER), span("dos_checker"):
+            not_available = 0
+            while True:
+                # for i in range(NUMBER_OF_DOS_TESTS):
+                status = check_device_status(target)
+                if status in (1, 2, 4, 5):  # Connectable and/or pairable
+                    return RETURN_CODE_NOT_VULNERABLE, str(not_available)
+                if status == RETVAL_CONTROLLER_ERROR:
+                    # Says nothing about the target, the watchdog handles the controller
+                    return RETURN_CODE_ERROR, "the local controller didn't answer"
+
+                not_available += 1
+
+                if (
+                    not_available > MAX_NUMBER_OF_DOS_TEST_TO_FAIL
+                    or not_available > NUMBER_OF_DOS_TESTS
+                ):
+                    return RETURN_CODE_VULNERABLE, str(not_available)
     except Exception as e:
         return RETURN_CODE_ERROR, str(e)
 
@@ -0,0 +1,147 @@
+import fnmatch
+import logging
+import os
+import queue
+import threading
+import time
+
+from bluekit.constants import (
+    WATCH_ABSENT_SWEEPS,
+    WATCH_SWEEP_DURATION,
+    WATCH_SWEEP_INTERVAL,
+)
+from bluekit.discovery import Discovery
+from bluekit.policy import NEXT
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSING = "pausing"  # asked to stop after the current exploit
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+
+
+def load_patterns(patterns: list) -> list:
+    """Address or name patterns like aa:bb:cc:*, or files with one per line"""
+    loaded = []
+    for pattern in patterns:
+        if os.path.isfile(pattern):
+            with open(pattern) as f:
+                for line in f:
+                    line = line.split("#")[0].strip()
+                    if line:
+                        loaded.append(line.lower())
+        else:
+            loaded.append(pattern.lower())
+    return loaded
+
+
+class Watcher:
+    """
+    Sweeps for devices over and over and queues a campaign for every device
+    matching the allowlist as soon as it shows up. A campaign whose device
+    is missing for WATCH_ABSENT_SWEEPS sweeps, or parked by the failure
+    policy, is paused into its checkpoint and resumed from it when the
+    device is back.
+    """
+
+    def __init__(
+        self,
+        bluekit,
+        patterns: list,
+        parameters: list,
+        discovery: Discovery = None,
+        workers: int = None,
+    ):
+        self.bluekit = bluekit
+        self.patterns = load_patterns(patterns)
+        self.parameters = parameters
+        self.discovery = discovery or Discovery()
+        self.workers = workers or len(self.discovery.controllers)
+        self.campaigns = {}  # address -> {"state", "session", "started", "missed"}
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+
+    def matches(self, entry: dict) -> bool:
+        names = [entry["address"], (entry.get("name") or "").lower()]
+        return any(
+            fnmatch.fnmatchcase(name, pattern)
+            for pattern in self.patterns
+            for name in names
+        )
+
+    def run(self, sweeps: int = None) -> None:
+        for _ in range(self.workers):
+            threading.Thread(target=self.run_campaigns, daemon=True).start()
+        print(f"Watching for {', '.join(self.patterns)}")
+        done = 0
+        while sweeps is None or done < sweeps:
+            # Controllers busy with a campaign aren't swept, absence then shows in check_target
+            devices = self.discovery.sweep(WATCH_SWEEP_DURATION, wait=False)
+            if len(self.discovery.swept) > 0:
+                self.update(devices)
+            done += 1
+            time.sleep(WATCH_SWEEP_INTERVAL)
+
+    def update(self, devices: dict) -> None:
+        with self.lock:
+            for address, entry in devices.items():
+                if not self.matches(entry):
+                    continue
+                campaign = self.campaigns.get(address)
+                if campaign is None:
+                    print(f"{address} in range, campaign queued")
+                    campaign = {"state": QUEUED, "session": None, "started": False}
+                    self.campaigns[address] = campaign
+                    self.queue.put(address)
+                elif campaign["state"] == PAUSED:
+                    print(f"{address} back in range, campaign queued again")
+                    campaign["state"] = QUEUED
+                    self.queue.put(address)
+                campaign["missed"] = 0
+
+            for address, campaign in self.campaigns.items():
+                if address in devices or campaign["state"] not in (QUEUED, RUNNING):
+                    continue
+                campaign["missed"] += 1
+                if campaign["missed"] < WATCH_ABSENT_SWEEPS:
+                    continue
+                print(f"{address} out of range, pausing its campaign")
+                if campaign["state"] == RUNNING:
+                    campaign["state"] = PAUSING
+                    campaign["session"].pause_requested.set()
+                else:
+                    campaign["state"] = PAUSED  # not started, skipped when dequeued
+
+    def run_campaigns(self) -> None:
+        while True:
+            address = self.queue.get()
+            with self.lock:
+                campaign = self.campaigns[address]
+                if campaign["state"] != QUEUED:
+                    continue
+                campaign["state"] = RUNNING
+                session = self.bluekit.new_target_session()
+                campaign["session"] = session
+                resume = campaign["started"]
+                campaign["started"] = True
+            try:
+                if resume:
+                    session.start_from_a_checkpoint(address)
+                else:
+                    session.start_from_cli_all(address, list(self.parameters))
+                # next gives the target up, it isn't resumed when back in range
+                if session.paused and session.policy_decision != NEXT:
+                    state = PAUSED
+                else:
+                    state = DONE
+            # sys.exit() in a session stops only its campaign
+            except BaseException as e:
+                logging.exception("Watcher.run_campaigns -> %s stopped", address)
+                print(f"Testing {address} stopped - {e!r}")
+                state = FAILED
+            with self.lock:
+                campaign["state"] = state
+                campaign["session"] = None
+                self.bluekit.target_sessions.remove(session)
+            print(f"Campaign for {address} {state}")
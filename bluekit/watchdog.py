@@ -0,0 +1,147 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+from bluekit.constants import (
+    BTMGMT_INFO,
+    BTMGMT_POWER,
+    HCICONFIG_RESET,
+    WATCHDOG_COMMAND_TIMEOUT,
+    WATCHDOG_FAILURE_THRESHOLD,
+    WATCHDOG_SETTLE_TIME,
+)
+from bluekit.lease import leases
+from bluekit.setupverfication.hardwarepool import get_usb_device, get_usb_parent
+from bluekit import metrics
+
+ADAPTER = re.compile(r"hci(\d+)$")
+
+
+def run_step(command: str) -> bool:
+    try:
+        result = subprocess.run(
+            command, shell=True, capture_output=True, timeout=WATCHDOG_COMMAND_TIMEOUT
+        )
+    except subprocess.TimeoutExpired:
+        return False
+    return result.returncode == 0
+
+
+def reauthorize_usb(device) -> bool:
+    """Drops the USB device and lets the kernel enumerate it again"""
+    if device is None:
+        return False
+    try:
+        for value in ("0", "1"):
+            with open(os.path.join(device, "authorized"), "w") as f:
+                f.write(value)
+            time.sleep(1)
+    except OSError as e:
+        logging.warning("reauthorize_usb -> %s - %s", device, e)
+        return False
+    return True
+
+
+def is_adapter_responsive(adapter: str) -> bool:
+    if shutil.which("btmgmt") is None:
+        return True  # no way to tell, better than resetting blindly
+    index = ADAPTER.match(adapter).group(1)
+    try:
+        output = subprocess.run(
+            BTMGMT_INFO.format(index=index),
+            shell=True,
+            capture_output=True,
+            timeout=WATCHDOG_COMMAND_TIMEOUT,
+        ).stdout.decode(errors="replace")
+    except subprocess.TimeoutExpired:
+        return False
+    for line in output.split("\n"):
+        if line.strip().startswith("current settings:"):
+            return "powered" in line.split()
+    return False
+
+
+class AdapterWatchdog:
+    """
+    Counts consecutive failures per controller (hci0) or board (/dev/ttyUSB1).
+    At WATCHDOG_FAILURE_THRESHOLD a controller is checked first, a target
+    out of range fails the same way as a wedged controller. An unresponsive
+    controller is reset, then power cycled, then re-enumerated on USB until
+    it answers again; a board has no health check and is re-enumerated.
+    """
+
+    def __init__(self, threshold: int = WATCHDOG_FAILURE_THRESHOLD):
+        self.threshold = threshold
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_recoverable(resource: str) -> bool:
+        return ADAPTER.match(resource) is not None or resource.startswith("/dev/tty")
+
+    def report(self, resource: str, ok: bool) -> None:
+        if not self.is_recoverable(resource):
+            return
+        with self.lock:
+            if ok:
+                self.failures.pop(resource, None)
+                return
+            self.failures[resource] = self.failures.get(resource, 0) + 1
+            if self.failures[resource] < self.threshold:
+                return
+            self.failures.pop(resource)
+        with leases.lease(resource):
+            self.recover(resource)
+
+    def get_steps(self, resource: str) -> list:
+        match = ADAPTER.match(resource)
+        if match is not None:
+            index = match.group(1)
+            return [
+                ("reset", lambda: run_step(HCICONFIG_RESET.format(adapter=resource))),
+                (
+                    "power cycle",
+                    lambda: run_step(BTMGMT_POWER.format(index=index, state="off"))
+                    and run_step(BTMGMT_POWER.format(index=index, state="on")),
+                ),
+                (
+                    "USB re-enumeration",
+                    lambda: reauthorize_usb(
+                        get_usb_device(f"/sys/class/bluetooth/{resource}/device")
+                    ),
+                ),
+            ]
+        return [
+            (
+                "USB re-enumeration",
+                lambda: reauthorize_usb(get_usb_parent(resource)),
+            )
+        ]
+
+    def recover(self, resource: str) -> bool:
+        is_adapter = ADAPTER.match(resource) is not None
+        if is_adapter and is_adapter_responsive(resource):
+            logging.info("AdapterWatchdog.recover -> %s is responsive", resource)
+            return True
+        for name, step in self.get_steps(resource):
+            print(f"{resource} is not responding, trying {name}")
+            done = step()
+            time.sleep(WATCHDOG_SETTLE_TIME)
+            # Boards have no health check, a step that went through has to do
+            if is_adapter_responsive(resource) if is_adapter else done:
+                print(f"{resource} recovered by {name}")
+                metrics.adapter_resets.inc()
+                return True
+            logging.warning(
+                "AdapterWatchdog.recover -> %s failed for %s", name, resource
+            )
+        print(f"{resource} could not be recovered")
+        return False
+
+
+# Shared by verifyconn and the engine of this process
+watchdog = AdapterWatchdog()